@@ -0,0 +1,65 @@
+"""memory held by a listing cache of FileItem models vs FileEntry
+
+run from the repo root: python -m bench.bench_file_entry_memory -n 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from store.aliyun._entry import FileEntry
+from store.backend.aliyun import FileItem
+
+
+def make_items(n: int) -> list[FileItem]:
+    """api items of `n` photos spread over 1000 folders"""
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        FileItem(
+            drive_id="1",
+            file_id=f"{i:040x}",
+            parent_file_id=f"{i % 1000:040x}",
+            name=f"IMG_{i:07}.jpg",
+            type="file",
+            size=1024 * 1024 + i,
+            file_extension="jpg",
+            category="image",
+            content_hash=f"{i:040X}",
+            created_at=now + timedelta(seconds=i),
+            updated_at=now + timedelta(seconds=i),
+        )
+        for i in range(n)
+    ]
+
+
+def measure(name: str, build: Callable[[], list]):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = build()
+    cost = time.perf_counter() - start
+    # retained memory, temporaries of the build are freed by now
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>10}: {size / 2**20:8.1f} MiB, {size / len(res):6.0f} B/entry, built in {cost:.1f}s"
+    )
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=1_000_000, help="number of entries")
+    args = parser.parse_args()
+
+    items = measure("FileItem", lambda: make_items(args.n))
+    del items
+    # the api items are dropped once converted, as in the listing cache
+    measure("FileEntry", lambda: list(map(FileEntry.from_item, make_items(args.n))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""compare the listdir response serialization before and after orjson
+
+run from the repo root: python -m bench.bench_listdir_serialize -n 5000
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse as StarletteJSONResponse
+
+from handler.response import JSONResponse
+from store.aliyun._store import AliyunPath
+from store.backend.aliyun import FileItem
+
+
+def make_files(n: int) -> list[AliyunPath]:
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        AliyunPath(
+            "/root/photos",
+            f"IMG_{i:05}.jpg",
+            file_item=FileItem(
+                drive_id="1",
+                file_id=f"{i:040x}",
+                parent_file_id="p",
+                name=f"IMG_{i:05}.jpg",
+                type="file",
+                size=1024 * 1024 + i,
+                file_extension="jpg",
+                category="image",
+                thumbnail=f"https://thumbnail.example.com/{i}?x-oss-process=image/resize,w_512",
+                created_at=now + timedelta(seconds=i),
+                updated_at=now + timedelta(seconds=i),
+            ),
+            # serializing never touches the store
+            _store=None,  # type: ignore
+        )
+        for i in range(n)
+    ]
+
+
+def old_path(files: list[AliyunPath]) -> bytes:
+    """model per item, dumped to json types, then fastapi's encoder and json.dumps"""
+    content = [it.to_model().model_dump(mode="json", by_alias=True) for it in files]
+    return StarletteJSONResponse(jsonable_encoder(content)).body
+
+
+def new_path(files: list[AliyunPath]) -> bytes:
+    return JSONResponse([it.to_dict() for it in files]).body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=5000, help="items in the folder")
+    parser.add_argument("-r", "--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    files = make_files(args.n)
+    assert json.loads(old_path(files)) == json.loads(new_path(files))
+    for name, func in (("old", old_path), ("new", new_path)):
+        best = min(timeit.repeat(lambda: func(files), number=1, repeat=args.repeat))
+        print(f"{name}: {best * 1000:8.2f} ms for {args.n} items")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""load the fastapi app backed by the mock aliyun server, report throughput and latency
+
+run from the repo root: python -m bench.bench_load -c 32 -n 2000 --latency 0.05 --rate 20
+main is imported, so a config.yaml must exist (its store section is not used)
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import tempfile
+import time
+from collections import Counter
+from typing import Callable
+
+import httpx
+
+from config import (
+    AliyunCacheConfig,
+    AliyunConfig,
+    AliyunHttpConfig,
+    RateLimitConfig,
+    StoreConfig,
+)
+from main import app
+from store import store_manager
+from store.backend.aliyun.test.mock_server import MockAliyunServer, MockDrive
+
+# method, url, params, headers
+Request = tuple[str, str, dict, dict]
+
+
+def make_scenarios(drive: MockDrive) -> dict[str, Callable[[random.Random], Request]]:
+    dirs = ["/root"] + [
+        "/root" + it.path for it in drive.files.values() if it.type == "folder"
+    ]
+    files = ["/root" + it.path for it in drive.files.values() if it.type == "file"]
+
+    def listdir(rnd: random.Random) -> Request:
+        return "GET", "/file/listdir", {"parentPath": rnd.choice(dirs)}, {}
+
+    def listdir_page(rnd: random.Random) -> Request:
+        params = {"parentPath": rnd.choice(dirs), "limit": 50}
+        return "GET", "/file/listdir", params, {}
+
+    def search(rnd: random.Random) -> Request:
+        params = {"q": f"IMG_{rnd.randrange(len(drive.files) // 100):05}", "limit": 50}
+        return "GET", "/file/search", params, {}
+
+    def thumbnail(rnd: random.Random) -> Request:
+        return "GET", "/file/thumbnail", {"path": rnd.choice(files)}, {}
+
+    def content(rnd: random.Random) -> Request:
+        headers = {"Range": "bytes=0-16383"}
+        return "GET", "/file/content", {"path": rnd.choice(files)}, headers
+
+    scenarios = {
+        "listdir": listdir,
+        "listdir-page": listdir_page,
+        "search": search,
+        "thumbnail": thumbnail,
+        "content": content,
+    }
+    weighted = [listdir] * 5 + [thumbnail] * 3 + [content, search]
+
+    def mixed(rnd: random.Random) -> Request:
+        return rnd.choice(weighted)(rnd)
+
+    scenarios["mixed"] = mixed
+    return scenarios
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return math.nan
+    return sorted_values[max(math.ceil(q * len(sorted_values)) - 1, 0)]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    make_request: Callable[[random.Random], Request],
+    total: int,
+    concurrency: int,
+    seed: int,
+) -> tuple[list[float], Counter[int], float]:
+    """latencies in seconds, count of each status code, wall time"""
+    rnd = random.Random(seed)
+    requests = [make_request(rnd) for _ in range(total)]
+    latencies: list[float] = []
+    statuses: Counter[int] = Counter()
+
+    async def worker():
+        while requests:
+            method, url, params, headers = requests.pop()
+            start = time.perf_counter()
+            try:
+                resp = await client.request(method, url, params=params, headers=headers)
+                statuses[resp.status_code] += 1
+            except httpx.HTTPError:
+                statuses[0] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace):
+    server = MockAliyunServer(
+        MockDrive(args.depth, args.dirs, args.files),
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=(args.rate, args.burst) if args.rate else None,
+    )
+    url = await server.start()
+    tmp = tempfile.TemporaryDirectory()
+    await store_manager.setup(
+        StoreConfig(
+            use="aliyun",
+            aliyun=AliyunConfig(
+                refresh_token="mock-refresh-" + "0" * 20,
+                client_id="bench",
+                client_secret="bench",
+                http=AliyunHttpConfig(
+                    base_url=url,
+                    rate_limit=RateLimitConfig(
+                        rate=args.client_rate, burst=args.client_burst
+                    ),
+                ),
+                cache=AliyunCacheConfig(index_path=":memory:", thumbnail_dir=tmp.name),
+            ),
+        )
+    )
+    scenarios = make_scenarios(server.drive)
+    names = list(scenarios) if args.scenario == "all" else [args.scenario]
+    print(
+        f"{len(server.drive.files)} files, concurrency {args.concurrency}, "
+        f"mock latency {args.latency * 1000:.0f}ms, mock rate {args.rate or 'unlimited'}"
+    )
+    print(
+        f"{'scenario':>13} {'requests':>8} {'errors':>6} {'req/s':>8} "
+        f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'api calls':>9}"
+    )
+    transport = httpx.ASGITransport(app=app)  # type: ignore
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client:
+            for i, name in enumerate(names):
+                calls = sum(server.calls.values())
+                latencies, statuses, wall = await run_scenario(
+                    client,
+                    scenarios[name],
+                    args.requests,
+                    args.concurrency,
+                    args.seed + i,
+                )
+                latencies.sort()
+                errors = sum(v for k, v in statuses.items() if not 200 <= k < 400)
+                print(
+                    f"{name:>13} {len(latencies):>8} {errors:>6} "
+                    f"{len(latencies) / wall:>8.1f} "
+                    f"{percentile(latencies, 0.5) * 1000:>8.1f} "
+                    f"{percentile(latencies, 0.99) * 1000:>8.1f} "
+                    f"{latencies[-1] * 1000:>8.1f} "
+                    f"{sum(server.calls.values()) - calls:>9}"
+                )
+    finally:
+        await store_manager.dispose()
+        await server.close()
+        tmp.cleanup()
+    print(f"throttled by the mock: {server.throttled}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scenario",
+        default="all",
+        choices=[
+            "all",
+            "listdir",
+            "listdir-page",
+            "search",
+            "thumbnail",
+            "content",
+            "mixed",
+        ],
+    )
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-n", "--requests", type=int, default=1000, help="per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--dirs", type=int, default=10, help="folders per folder")
+    parser.add_argument("--files", type=int, default=100, help="files per folder")
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="mock seconds per call"
+    )
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="mock calls per second, 0 for no limit"
+    )
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument(
+        "--client-rate", type=float, default=20, help="store rate limit"
+    )
+    parser.add_argument("--client-burst", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,13 @@
-from ._base import get_global_config, AliyunConfig, save_config
+from ._base import (
+    get_global_config,
+    AliyunConfig,
+    AliyunCacheConfig,
+    AliyunHttpConfig,
+    AliyunUploadConfig,
+    ImagingConfig,
+    RateLimitConfig,
+    StoreConfig,
+    save_config,
+)
 
 global_config = get_global_config()
@@ -11,11 +11,124 @@ from typing import Annotated, Optional
 CONFIG_PATH = "./config.yaml"
 
 
+class RateLimitConfig(BaseModel):
+    rate: Annotated[float, Field(gt=0, description="requests per second")]
+    burst: Annotated[int, Field(gt=0)]
+
+
+class AliyunHttpConfig(BaseModel):
+    base_url: str = "https://openapi.alipan.com"
+    limit: Annotated[int, Field(ge=0)] = 100
+    limit_per_host: Annotated[int, Field(ge=0)] = 32
+    keepalive_timeout: Annotated[float, Field(gt=0)] = 30
+    dns_cache_ttl: Annotated[int, Field(ge=0)] = 300
+    # total seconds of an open api request
+    timeout: Annotated[float, Field(gt=0)] = 60
+    # file transfers (content, uploads) have no total limit, only these: seconds to
+    # connect, and seconds a read may wait for the next bytes
+    transfer_connect_timeout: Annotated[float, Field(gt=0)] = 30
+    transfer_read_timeout: Annotated[float, Field(gt=0)] = 60
+    # file content proxy: bytes per chunk, and chunks buffered ahead of the reader
+    stream_chunk_size: Annotated[int, Field(gt=0)] = 256 * 1024
+    stream_read_ahead: Annotated[int, Field(gt=0)] = 8
+    # files (or ranges) from this size on are fetched as `download_segment_size` ranges
+    # over up to `download_connections` connections at once, 0 to always use one connection
+    download_segmented_min_size: Annotated[int, Field(ge=0)] = 16 * 1024 * 1024
+    download_segment_size: Annotated[int, Field(gt=0)] = 4 * 1024 * 1024
+    download_connections: Annotated[int, Field(gt=0)] = 4
+    rate_limit: RateLimitConfig = RateLimitConfig(rate=20, burst=20)
+    # own limits of some api paths, eg: {"/adrive/v1.0/openFile/getDownloadUrl": {rate: 10, burst: 10}}
+    endpoint_rate_limits: dict[str, RateLimitConfig] = {}
+    # retries of a TooManyRequests response
+    max_retries: Annotated[int, Field(ge=0)] = 4
+
+
+class AliyunCacheConfig(BaseModel):
+    listing_maxsize: Annotated[int, Field(gt=0)] = 1024
+    listing_fresh_ttl: Annotated[float, Field(ge=0)] = 30
+    listing_stale_ttl: Annotated[float, Field(ge=0)] = 60 * 10
+    # ids of resolved paths, lookups of uncached paths start from their deepest cached ancestor
+    path_cache_maxsize: Annotated[int, Field(gt=0)] = 100_000
+    path_cache_ttl: Annotated[float, Field(gt=0)] = 60 * 10
+    # sqlite file of the persistent path index, ":memory:" to keep it in memory only
+    index_path: str = "./data/aliyun/index.db"
+    # seconds a path <-> id entry of the index is trusted after the drive last confirmed it
+    index_max_age: Annotated[float, Field(gt=0)] = 60 * 60 * 24
+    download_url_maxsize: Annotated[int, Field(gt=0)] = 4096
+    # seconds before `expiration` a cached download url is dropped
+    download_url_margin: Annotated[float, Field(ge=0)] = 60
+    thumbnail_dir: str = "./data/aliyun/thumbnails"
+    thumbnail_max_bytes: Annotated[int, Field(gt=0)] = 512 * 1024 * 1024
+
+
+class AliyunCrawlerConfig(BaseModel):
+    # walk the whole drive in background and keep its metadata in the file index,
+    # without it search falls back to the api and the timeline only knows browsed dirs
+    enabled: bool = False
+    concurrency: Annotated[int, Field(gt=0)] = 4
+    # seconds between two crawls
+    interval: Annotated[float, Field(gt=0)] = 60 * 60
+    # seconds a dir listing in the index is trusted, both by the crawler and by listdir
+    max_age: Annotated[float, Field(gt=0)] = 60 * 60 * 24
+
+
+class AliyunUploadConfig(BaseModel):
+    # bytes per part, raised for files that would need more parts than the drive takes
+    part_size: Annotated[int, Field(gt=0)] = 10 * 1024 * 1024
+    # parts of one upload sent at the same time
+    concurrency: Annotated[int, Field(gt=0)] = 4
+    # seconds an interrupted upload can be resumed
+    resume_ttl: Annotated[float, Field(gt=0)] = 60 * 60 * 24
+
+
 class AliyunConfig(BaseModel):
     refresh_token: Annotated[str, Field(min_length=20)]
     access_token: Optional[str] = None
+    # wall clock time the access token expires at, a token of unknown lifetime is replaced at startup
+    access_token_expires_at: Optional[float] = None
     client_id: str
     client_secret: str
+    http: AliyunHttpConfig = AliyunHttpConfig()
+    cache: AliyunCacheConfig = AliyunCacheConfig()
+    crawler: AliyunCrawlerConfig = AliyunCrawlerConfig()
+    upload: AliyunUploadConfig = AliyunUploadConfig()
+    # seconds before expiry the access token is refreshed in background
+    token_refresh_margin: Annotated[float, Field(ge=0)] = 60 * 5
+
+
+class TracingConfig(BaseModel):
+    enabled: bool = False
+    # finished spans are appended to this file, one json object per line
+    jsonl_path: str = "./data/traces.jsonl"
+    # fraction of requests traced
+    sample_ratio: Annotated[float, Field(ge=0, le=1)] = 1.0
+
+
+class UploadConfig(BaseModel):
+    # request bodies are kept in memory up to this size, then spooled to a file
+    spool_max_memory: Annotated[int, Field(ge=0)] = 16 * 1024 * 1024
+    # dir of the spool files, the system temp dir by default
+    spool_dir: Optional[str] = None
+    # largest accepted upload in bytes, 0 for no limit
+    max_size: Annotated[int, Field(ge=0)] = 0
+
+
+class ImagingConfig(BaseModel):
+    # processes decoding and encoding images, the cpu count by default
+    workers: Optional[Annotated[int, Field(gt=0)]] = None
+    # rendition widths, a requested width is rounded up to the next one
+    widths: list[Annotated[int, Field(gt=0)]] = [256, 512, 1024, 2048]
+    cache_dir: str = "./data/derivatives"
+    cache_max_bytes: Annotated[int, Field(gt=0)] = 1024 * 1024 * 1024
+    # originals downloaded for processing, kept for the next renditions
+    source_dir: str = "./data/originals"
+    source_max_bytes: Annotated[int, Field(gt=0)] = 2 * 1024 * 1024 * 1024
+    # larger originals are not processed
+    max_source_size: Annotated[int, Field(gt=0)] = 64 * 1024 * 1024
+    # width edit previews are rendered at
+    preview_width: Annotated[int, Field(gt=0)] = 1280
+    # intermediate frames of edit chains kept by each process
+    edit_memo_bytes: Annotated[int, Field(gt=0)] = 256 * 1024 * 1024
 
 
 class StoreConfig(BaseModel):
@@ -25,6 +138,9 @@ class StoreConfig(BaseModel):
 
 class Config(BaseModel):
     store: StoreConfig
+    tracing: TracingConfig = TracingConfig()
+    upload: UploadConfig = UploadConfig()
+    imaging: ImagingConfig = ImagingConfig()
 
 
 _config: Optional[Config] = None
@@ -0,0 +1,41 @@
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel, Field
+
+from imaging import DerivativeFormat, EditOp, ImageError, imaging_manager
+from store import store_manager
+
+from .image import cached_file_response
+
+edit_api = APIRouter(prefix="/edit")
+
+
+class RenderReq(BaseModel):
+    path: str
+    ops: list[EditOp] = Field(max_length=32)
+    # render at most `imaging.preview_width` wide, for interactive editing
+    preview: bool = False
+    format: DerivativeFormat = "jpeg"
+    quality: int = Field(90, ge=1, le=100)
+
+
+@edit_api.post("/render")
+async def render(
+    req: RenderReq, if_none_match: Annotated[Optional[str], Header()] = None
+):
+    """the source with the ops applied in order, intermediate results are reused across requests"""
+    try:
+        cached = await imaging_manager.engine.edit(
+            store_manager.store,
+            req.path,
+            req.ops,
+            req.preview,
+            req.format,
+            req.quality,
+        )
+    except ImageError as e:
+        raise HTTPException(415, str(e))
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(404, str(e))
+    return cached_file_response(cached, if_none_match)
@@ -1,10 +1,282 @@
-from fastapi import APIRouter
+from typing import Annotated, Literal, Optional
+from mimetypes import guess_type
+from datetime import datetime
+from urllib.parse import quote
+import asyncio
+import time
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from config import global_config
 from store import store_manager
+from store.archive import stream_zip
+from store.base import SearchQuery
+from store.utils import UploadBuffer
+
+from .response import JSONResponse, dumps
 
 file_api = APIRouter(prefix="/file")
 
 
 @file_api.get("/listdir")
-async def listdir(parentPath: str):
-    files = await store_manager.store.listdir(parentPath)
-    return [it.to_model().model_dump(mode="json", by_alias=True) for it in files]
+async def listdir(
+    parentPath: str,
+    cursor: Optional[str] = None,
+    limit: Annotated[Optional[int], Query(gt=0, le=100)] = None,
+    stream: bool = False,
+):
+    store = store_manager.store
+    if stream:
+        # fetch the first page eagerly so errors surface before the response starts
+        first_page, next_cursor = await store.listdir_page(
+            parentPath, cursor, limit or 100
+        )
+
+        async def ndjson_lines():
+            for it in first_page:
+                yield dumps(it.to_dict()) + b"\n"
+            if next_cursor:
+                async for it in store.iter_dir(parentPath, limit or 100, next_cursor):
+                    yield dumps(it.to_dict()) + b"\n"
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    if cursor is None and limit is None:
+        files = await store.listdir(parentPath)
+        return JSONResponse([it.to_dict() for it in files])
+
+    files, next_cursor = await store.listdir_page(parentPath, cursor, limit or 100)
+    return JSONResponse(
+        {"items": [it.to_dict() for it in files], "nextCursor": next_cursor}
+    )
+
+
+@file_api.get("/search")
+async def search(
+    q: str = "",
+    match: Literal["contains", "prefix", "fuzzy"] = "contains",
+    type: Optional[Literal["file", "folder"]] = None,
+    category: Annotated[Optional[list[str]], Query()] = None,
+    extension: Annotated[Optional[list[str]], Query()] = None,
+    minSize: Annotated[Optional[int], Query(ge=0)] = None,
+    maxSize: Annotated[Optional[int], Query(ge=0)] = None,
+    createdAfter: Optional[datetime] = None,
+    createdBefore: Optional[datetime] = None,
+    updatedAfter: Optional[datetime] = None,
+    updatedBefore: Optional[datetime] = None,
+    under: Optional[str] = None,
+    orderBy: Literal["name", "size", "created_at", "updated_at", "relevance"] = "name",
+    orderDirection: Literal["ASC", "DESC"] = "ASC",
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(gt=0, le=100)] = 100,
+):
+    query = SearchQuery(
+        name=q,
+        match=match,
+        type=type,
+        category=category,
+        extension=extension,
+        min_size=minSize,
+        max_size=maxSize,
+        created_after=createdAfter,
+        created_before=createdBefore,
+        updated_after=updatedAfter,
+        updated_before=updatedBefore,
+        under=under,
+        order_by=orderBy,
+        order_direction=orderDirection,
+        limit=limit,
+        cursor=cursor,
+    )
+    try:
+        files, next_cursor = await store_manager.store.search(query)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return JSONResponse(
+        {"items": [it.to_dict() for it in files], "nextCursor": next_cursor}
+    )
+
+
+class BatchGetReq(BaseModel):
+    ids: list[str] = Field(min_length=1, max_length=1000)
+
+
+@file_api.post("/batch-get")
+async def batch_get(req: BatchGetReq):
+    found = await store_manager.store.get_file_items_by_ids(req.ids)
+    return JSONResponse(
+        {
+            "items": {k: v.to_dict() for k, v in found.items()},
+            "missing": [it for it in req.ids if it not in found],
+        }
+    )
+
+
+class DownloadUrlsReq(BaseModel):
+    paths: list[str] = Field(min_length=1, max_length=1000)
+    concurrency: int = Field(8, gt=0, le=32)
+
+
+@file_api.post("/download-urls")
+async def download_urls(req: DownloadUrlsReq):
+    res = await store_manager.store.get_download_urls(req.paths, req.concurrency)
+    return {
+        "urls": {k: v for k, v in res.items() if isinstance(v, str)},
+        "errors": {
+            k: f"{type(v).__name__}: {v}"
+            for k, v in res.items()
+            if not isinstance(v, str)
+        },
+    }
+
+
+@file_api.get("/thumbnail")
+async def thumbnail(
+    path: str,
+    width: Annotated[int, Query(gt=0, le=4096)] = 512,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    try:
+        thumb = await store_manager.store.get_thumbnail(path, width)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(404, str(e))
+    headers = {
+        "ETag": thumb.etag,
+        "Cache-Control": "public, max-age=86400, stale-while-revalidate=604800",
+    }
+    if if_none_match and thumb.etag in if_none_match:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(thumb.path, media_type=thumb.media_type, headers=headers)
+
+
+def _parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """parse a single `bytes=` range into (offset, length), None if it is unsatisfiable"""
+    unit, _, spec = range_header.partition("=")
+    start, sep, end = spec.strip().partition("-")
+    try:
+        if unit.strip() != "bytes" or not sep:
+            raise ValueError
+        if not start:
+            # suffix range: the last `end` bytes
+            offset = max(size - int(end), 0)
+            last = size - 1
+        else:
+            offset = int(start)
+            last = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if offset > last or offset >= size:
+        return None
+    return offset, last - offset + 1
+
+
+@file_api.get("/content")
+async def content(path: str, range: Annotated[Optional[str], Header()] = None):
+    try:
+        stream = await store_manager.store.open_file(path)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(404, str(e))
+    size = stream.size
+    headers = {"Accept-Ranges": "bytes"}
+    status_code = 200
+    # multiple ranges are not supported, they get the full content as allowed by rfc 9110
+    if range and size is not None and "," not in range:
+        parsed = _parse_range(range, size)
+        if parsed is None:
+            await stream.close()
+            raise HTTPException(416, headers={"Content-Range": f"bytes */{size}"})
+        offset, length = parsed
+        await stream.seek(offset, length)
+        headers["Content-Range"] = f"bytes {offset}-{offset + length - 1}/{size}"
+        status_code = 206
+    if stream.length is not None:
+        headers["Content-Length"] = str(stream.length)
+
+    async def body():
+        async with stream:
+            async for chunk in stream:
+                yield chunk
+
+    return StreamingResponse(
+        body(),
+        status_code=status_code,
+        headers=headers,
+        media_type=guess_type(path)[0] or "application/octet-stream",
+    )
+
+
+class ArchiveReq(BaseModel):
+    paths: list[str] = Field(min_length=1, max_length=1000)
+    # file name of the archive, without ".zip"
+    name: Optional[str] = None
+    prefetch: int = Field(4, gt=0, le=16)
+
+
+async def _archive(req: ArchiveReq):
+    store = store_manager.store
+    try:
+        roots = await asyncio.gather(*map(store.get_file_item_by_path, req.paths))
+    except FileNotFoundError as e:
+        raise HTTPException(404, str(e))
+    name = req.name or (roots[0].name if len(roots) == 1 else "") or "archive"
+    return StreamingResponse(
+        stream_zip(store, roots, req.prefetch),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(name + '.zip')}"
+        },
+    )
+
+
+@file_api.get("/archive")
+async def archive(
+    path: Annotated[list[str], Query(min_length=1, max_length=100)],
+    name: Optional[str] = None,
+    prefetch: Annotated[int, Query(gt=0, le=16)] = 4,
+):
+    """a zip of the files and dirs (with everything under them), streamed as it is built"""
+    return await _archive(ArchiveReq(paths=path, name=name, prefetch=prefetch))
+
+
+@file_api.post("/archive")
+async def archive_selection(req: ArchiveReq):
+    """`/archive` for selections too long for a query string"""
+    return await _archive(req)
+
+
+@file_api.post("/upload")
+async def upload(
+    request: Request,
+    parentPath: str,
+    name: Annotated[str, Query(min_length=1, pattern=r"^[^/]+$")],
+    onConflict: Literal["auto_rename", "refuse", "ignore"] = "auto_rename",
+):
+    """the raw request body is the file content"""
+    cfg = global_config.upload
+    start = time.perf_counter()
+    with UploadBuffer(cfg.spool_max_memory, cfg.spool_dir) as content:
+        async for chunk in request.stream():
+            content.write(chunk)
+            if cfg.max_size and content.size > cfg.max_size:
+                raise HTTPException(413, f"文件超过 {cfg.max_size} 字节")
+        received = time.perf_counter()
+        try:
+            res = await store_manager.store.upload(
+                parentPath, name, content, onConflict
+            )
+        except FileExistsError as e:
+            raise HTTPException(409, str(e))
+    done = time.perf_counter()
+    return JSONResponse(
+        {
+            "item": res.path.to_dict(),
+            "rapidUpload": res.rapid_upload,
+            "size": content.size,
+            "bytesSent": res.bytes_sent,
+            "receiveSeconds": received - start,
+            "uploadSeconds": done - received,
+            # bytes per second from the first byte received to the file being stored
+            "throughput": content.size / (done - start),
+        }
+    )
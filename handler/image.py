@@ -0,0 +1,46 @@
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import FileResponse, Response
+
+from imaging import DerivativeFormat, DerivativeSpec, ImageError, imaging_manager
+from store import store_manager
+from store.base import CachedFile
+
+image_api = APIRouter(prefix="/image")
+
+
+def cached_file_response(cached: CachedFile, if_none_match: Optional[str]) -> Response:
+    headers = {
+        "ETag": cached.etag,
+        # keys carry the content hash, the result of a key never changes
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if if_none_match and cached.etag in if_none_match:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(cached.path, media_type=cached.media_type, headers=headers)
+
+
+@image_api.get("/derivative")
+async def derivative(
+    path: str,
+    width: Annotated[int, Query(gt=0, le=8192)] = 1024,
+    format: DerivativeFormat = "webp",
+    quality: Annotated[int, Query(ge=1, le=100)] = 80,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
+    """the image resized to the configured width at or above `width` and re-encoded"""
+    try:
+        cached = await imaging_manager.engine.derivative(
+            store_manager.store, path, DerivativeSpec(width, format, quality)
+        )
+    except ImageError as e:
+        raise HTTPException(415, str(e))
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(404, str(e))
+    return cached_file_response(cached, if_none_match)
+
+
+@image_api.get("/stats")
+async def stats():
+    return imaging_manager.engine.stats()
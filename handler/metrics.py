@@ -0,0 +1,112 @@
+import re
+import time
+from typing import Any, Iterator
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from store import store_manager
+from utils import REGISTRY, Counter, Gauge, Histogram, MetricFamily, Sample
+
+metrics_api = APIRouter()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "request latency by route, until the last byte of the response",
+    ("method", "route"),
+)
+REQUESTS = Counter(
+    "http_requests_total",
+    "responses by route and status",
+    ("method", "route", "status"),
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "requests being handled")
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            # the router puts the matched route in the scope, its template keeps the label set small
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - start, method=scope["method"], route=route_path
+            )
+            REQUESTS.inc(method=scope["method"], route=route_path, status=status)
+
+
+# valid prometheus metric name
+_METRIC_NAME = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+# stats dicts keyed by arbitrary values, exported as one gauge labelled with the key
+_LABELLED = {"top_merged": "key"}
+_MAX_LABEL_LENGTH = 120
+
+_Labels = tuple[tuple[str, str], ...]
+
+
+def _is_number(val: Any) -> bool:
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+
+def _flatten(
+    prefix: str, stats: dict[str, Any]
+) -> Iterator[tuple[str, _Labels, float]]:
+    for key, val in stats.items():
+        name = f"{prefix}_{key}".replace("/", "_").replace(".", "_").replace("-", "_")
+        if not _METRIC_NAME.fullmatch(name):
+            continue
+        if key in _LABELLED and isinstance(val, dict):
+            for label, v in val.items():
+                if _is_number(v):
+                    label = str(label)[:_MAX_LABEL_LENGTH]
+                    yield name, ((_LABELLED[key], label),), v
+        elif isinstance(val, dict):
+            yield from _flatten(name, val)
+        elif _is_number(val):
+            yield name, (), val
+    hits, misses = stats.get("hits"), stats.get("misses")
+    if isinstance(hits, int) and isinstance(misses, int) and "hit_ratio" not in stats:
+        yield f"{prefix}_hit_ratio", (), hits / (hits + misses) if hits + misses else 0
+
+
+def _store_stats() -> Iterator[MetricFamily]:
+    """`store.stats()` as gauges, eg: store_listing_cache_hits, store_token_refreshes"""
+    try:
+        stats = store_manager.store.stats()
+    except ValueError:
+        # store is not set up yet
+        return
+    samples: dict[str, list[Sample]] = {}
+    for name, labels, val in _flatten("store", stats):
+        samples.setdefault(name, []).append(Sample("", labels, val))
+    for name, it in samples.items():
+        yield MetricFamily(name, "gauge", name, it)
+
+
+REGISTRY.add_collector(_store_stats)
+
+
+@metrics_api.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,19 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+from utils import tracer
+
+
+def dumps(content: Any) -> bytes:
+    # utc datetimes end with "Z", the same as pydantic renders them
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+class JSONResponse(ORJSONResponse):
+    """orjson response, route handlers return it directly to skip fastapi's jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        with tracer.span("serialize"):
+            return dumps(content)
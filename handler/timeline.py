@@ -0,0 +1,48 @@
+from typing import Annotated, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Path, Query
+from store import store_manager
+
+from .response import JSONResponse
+
+timeline_api = APIRouter(prefix="/timeline")
+
+Category = Literal["image", "video"]
+
+
+@timeline_api.get("")
+async def timeline(
+    granularity: Literal["day", "month"] = "month",
+    category: Optional[Category] = None,
+):
+    """photo and video counts by the date they were taken
+
+    the counts come from the local index, `complete` is false until the crawler
+    (`store.aliyun.crawler.enabled`) has walked the whole drive, before that only
+    the dirs browsed so far are counted.
+    """
+    store = store_manager.store
+    buckets = await store.timeline(granularity, category)
+    return {
+        "buckets": [{"key": it.key, "count": it.count} for it in buckets],
+        "complete": await store.index_complete(),
+    }
+
+
+@timeline_api.get("/{bucket}")
+async def timeline_items(
+    bucket: Annotated[str, Path(pattern=r"^\d{4}-\d{2}(-\d{2})?$")],
+    category: Optional[Category] = None,
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(gt=0, le=500)] = 100,
+):
+    try:
+        files, next_cursor = await store_manager.store.timeline_items(
+            bucket, limit, cursor, category
+        )
+    except ValueError:
+        # the cursor is not one this endpoint handed out
+        raise HTTPException(400, "无效的 cursor")
+    return JSONResponse(
+        {"items": [it.to_dict() for it in files], "nextCursor": next_cursor}
+    )
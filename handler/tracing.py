@@ -0,0 +1,44 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import global_config
+from utils import JsonLinesExporter, tracer
+
+
+def setup_tracing():
+    cfg = global_config.tracing
+    if cfg.enabled:
+        tracer.configure(JsonLinesExporter(cfg.jsonl_path), cfg.sample_ratio)
+
+
+def shutdown_tracing():
+    tracer.configure(None)
+
+
+class TracingMiddleware:
+    """root span of every http request, named by the matched route"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or tracer.exporter is None:
+            return await self.app(scope, receive, send)
+        with tracer.span(
+            f"{scope['method']} {scope['path']}",
+            "server",
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        ) as span:
+
+            async def send_wrapper(message: Message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                    span.add_event("http.response_start")
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    span.name = f"{scope['method']} {route.path}"
+                    span.set_attribute("http.route", route.path)
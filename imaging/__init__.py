@@ -0,0 +1,5 @@
+from ._derivative import DerivativeFormat, DerivativeSpec, render_derivative
+from ._edit import EditOp, EditResult, render_edit
+from ._engine import ImageEngine
+from .exception import ImageError
+from .manager import imaging_manager
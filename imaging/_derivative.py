@@ -0,0 +1,95 @@
+"""decoding and encoding of renditions, run in the worker processes"""
+
+import io
+from typing import Literal, NamedTuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .exception import ImageError
+
+DerivativeFormat = Literal["webp", "jpeg"]
+
+_MEDIA_TYPE = {"webp": "image/webp", "jpeg": "image/jpeg"}
+# exif orientations that swap width and height
+_TRANSPOSED = (5, 6, 7, 8)
+
+
+class DerivativeSpec(NamedTuple):
+    width: int
+    format: DerivativeFormat = "webp"
+    quality: int = 80
+
+    @property
+    def media_type(self) -> str:
+        return _MEDIA_TYPE[self.format]
+
+    def key(self) -> str:
+        return f"{self.width}w-{self.format}-q{self.quality}"
+
+
+def upright_size(im: Image.Image) -> tuple[int, int]:
+    """(width, height) of the image once its exif orientation is applied"""
+    if im.getexif().get(0x0112) in _TRANSPOSED:
+        return im.height, im.width
+    return im.size
+
+
+def open_image(source: str, max_width: int = 0) -> Image.Image:
+    """decode the file upright, jpegs at most `max_width` wide are decoded at a reduced scale (0 for full size)"""
+    try:
+        with Image.open(source) as im:
+            if max_width and im.width:
+                width, height = upright_size(im)
+                if width > max_width:
+                    size = (max_width, max(round(height * max_width / width), 1))
+                    if im.getexif().get(0x0112) in _TRANSPOSED:
+                        size = size[::-1]
+                    # the jpeg decoder scales by 1/2, 1/4 or 1/8 on its own, far cheaper than a resize
+                    im.draft("RGB", size)
+            im.load()
+            # a decoded copy, the file is closed on return
+            return ImageOps.exif_transpose(im)
+    except UnidentifiedImageError:
+        raise ImageError("无法识别的图片格式") from None
+    except Image.DecompressionBombError:
+        raise ImageError("图片像素过多") from None
+
+
+def encode(im: Image.Image, format: DerivativeFormat, quality: int, icc=None) -> bytes:
+    out = io.BytesIO()
+    if format == "jpeg":
+        if im.mode in ("RGBA", "LA", "P"):
+            im = im.convert("RGBA")
+            background = Image.new("RGB", im.size, (255, 255, 255))
+            background.paste(im, mask=im.getchannel("A"))
+            im = background
+        elif im.mode != "RGB":
+            im = im.convert("RGB")
+        im.save(
+            out,
+            "JPEG",
+            quality=quality,
+            optimize=True,
+            progressive=True,
+            icc_profile=icc,
+        )
+    else:
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+        im.save(out, "WEBP", quality=quality, method=4, icc_profile=icc)
+    return out.getvalue()
+
+
+def fit_width(im: Image.Image, width: int) -> Image.Image:
+    """the image scaled down to `width` if it is wider"""
+    if im.width <= width:
+        return im
+    height = max(round(im.height * width / im.width), 1)
+    return im.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def render_derivative(source: str, spec: DerivativeSpec) -> bytes:
+    """the encoded rendition of the image file `source`, never wider than the original"""
+    with open_image(source, spec.width) as im:
+        icc = im.info.get("icc_profile")
+        return encode(fit_width(im, spec.width), spec.format, spec.quality, icc)
@@ -0,0 +1,258 @@
+"""edit chains: operations on rgb frames and their memoized rendering, run in the worker processes"""
+
+import hashlib
+from collections import OrderedDict
+from typing import Annotated, Literal, NamedTuple, Optional, Union
+
+import numpy as np
+from PIL import Image
+from pydantic import BaseModel, Field
+
+from ._derivative import (
+    _MEDIA_TYPE,
+    DerivativeFormat,
+    encode,
+    fit_width,
+    open_image,
+    upright_size,
+)
+
+# rows processed at once by the kernels that need float math, bounds their temporaries
+_BAND_ROWS = 256
+# rec. 709 luma weights
+_LUMA = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+
+def _to_u8(values: np.ndarray) -> np.ndarray:
+    return np.clip(values * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def _srgb_to_linear(x: np.ndarray) -> np.ndarray:
+    return np.where(x <= 0.04045, x / 12.92, ((x + 0.055) / 1.055) ** 2.4)
+
+
+def _linear_to_srgb(x: np.ndarray) -> np.ndarray:
+    return np.where(x <= 0.0031308, x * 12.92, 1.055 * x ** (1 / 2.4) - 0.055)
+
+
+def apply_lut(pixels: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """map every 8 bit value through the 256 entry table"""
+    return lut[pixels]
+
+
+def exposure_lut(ev: float) -> np.ndarray:
+    """scale light by 2**ev, in linear light like a camera exposure"""
+    x = np.arange(256, dtype=np.float64) / 255
+    return _to_u8(_linear_to_srgb(np.minimum(_srgb_to_linear(x) * 2.0**ev, 1.0)))
+
+
+def contrast_lut(amount: float) -> np.ndarray:
+    """stretch (amount > 0) or flatten (amount < 0) the values around mid gray"""
+    x = np.arange(256, dtype=np.float64) / 255
+    return _to_u8((x - 0.5) * (1 + amount) + 0.5)
+
+
+def saturate(pixels: np.ndarray, amount: float) -> np.ndarray:
+    """move the colors away from (amount > 0) or towards (amount < 0) their luma, -1 is grayscale"""
+    out = np.empty_like(pixels)
+    for start in range(0, pixels.shape[0], _BAND_ROWS):
+        band = pixels[start : start + _BAND_ROWS].astype(np.float32)
+        luma = (band @ _LUMA)[..., None]
+        band -= luma
+        band *= 1 + amount
+        band += luma + 0.5
+        np.clip(band, 0, 255, out=band)
+        out[start : start + _BAND_ROWS] = band
+    return out
+
+
+class CropOp(BaseModel):
+    """the box in fractions of the frame, so it means the same on a preview"""
+
+    op: Literal["crop"]
+    left: float = Field(ge=0, lt=1)
+    top: float = Field(ge=0, lt=1)
+    width: float = Field(gt=0, le=1)
+    height: float = Field(gt=0, le=1)
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        h, w = pixels.shape[:2]
+        x0, y0 = round(self.left * w), round(self.top * h)
+        x1 = max(min(round((self.left + self.width) * w), w), x0 + 1)
+        y1 = max(min(round((self.top + self.height) * h), h), y0 + 1)
+        # a copy, a view would keep the whole parent frame alive in the memo
+        return np.ascontiguousarray(pixels[y0:y1, x0:x1])
+
+
+class RotateOp(BaseModel):
+    """clockwise, the frame grows to hold the rotated image"""
+
+    op: Literal["rotate"]
+    angle: float = Field(ge=-360, le=360)
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        if self.angle % 90 == 0:
+            return np.ascontiguousarray(np.rot90(pixels, -int(self.angle // 90)))
+        im = Image.fromarray(pixels).rotate(
+            -self.angle, Image.Resampling.BICUBIC, expand=True
+        )
+        return np.asarray(im)
+
+
+class FlipOp(BaseModel):
+    op: Literal["flip"]
+    direction: Literal["horizontal", "vertical"] = "horizontal"
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        flipped = pixels[:, ::-1] if self.direction == "horizontal" else pixels[::-1]
+        return np.ascontiguousarray(flipped)
+
+
+class ResizeOp(BaseModel):
+    """width in pixels of the full size render, scaled down with a preview"""
+
+    op: Literal["resize"]
+    width: int = Field(gt=0, le=8192)
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        h, w = pixels.shape[:2]
+        width = max(round(self.width * scale), 1)
+        height = max(round(h * width / w), 1)
+        im = Image.fromarray(pixels).resize(
+            (width, height), Image.Resampling.LANCZOS, reducing_gap=3.0
+        )
+        return np.asarray(im)
+
+
+class ExposureOp(BaseModel):
+    op: Literal["exposure"]
+    ev: float = Field(ge=-5, le=5)
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        return apply_lut(pixels, exposure_lut(self.ev))
+
+
+class ContrastOp(BaseModel):
+    op: Literal["contrast"]
+    amount: float = Field(ge=-1, le=1)
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        return apply_lut(pixels, contrast_lut(self.amount))
+
+
+class SaturationOp(BaseModel):
+    op: Literal["saturation"]
+    amount: float = Field(ge=-1, le=1)
+
+    def apply(self, pixels: np.ndarray, scale: float) -> np.ndarray:
+        return saturate(pixels, self.amount)
+
+
+EditOp = Annotated[
+    Union[CropOp, RotateOp, FlipOp, ResizeOp, ExposureOp, ContrastOp, SaturationOp],
+    Field(discriminator="op"),
+]
+
+
+def chain_keys(content_key: str, base: int, ops: list[EditOp]) -> list[str]:
+    """keys of the decoded source and of the result after each op, each derived from the previous one"""
+    key = hashlib.sha1(f"{content_key}|{base}".encode()).hexdigest()
+    keys = [key]
+    for op in ops:
+        key = hashlib.sha1(f"{key}|{op.model_dump_json()}".encode()).hexdigest()
+        keys.append(key)
+    return keys
+
+
+class _Frame(NamedTuple):
+    pixels: np.ndarray
+    # scale of the frame to the full size image
+    scale: float
+    icc: Optional[bytes]
+
+
+class _FrameMemo:
+    """lru of frames bounded by their bytes, one per worker process"""
+
+    def __init__(self) -> None:
+        self.frames: OrderedDict[str, _Frame] = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key: str) -> Optional[_Frame]:
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frames.move_to_end(key)
+        return frame
+
+    def put(self, key: str, frame: _Frame, max_bytes: int):
+        # frames are shared by the chains built on them, none may change one in place
+        frame.pixels.flags.writeable = False
+        if key in self.frames:
+            self.bytes -= self.frames.pop(key).pixels.nbytes
+        self.frames[key] = frame
+        self.bytes += frame.pixels.nbytes
+        while self.bytes > max_bytes and self.frames:
+            self.bytes -= self.frames.popitem(last=False)[1].pixels.nbytes
+
+
+_memo = _FrameMemo()
+
+
+class EditResult(NamedTuple):
+    data: bytes
+    width: int
+    height: int
+    # steps served from the memo and steps computed, decoding the source is a step
+    reused: int
+    computed: int
+
+
+def _decode(source: str, base: int) -> _Frame:
+    """the source as rgb, at most `base` wide unless it is 0"""
+    with open_image(source, base) as im:
+        icc = im.info.get("icc_profile")
+        if base:
+            im = fit_width(im, base)
+        pixels = np.asarray(im.convert("RGB"))
+    # only the header is read, the draft decode above may have scaled the image
+    with Image.open(source) as probe:
+        full_width = upright_size(probe)[0]
+    return _Frame(pixels, pixels.shape[1] / full_width, icc)
+
+
+def render_edit(
+    source: str,
+    content_key: str,
+    base: int,
+    ops: list[EditOp],
+    format: DerivativeFormat = "jpeg",
+    quality: int = 90,
+    memo_bytes: int = 256 * 1024 * 1024,
+) -> EditResult:
+    """apply `ops` in order to the image file `source`, from the longest memoized prefix of the chain
+
+    `base` is the width of a preview, 0 renders at full size.
+    """
+    keys = chain_keys(content_key, base, ops)
+    start = len(keys)
+    frame = None
+    while start and frame is None:
+        start -= 1
+        frame = _memo.get(keys[start])
+    if frame is None:
+        frame = _decode(source, base)
+        _memo.put(keys[0], frame, memo_bytes)
+        reused = 0
+    else:
+        reused = start + 1
+    for i in range(start, len(ops)):
+        pixels = ops[i].apply(frame.pixels, frame.scale)
+        frame = frame._replace(pixels=pixels)
+        _memo.put(keys[i + 1], frame, memo_bytes)
+    height, width = frame.pixels.shape[:2]
+    data = encode(Image.fromarray(frame.pixels), format, quality, frame.icc)
+    return EditResult(data, width, height, reused, len(keys) - reused)
+
+
+def media_type(format: DerivativeFormat) -> str:
+    return _MEDIA_TYPE[format]
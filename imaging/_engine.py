@@ -0,0 +1,205 @@
+import asyncio
+import bisect
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from store.base import BaseStore, CachedFile, StrPath
+from utils import DiskLRUCache, SingleFlight, tracer
+
+from ._derivative import DerivativeFormat, DerivativeSpec, render_derivative
+from ._edit import EditOp, chain_keys, media_type, render_edit
+from .exception import ImageError
+
+_R = TypeVar("_R")
+
+
+class ImageEngine:
+    """renders images of a store in a process pool, caching originals and results on disk
+
+    the event loop only moves bytes: decoding and encoding run in `workers`
+    processes. concurrent requests of the same result share one render.
+
+    each process is a lane of its own, the renders of one image always go to the
+    same lane so its edit chains find their intermediate frames in that process.
+    """
+
+    def __init__(
+        self,
+        cache: DiskLRUCache,
+        sources: DiskLRUCache,
+        widths: list[int],
+        workers: Optional[int] = None,
+        max_source_size: int = 64 * 1024 * 1024,
+        preview_width: int = 1280,
+        edit_memo_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.cache = cache
+        self.sources = sources
+        self.widths = sorted(widths)
+        self.workers = workers or os.cpu_count() or 1
+        self.max_source_size = max_source_size
+        self.preview_width = preview_width
+        self.edit_memo_bytes = edit_memo_bytes
+        self.single_flight = SingleFlight()
+        self._lanes: list[ProcessPoolExecutor] = []
+        # renders queued or running in each lane
+        self._queued: list[int] = []
+
+        self.renders = 0
+        self.render_seconds = 0.0
+        self.source_downloads = 0
+        self.edit_steps_reused = 0
+        self.edit_steps_computed = 0
+
+    @property
+    def lanes(self) -> list[ProcessPoolExecutor]:
+        if not self._lanes:
+            # forking a process that runs threads (sqlite, aiodns) can deadlock the child
+            context = multiprocessing.get_context("spawn")
+            self._lanes = [
+                ProcessPoolExecutor(1, mp_context=context) for _ in range(self.workers)
+            ]
+            self._queued = [0] * self.workers
+        return self._lanes
+
+    def snap_width(self, width: int) -> int:
+        """the smallest rendition width not below `width`, the largest one past them all"""
+        i = bisect.bisect_left(self.widths, width)
+        return self.widths[min(i, len(self.widths) - 1)]
+
+    async def run(
+        self, func: Callable[..., _R], *args, affinity: Optional[str] = None
+    ) -> _R:
+        """call `func` in a worker process, the same one for the same `affinity`, else the least busy one"""
+        lanes = self.lanes
+        if affinity is None:
+            lane = min(range(len(lanes)), key=self._queued.__getitem__)
+        else:
+            lane = zlib.crc32(affinity.encode()) % len(lanes)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self._queued[lane] += 1
+        with tracer.span("imaging.render", "internal", func=func.__name__, lane=lane):
+            try:
+                return await loop.run_in_executor(lanes[lane], func, *args)
+            finally:
+                self._queued[lane] -= 1
+                self.renders += 1
+                self.render_seconds += loop.time() - start
+
+    async def source(self, store: BaseStore, path: StrPath, content_key: str) -> str:
+        """local path of the original, downloaded once for all the renditions"""
+        cached = self.sources.get(content_key)
+        if cached is None:
+            cached = await self.single_flight.do(
+                ("source", content_key),
+                partial(self._download, store, path, content_key),
+            )
+        return cached
+
+    async def _download(self, store: BaseStore, path: StrPath, content_key: str) -> str:
+        async with await store.open_file(path) as stream:
+            if stream.size is not None and stream.size > self.max_source_size:
+                raise ImageError(f"{path} 超过 {self.max_source_size} 字节")
+            with self.sources.writer(content_key) as f:
+                async for chunk in stream:
+                    f.write(chunk)
+        self.source_downloads += 1
+        cached = self.sources.get(content_key)
+        assert cached
+        return cached
+
+    async def cached(
+        self,
+        key: str,
+        media_type: str,
+        render: Callable[[], Awaitable[bytes]],
+    ) -> CachedFile:
+        """the cached result of `key`, rendered by `render` (bytes) when missing"""
+        path = self.cache.get(key)
+        if path is None:
+            path = await self.single_flight.do(
+                ("result", key), partial(self._render_to_cache, key, render)
+            )
+        return CachedFile(path, f'"{key}"', media_type)
+
+    async def _render_to_cache(
+        self, key: str, render: Callable[[], Awaitable[bytes]]
+    ) -> str:
+        data = await render()
+        with self.cache.writer(key) as f:
+            f.write(data)
+        path = self.cache.get(key)
+        assert path
+        return path
+
+    async def derivative(
+        self, store: BaseStore, path: StrPath, spec: DerivativeSpec
+    ) -> CachedFile:
+        """rendition of the image at `path`, its width snapped to one of `widths`"""
+        spec = spec._replace(width=self.snap_width(spec.width))
+        content_key = await store.get_content_key(path)
+
+        async def render() -> bytes:
+            source = await self.source(store, path, content_key)
+            return await self.run(render_derivative, source, spec)
+
+        return await self.cached(f"{content_key}-{spec.key()}", spec.media_type, render)
+
+    async def edit(
+        self,
+        store: BaseStore,
+        path: StrPath,
+        ops: list[EditOp],
+        preview: bool = False,
+        format: DerivativeFormat = "jpeg",
+        quality: int = 90,
+    ) -> CachedFile:
+        """`ops` applied in order to the image at `path`, at most `preview_width` wide for a preview"""
+        content_key = await store.get_content_key(path)
+        base = self.preview_width if preview else 0
+        chain = chain_keys(content_key, base, ops)[-1]
+
+        async def render() -> bytes:
+            source = await self.source(store, path, content_key)
+            res = await self.run(
+                render_edit,
+                source,
+                content_key,
+                base,
+                ops,
+                format,
+                quality,
+                self.edit_memo_bytes,
+                affinity=content_key,
+            )
+            self.edit_steps_reused += res.reused
+            self.edit_steps_computed += res.computed
+            return res.data
+
+        return await self.cached(
+            f"edit-{chain}-{format}-q{quality}", media_type(format), render
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "renders": self.renders,
+            "render_seconds_total": self.render_seconds,
+            "source_downloads": self.source_downloads,
+            "edit_steps_reused": self.edit_steps_reused,
+            "edit_steps_computed": self.edit_steps_computed,
+            "cache": self.cache.stats(),
+            "sources": self.sources.stats(),
+            "single_flight": self.single_flight.stats(),
+        }
+
+    def dispose(self):
+        for it in self._lanes:
+            it.shutdown(wait=False, cancel_futures=True)
+        self._lanes = []
@@ -0,0 +1,2 @@
+class ImageError(ValueError):
+    """the file is not an image that can be processed"""
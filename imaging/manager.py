@@ -0,0 +1,37 @@
+from typing import Optional
+
+from config import global_config, ImagingConfig
+from utils import DiskLRUCache
+
+from ._engine import ImageEngine
+
+
+class ImagingManager:
+    def __init__(self) -> None:
+        self._engine: Optional[ImageEngine] = None
+
+    def setup(self, cfg: Optional[ImagingConfig] = None):
+        """build the engine of `cfg`, the global config by default"""
+        cfg = cfg or global_config.imaging
+        self._engine = ImageEngine(
+            DiskLRUCache(cfg.cache_dir, cfg.cache_max_bytes),
+            DiskLRUCache(cfg.source_dir, cfg.source_max_bytes),
+            cfg.widths,
+            cfg.workers,
+            cfg.max_source_size,
+            cfg.preview_width,
+            cfg.edit_memo_bytes,
+        )
+
+    @property
+    def engine(self) -> ImageEngine:
+        if self._engine is None:
+            raise ValueError
+        return self._engine
+
+    def dispose(self):
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+imaging_manager = ImagingManager()
@@ -0,0 +1,155 @@
+import asyncio
+import gc
+import io
+import os
+import tempfile
+import warnings
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from PIL import Image
+from pydantic import TypeAdapter
+
+from config import AliyunCacheConfig, AliyunConfig, AliyunHttpConfig, RateLimitConfig
+from imaging import (
+    DerivativeSpec,
+    EditOp,
+    ImageEngine,
+    ImageError,
+    render_derivative,
+    render_edit,
+)
+from store.aliyun import AliyunStore
+from store.backend.aliyun.test.mock_server import MockAliyunServer, MockDrive
+from utils import DiskLRUCache
+
+
+def make_jpeg(width: int, height: int, orientation: int = 1) -> bytes:
+    im = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    out = io.BytesIO()
+    im.save(out, "JPEG", exif=exif)
+    return out.getvalue()
+
+
+class TestRenderDerivative(TestCase):
+    def test_upright_and_smaller(self):
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as f:
+            # stored landscape, shown rotated by 90 degrees
+            f.write(make_jpeg(3000, 2000, orientation=6))
+            f.flush()
+            data = render_derivative(f.name, DerivativeSpec(512, "webp"))
+            with Image.open(io.BytesIO(data)) as im:
+                self.assertEqual((im.format, im.size), ("WEBP", (512, 768)))
+            # never upscaled
+            data = render_derivative(f.name, DerivativeSpec(4096, "jpeg"))
+            with Image.open(io.BytesIO(data)) as im:
+                self.assertEqual((im.format, im.size), ("JPEG", (2000, 3000)))
+
+    def test_file_closed(self):
+        with tempfile.NamedTemporaryFile(suffix=".gif") as f:
+            # animated, the decoder keeps the file for the next frames
+            frames = [Image.new("L", (64, 48), it) for it in (0, 128)]
+            frames[0].save(f, "GIF", save_all=True, append_images=frames[1:])
+            f.flush()
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always", ResourceWarning)
+                render_derivative(f.name, DerivativeSpec(32, "webp"))
+                gc.collect()
+            self.assertEqual([it.message for it in caught], [])
+
+    def test_not_an_image(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"not an image")
+            f.flush()
+            with self.assertRaises(ImageError):
+                render_derivative(f.name, DerivativeSpec(512))
+
+
+class TestImageEngine(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = MockAliyunServer(MockDrive(1, 1, 1))
+        url = await self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        cfg = AliyunConfig(
+            refresh_token="mock-refresh-" + "0" * 20,
+            client_id="id",
+            client_secret="secret",
+            http=AliyunHttpConfig(
+                base_url=url, rate_limit=RateLimitConfig(rate=1000, burst=1000)
+            ),
+            cache=AliyunCacheConfig(index_path=":memory:", thumbnail_dir=self.tmp.name),
+        )
+        self.store, self.dispose = await AliyunStore.spawn(cfg)
+        self.engine = ImageEngine(
+            DiskLRUCache(os.path.join(self.tmp.name, "cache"), 1 << 30),
+            DiskLRUCache(os.path.join(self.tmp.name, "sources"), 1 << 30),
+            [256, 1024],
+            workers=1,
+        )
+
+    async def asyncTearDown(self) -> None:
+        self.engine.dispose()
+        await self.dispose()
+        await self.server.close()
+        self.tmp.cleanup()
+
+    async def test_derivative(self):
+        self.server.drive.add("root", "a.jpg", make_jpeg(1600, 1200))
+        found = await asyncio.gather(
+            *(
+                self.engine.derivative(self.store, "/root/a.jpg", DerivativeSpec(w))
+                for w in (200, 256, 256)
+            )
+        )
+        # all snapped to 256, rendered once
+        self.assertEqual(len({it.path for it in found}), 1)
+        with Image.open(found[0].path) as im:
+            self.assertEqual(im.size, (256, 192))
+        await self.engine.derivative(self.store, "/root/a.jpg", DerivativeSpec(600))
+        self.assertEqual(self.engine.renders, 2)
+        self.assertEqual(self.engine.source_downloads, 1)
+
+    async def test_edit(self):
+        self.server.drive.add("root", "b.jpg", make_jpeg(3000, 2000))
+        self.engine.preview_width = 600
+        chain = TypeAdapter(list[EditOp]).validate_python(
+            [{"op": "rotate", "angle": -90}, {"op": "contrast", "amount": 0.2}]
+        )
+        first = await self.engine.edit(self.store, "/root/b.jpg", chain, preview=True)
+        with Image.open(first.path) as im:
+            self.assertEqual(im.size, (400, 600))
+        chain[-1] = chain[-1].model_copy(update={"amount": 0.3})
+        await self.engine.edit(self.store, "/root/b.jpg", chain, preview=True)
+        self.assertEqual(self.engine.edit_steps_reused, 2)
+        self.assertEqual(self.engine.edit_steps_computed, 3 + 1)
+        # the same render again comes from the disk cache
+        again = await self.engine.edit(self.store, "/root/b.jpg", chain, preview=True)
+        self.assertEqual(self.engine.renders, 2)
+        self.assertNotEqual(again.etag, first.etag)
+
+
+class TestRenderEdit(TestCase):
+    def test_memoized_prefix(self):
+        ops = TypeAdapter(list[EditOp])
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as f:
+            f.write(make_jpeg(1600, 1200))
+            f.flush()
+            chain = [
+                {"op": "crop", "left": 0, "top": 0, "width": 0.5, "height": 1},
+                {"op": "rotate", "angle": 90},
+                {"op": "saturation", "amount": -1},
+                {"op": "exposure", "ev": 1},
+            ]
+            res = render_edit(f.name, "k", 0, ops.validate_python(chain))
+            self.assertEqual((res.width, res.height, res.reused), (1200, 800, 0))
+            # the slider of the last op moved, only that op runs again
+            chain[-1]["ev"] = 0.5
+            res = render_edit(f.name, "k", 0, ops.validate_python(chain))
+            self.assertEqual((res.reused, res.computed), (4, 1))
+            with Image.open(io.BytesIO(res.data)) as im:
+                r, g, b = im.getpixel((600, 400))
+                self.assertLessEqual(max(r, g, b) - min(r, g, b), 2)
+
+            res = render_edit(f.name, "k", 400, ops.validate_python(chain[:2]))
+            self.assertEqual((res.width, res.height, res.reused), (300, 200, 0))
@@ -3,20 +3,33 @@ from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from store import store_manager
+from imaging import imaging_manager
 from store.backend.aliyun.login import login_use_redirect
 
 
 from handler.file import file_api
+from handler.timeline import timeline_api
+from handler.image import image_api
+from handler.edit import edit_api
+from handler.response import JSONResponse
+from handler.metrics import metrics_api, MetricsMiddleware
+from handler.tracing import TracingMiddleware, setup_tracing, shutdown_tracing
 
 from config import save_config
 
 
 async def store_save():
     await store_manager.dispose()
+    imaging_manager.dispose()
     save_config()
+    shutdown_tracing()
 
 
-app = FastAPI(on_startup=[store_manager.setup], on_shutdown=[store_save])
+app = FastAPI(
+    on_startup=[setup_tracing, store_manager.setup, imaging_manager.setup],
+    on_shutdown=[store_save],
+    default_response_class=JSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,7 +39,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
 app.include_router(file_api)
+app.include_router(metrics_api)
+app.include_router(timeline_api)
+app.include_router(image_api)
+app.include_router(edit_api)
 
 
 @app.get("/login-redirect")
@@ -35,6 +55,11 @@ async def login_redirect(code: str):
     return {"code": code}
 
 
+@app.get("/stats")
+async def stats():
+    return store_manager.store.stats()
+
+
 @app.get("/test")
 async def refresh_token():
     await store_manager.store._refresh_token()
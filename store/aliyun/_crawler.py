@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Optional
+
+from store.backend.aliyun import PRIORITY_BACKGROUND, with_priority
+
+if TYPE_CHECKING:
+    from ._store import AliyunStore
+
+logger = logging.getLogger(__name__)
+
+# (file_id, path, updated_at) of a dir waiting to be scanned
+_PendingDir = tuple[str, str, Optional[float]]
+
+
+class DriveCrawler:
+    """breadth first walk of the whole drive into the file index
+
+    pending dirs are checkpointed in the index, an interrupted crawl resumes where it
+    stopped. a dir whose `updated_at` did not change since its last scan (younger than
+    `max_age`) is not listed again, its children come from the index.
+    """
+
+    def __init__(
+        self,
+        store: "AliyunStore",
+        concurrency: int = 4,
+        interval: float = 60 * 60,
+        max_age: float = 60 * 60 * 24,
+    ) -> None:
+        self.store = store
+        self.concurrency = concurrency
+        self.interval = interval
+        self.max_age = max_age
+
+        self.crawls = 0
+        self.dirs_listed = 0
+        self.dirs_skipped = 0
+        self.errors = 0
+        self.running = False
+        # failed dirs of the current walk
+        self._failures = 0
+        self.last_finished_at: Optional[float] = None
+
+    async def run(self):
+        """crawl every `interval` seconds until cancelled"""
+        with with_priority(PRIORITY_BACKGROUND):
+            while True:
+                try:
+                    await self.crawl()
+                except Exception:
+                    logger.exception("crawl drive failed")
+                await asyncio.sleep(self.interval)
+
+    async def crawl(self):
+        """walk the drive from the root, after finishing an interrupted walk if any
+
+        the crawl is finished only when every dir was scanned, failed dirs stay
+        pending for the next one.
+        """
+        index = self.store.file_index
+        pending: list[_PendingDir] = await index.run(index.load_crawl_queue)
+        if pending:
+            logger.info("resume crawl with %d pending dirs", len(pending))
+            if await self._walk(pending):
+                return
+        root = [("root", "/root", None)]
+        await index.run(index.crawl_step, None, root)
+        if await self._walk(root):
+            return
+        self.crawls += 1
+        self.last_finished_at = time.time()
+        await index.run(
+            index.set_meta, "last_crawl_finished_at", str(self.last_finished_at)
+        )
+
+    async def _walk(self, pending: list[_PendingDir]) -> int:
+        """scan `pending` and every dir found under them, returns the number of failed dirs"""
+        queue: asyncio.Queue[_PendingDir] = asyncio.Queue()
+        for it in pending:
+            queue.put_nowait(it)
+        self._failures = 0
+        self.running = True
+        workers = [
+            asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)
+        ]
+        try:
+            await queue.join()
+        finally:
+            self.running = False
+            for it in workers:
+                it.cancel()
+        if self._failures:
+            logger.warning("crawl left %d failed dirs pending", self._failures)
+        return self._failures
+
+    async def _worker(self, queue: "asyncio.Queue[_PendingDir]"):
+        index = self.store.file_index
+        while True:
+            file_id, path, updated_at = await queue.get()
+            try:
+                subdirs = await self._scan(file_id, path, updated_at)
+            except FileNotFoundError:
+                # deleted since it was found, nothing left to scan
+                await index.run(index.crawl_step, file_id)
+            except Exception:
+                # stays in the checkpoint, the next crawl retries it
+                self.errors += 1
+                self._failures += 1
+                logger.warning("crawl %s failed", path, exc_info=True)
+            else:
+                await index.run(index.crawl_step, file_id, subdirs)
+                for it in subdirs:
+                    queue.put_nowait(it)
+            finally:
+                queue.task_done()
+
+    async def _scan(
+        self, file_id: str, path: str, updated_at: Optional[float]
+    ) -> list[_PendingDir]:
+        index = self.store.file_index
+        children = None
+        scan = await index.run(index.get_dir_scan, file_id)
+        if (
+            updated_at is not None
+            and scan is not None
+            and scan[1] == updated_at
+            and scan[0] >= time.time() - self.max_age
+        ):
+            children = await index.run(index.get_children, file_id, self.max_age)
+        if children is None:
+            children = await self.store._list_remote_dir(file_id, updated_at)
+            self.store.listing_cache.invalidate(file_id)
+            self.dirs_listed += 1
+        else:
+            self.dirs_skipped += 1
+        return [
+            (it.file_id, f"{path}/{it.name}", it.updated_at.timestamp())
+            for it in children
+            if it.file_type == "folder"
+        ]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "running": self.running,
+            "crawls": self.crawls,
+            "dirs_listed": self.dirs_listed,
+            "dirs_skipped": self.dirs_skipped,
+            "errors": self.errors,
+            "last_finished_at": self.last_finished_at,
+        }
@@ -0,0 +1,115 @@
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+import orjson
+
+from store.backend.aliyun import FileItem
+
+
+def _intern(s: Optional[str]) -> Optional[str]:
+    return None if s is None else sys.intern(s)
+
+
+def _timestamp(val: str | datetime) -> float:
+    if isinstance(val, str):
+        val = datetime.fromisoformat(val)
+    return val.timestamp()
+
+
+class FileEntry:
+    """compact, read only FileItem kept in listings and caches
+
+    values shared by many entries (drive, parent, type, extension...) are interned
+    and dates are plain timestamps, so an entry is a fraction of a FileItem.
+    """
+
+    __slots__ = (
+        "drive_id",
+        "file_id",
+        "parent_file_id",
+        "name",
+        "file_type",
+        "size",
+        "file_extension",
+        "content_hash",
+        "category",
+        "thumbnail",
+        "created_ts",
+        "updated_ts",
+    )
+
+    def __init__(
+        self,
+        drive_id: str,
+        file_id: str,
+        parent_file_id: str,
+        name: str,
+        file_type: str,
+        created_ts: float,
+        updated_ts: float,
+        size: Optional[int] = None,
+        file_extension: Optional[str] = None,
+        content_hash: Optional[str] = None,
+        category: Optional[str] = None,
+        thumbnail: Optional[str] = None,
+    ) -> None:
+        self.drive_id = sys.intern(drive_id)
+        self.file_id = file_id
+        self.parent_file_id = sys.intern(parent_file_id)
+        self.name = name
+        self.file_type = sys.intern(file_type)
+        self.size = size
+        self.file_extension = _intern(file_extension)
+        self.content_hash = content_hash
+        self.category = _intern(category)
+        self.thumbnail = thumbnail
+        self.created_ts = created_ts
+        self.updated_ts = updated_ts
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.fromtimestamp(self.created_ts, timezone.utc)
+
+    @property
+    def updated_at(self) -> datetime:
+        return datetime.fromtimestamp(self.updated_ts, timezone.utc)
+
+    @classmethod
+    def from_item(cls, item: FileItem) -> "FileEntry":
+        return cls(
+            item.drive_id,
+            item.file_id,
+            item.parent_file_id,
+            item.name,
+            item.file_type,
+            item.created_at.timestamp(),
+            item.updated_at.timestamp(),
+            item.size,
+            item.file_extension,
+            item.content_hash,
+            item.category,
+            item.thumbnail,
+        )
+
+    @classmethod
+    def from_json(cls, data: str | bytes) -> "FileEntry":
+        """entry of a `FileItem.model_dump_json()`, without validating a model"""
+        d = orjson.loads(data)
+        return cls(
+            d["drive_id"],
+            d["file_id"],
+            d["parent_file_id"],
+            d["name"],
+            d["file_type"],
+            _timestamp(d["created_at"]),
+            _timestamp(d["updated_at"]),
+            d.get("size"),
+            d.get("file_extension"),
+            d.get("content_hash"),
+            d.get("category"),
+            d.get("thumbnail"),
+        )
+
+    def __repr__(self) -> str:
+        return f"FileEntry(file_id={self.file_id!r}, name={self.name!r})"
@@ -0,0 +1,519 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from os import makedirs, path as os_path
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator, Literal, Optional, TypeVar
+
+from store.base import SearchQuery
+from store.backend.aliyun import FileItem
+
+from ._entry import FileEntry
+
+# applied in order, `PRAGMA user_version` records how many have run
+_MIGRATIONS = (
+    """
+    CREATE TABLE IF NOT EXISTS files (
+        drive_id TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        parent_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        path TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (drive_id, file_id)
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS files_path ON files (drive_id, path);
+    CREATE INDEX IF NOT EXISTS files_parent ON files (drive_id, parent_id);
+    """,
+    # full metadata mirror
+    """
+    ALTER TABLE files ADD COLUMN file_type TEXT;
+    ALTER TABLE files ADD COLUMN category TEXT;
+    ALTER TABLE files ADD COLUMN file_extension TEXT;
+    ALTER TABLE files ADD COLUMN size INTEGER;
+    ALTER TABLE files ADD COLUMN created_at REAL;
+    ALTER TABLE files ADD COLUMN content_hash TEXT;
+    ALTER TABLE files ADD COLUMN item TEXT;
+    CREATE TABLE dirs (
+        drive_id TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        scanned_at REAL NOT NULL,
+        updated_at REAL,
+        PRIMARY KEY (drive_id, file_id)
+    );
+    CREATE TABLE crawl_queue (
+        drive_id TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        path TEXT NOT NULL,
+        updated_at REAL,
+        PRIMARY KEY (drive_id, file_id)
+    );
+    CREATE TABLE meta (
+        drive_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (drive_id, key)
+    );
+    """,
+    # search, trigram tokens make substring LIKE on names use the fts index
+    """
+    CREATE VIRTUAL TABLE files_fts USING fts5(
+        name, content='files', content_rowid='rowid', tokenize='trigram'
+    );
+    CREATE TRIGGER files_fts_insert AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts (rowid, name) VALUES (new.rowid, new.name);
+    END;
+    CREATE TRIGGER files_fts_delete AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+    END;
+    CREATE TRIGGER files_fts_update AFTER UPDATE OF name ON files BEGIN
+        INSERT INTO files_fts (files_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        INSERT INTO files_fts (rowid, name) VALUES (new.rowid, new.name);
+    END;
+    INSERT INTO files_fts (files_fts) VALUES ('rebuild');
+    CREATE INDEX files_updated_at ON files (drive_id, updated_at);
+    CREATE INDEX files_size ON files (drive_id, size);
+    """,
+    # timeline, photos are bucketed by the day (utc) they were taken, taken_at is
+    # the time of their media metadata when the drive has one
+    """
+    ALTER TABLE files ADD COLUMN taken_at REAL;
+    ALTER TABLE files ADD COLUMN day TEXT
+        GENERATED ALWAYS AS (date(coalesce(taken_at, created_at), 'unixepoch')) VIRTUAL;
+    CREATE INDEX files_timeline ON files (drive_id, day, coalesce(taken_at, created_at))
+        WHERE category IN ('image', 'video') AND item IS NOT NULL;
+    """,
+    # multipart uploads in progress, kept to resume them
+    """
+    CREATE TABLE uploads (
+        drive_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        upload_id TEXT NOT NULL,
+        part_size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (drive_id, key)
+    );
+    """,
+    # when each row was last confirmed by the drive, NULL for rows of before
+    """
+    ALTER TABLE files ADD COLUMN indexed_at REAL;
+    """,
+)
+
+# matches the where clause of the files_timeline index
+_TIMELINE_COND = "drive_id = ? AND category IN ('image', 'video') AND item IS NOT NULL"
+# length of the bucket key, "2024-01-31" or "2024-01"
+_BUCKET_LEN = {"day": 10, "month": 7}
+
+_ORDER_COLUMNS = {
+    "name": "f.name",
+    "size": "f.size",
+    "created_at": "f.created_at",
+    "updated_at": "f.updated_at",
+    "relevance": "score",
+}
+
+
+def _like(column: str, text: str, pattern: str) -> tuple[str, str]:
+    """LIKE clause of `pattern` with `text` put in the {} of it, wildcards in `text` match literally"""
+    if not any(c in text for c in "%_\\"):
+        # ESCAPE keeps the trigram index from serving the LIKE, so only add it when needed
+        return f"{column} LIKE ?", pattern.format(text)
+    text = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{column} LIKE ? ESCAPE '\\'", pattern.format(text)
+
+
+_R = TypeVar("_R")
+
+_FILE_COLUMNS = (
+    "drive_id, file_id, parent_id, name, path, updated_at, file_type, category,"
+    " file_extension, size, created_at, content_hash, item, indexed_at, taken_at"
+)
+
+
+class FileIndex:
+    """persistent file_id <-> path index and metadata mirror of one drive, backed by sqlite
+
+    the database is opened lazily on first use, so startup never waits for it.
+    the methods are blocking, async code calls them through `run`, in the one
+    thread of the index, so a long write never stalls the event loop.
+    """
+
+    def __init__(self, db_path: str, drive_id: str) -> None:
+        self.db_path = db_path
+        self.drive_id = drive_id
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="file-index")
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.db_path != ":memory:":
+                makedirs(os_path.dirname(os_path.abspath(self.db_path)), exist_ok=True)
+            # used from the index thread only, but closed from the caller of `close`
+            conn = sqlite3.connect(
+                self.db_path, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # rows dropped by INSERT OR REPLACE must fire the fts delete trigger too
+            conn.execute("PRAGMA recursive_triggers=ON")
+            self._migrate(conn)
+            self._conn = conn
+        return self._conn
+
+    async def run(self, func: Callable[..., _R], *args: Any) -> _R:
+        """call `func`, a method of the index, in the index thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _migrate(self, conn: sqlite3.Connection):
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        for i, script in enumerate(_MIGRATIONS[version:], start=version + 1):
+            conn.executescript(f"BEGIN; {script}; PRAGMA user_version = {i}; COMMIT;")
+
+    def get_id_by_path(self, path: str, max_age: float) -> Optional[str]:
+        """id of `path` if the drive confirmed it within `max_age` seconds"""
+        row = self.conn.execute(
+            "SELECT file_id FROM files WHERE drive_id = ? AND path = ? AND indexed_at >= ?",
+            (self.drive_id, path, time.time() - max_age),
+        ).fetchone()
+        return self._count(row)
+
+    def get_path_by_id(self, file_id: str, max_age: float) -> Optional[str]:
+        """path of `file_id` if the drive confirmed it within `max_age` seconds"""
+        row = self.conn.execute(
+            "SELECT path FROM files WHERE drive_id = ? AND file_id = ? AND indexed_at >= ?",
+            (self.drive_id, file_id, time.time() - max_age),
+        ).fetchone()
+        return self._count(row)
+
+    def _count(self, row: Optional[tuple[str]]) -> Optional[str]:
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def get_item_by_path(self, path: str) -> Optional[FileItem]:
+        row = self.conn.execute(
+            "SELECT item FROM files WHERE drive_id = ? AND path = ? AND item IS NOT NULL",
+            (self.drive_id, path),
+        ).fetchone()
+        return FileItem.model_validate_json(row[0]) if row else None
+
+    def get_children(self, parent_id: str, max_age: float) -> Optional[list[FileEntry]]:
+        """children of a dir fully listed within `max_age` seconds, else None"""
+        scan = self.get_dir_scan(parent_id)
+        if scan is None or scan[0] < time.time() - max_age:
+            return None
+        rows = self.conn.execute(
+            "SELECT item FROM files WHERE drive_id = ? AND parent_id = ?",
+            (self.drive_id, parent_id),
+        ).fetchall()
+        if any(item is None for (item,) in rows):
+            return None
+        return [FileEntry.from_json(item) for (item,) in rows]
+
+    def get_dir_scan(self, file_id: str) -> Optional[tuple[float, Optional[float]]]:
+        """(scanned_at, updated_at of the dir when it was scanned) of the last full listing"""
+        return self.conn.execute(
+            "SELECT scanned_at, updated_at FROM dirs WHERE drive_id = ? AND file_id = ?",
+            (self.drive_id, file_id),
+        ).fetchone()
+
+    def upsert(self, parent_path: str, items: Iterable[FileItem]):
+        with self._transaction() as conn:
+            self._upsert(conn, parent_path, items)
+
+    def replace_children(
+        self,
+        parent_id: str,
+        parent_path: str,
+        items: list[FileItem],
+        parent_updated_at: Optional[float] = None,
+    ):
+        """sync the children of a dir with a full listing of it, dropping the
+        subtrees of child dirs that are gone or were renamed"""
+        listed = {it.file_id: f"{parent_path}/{it.name}" for it in items}
+        with self._transaction() as conn:
+            for file_id, path in conn.execute(
+                "SELECT file_id, path FROM files WHERE drive_id = ? AND parent_id = ?"
+                " AND (file_type IS NULL OR file_type = 'folder')",
+                (self.drive_id, parent_id),
+            ).fetchall():
+                if listed.get(file_id) != path:
+                    self._remove_tree(conn, path)
+            conn.execute(
+                "DELETE FROM files WHERE drive_id = ? AND parent_id = ?",
+                (self.drive_id, parent_id),
+            )
+            self._upsert(conn, parent_path, items)
+            conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?,?,?,?)",
+                (self.drive_id, parent_id, time.time(), parent_updated_at),
+            )
+
+    def _upsert(
+        self, conn: sqlite3.Connection, parent_path: str, items: Iterable[FileItem]
+    ):
+        now = time.time()
+        rows = [
+            (
+                self.drive_id,
+                it.file_id,
+                it.parent_file_id,
+                it.name,
+                f"{parent_path}/{it.name}",
+                it.updated_at.timestamp(),
+                it.file_type,
+                it.category,
+                it.file_extension,
+                it.size,
+                it.created_at.timestamp(),
+                it.content_hash,
+                it.model_dump_json(),
+                now,
+                it.taken_at.timestamp() if it.taken_at else None,
+            )
+            for it in items
+        ]
+        # REPLACE also drops a stale row that still holds the same path
+        conn.executemany(
+            f"INSERT OR REPLACE INTO files ({_FILE_COLUMNS})"
+            " VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            rows,
+        )
+
+    def add(self, file_id: str, parent_id: str, path: str):
+        name = path.rsplit("/", 1)[-1]
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files"
+                " (drive_id, file_id, parent_id, name, path, updated_at, indexed_at)"
+                " VALUES (?,?,?,?,?,?,?)",
+                (self.drive_id, file_id, parent_id, name, path, now, now),
+            )
+
+    def remove_tree(self, path: str):
+        """remove the entry of `path` and everything under it"""
+        with self._transaction() as conn:
+            self._remove_tree(conn, path)
+
+    def _remove_tree(self, conn: sqlite3.Connection, path: str):
+        cond = "drive_id = ? AND (path = ? OR substr(path, 1, ?) = ?)"
+        args = (self.drive_id, path, len(path) + 1, path + "/")
+        # the listings of the removed dirs are gone with them
+        conn.execute(
+            f"DELETE FROM dirs WHERE drive_id = ? AND file_id IN"
+            f" (SELECT file_id FROM files WHERE {cond})",
+            (self.drive_id, *args),
+        )
+        conn.execute(f"DELETE FROM files WHERE {cond}", args)
+
+    def invalidate_dir(self, file_id: str):
+        """forget the last full listing of a dir, it will not be served from the mirror"""
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM dirs WHERE drive_id = ? AND file_id = ?",
+                (self.drive_id, file_id),
+            )
+
+    def load_crawl_queue(self) -> list[tuple[str, str, Optional[float]]]:
+        return self.conn.execute(
+            "SELECT file_id, path, updated_at FROM crawl_queue WHERE drive_id = ?",
+            (self.drive_id,),
+        ).fetchall()
+
+    def crawl_step(
+        self,
+        done_id: Optional[str],
+        discovered: Iterable[tuple[str, str, Optional[float]]] = (),
+    ):
+        """checkpoint the crawl: `done_id` is finished, `discovered` dirs are pending"""
+        with self._transaction() as conn:
+            if done_id is not None:
+                conn.execute(
+                    "DELETE FROM crawl_queue WHERE drive_id = ? AND file_id = ?",
+                    (self.drive_id, done_id),
+                )
+            conn.executemany(
+                "INSERT OR REPLACE INTO crawl_queue VALUES (?,?,?,?)",
+                [(self.drive_id, *it) for it in discovered],
+            )
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE drive_id = ? AND key = ?",
+            (self.drive_id, key),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?,?,?)",
+                (self.drive_id, key, value),
+            )
+
+    def get_upload(self, key: str, max_age: float) -> Optional[tuple[str, str, int]]:
+        """(file_id, upload_id, part_size) of an upload started within `max_age` seconds"""
+        row = self.conn.execute(
+            "SELECT file_id, upload_id, part_size, created_at FROM uploads"
+            " WHERE drive_id = ? AND key = ?",
+            (self.drive_id, key),
+        ).fetchone()
+        if row is None:
+            return None
+        if row[3] < time.time() - max_age:
+            self.delete_upload(key)
+            return None
+        return row[:3]
+
+    def set_upload(self, key: str, file_id: str, upload_id: str, part_size: int):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?,?,?,?,?,?)",
+                (self.drive_id, key, file_id, upload_id, part_size, time.time()),
+            )
+
+    def delete_upload(self, key: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM uploads WHERE drive_id = ? AND key = ?",
+                (self.drive_id, key),
+            )
+
+    def search(
+        self, query: SearchQuery
+    ) -> tuple[list[tuple[str, FileItem]], Optional[str]]:
+        """one page of (path, item) matching the query, and the cursor of next page"""
+        sql = "SELECT f.path, f.item FROM files f"
+        args: list[Any] = []
+        words = query.name.split()
+        if query.match == "fuzzy" and any(len(it) >= 3 for it in words):
+            # any shared trigram matches, bm25 ranks names sharing more of them first
+            trigrams = {w[i : i + 3] for w in words for i in range(len(w) - 2)}
+            sql += (
+                " JOIN (SELECT rowid, rank AS score FROM files_fts WHERE files_fts MATCH ?) m"
+                " ON m.rowid = f.rowid"
+            )
+            args.append(" OR ".join('"%s"' % it.replace('"', '""') for it in trigrams))
+        elif words:
+            if query.match == "prefix":
+                likes = [_like("name", query.name.strip(), "{}%")]
+            else:
+                likes = [_like("name", it, "%{}%") for it in words]
+            sql += (
+                " JOIN (SELECT rowid, 0 AS score FROM files_fts WHERE "
+                + " AND ".join(clause for clause, _ in likes)
+                + ") m ON m.rowid = f.rowid"
+            )
+            args.extend(arg for _, arg in likes)
+        else:
+            sql += " JOIN (SELECT 0 AS score) m"
+
+        conds = ["f.drive_id = ?", "f.item IS NOT NULL"]
+        args.append(self.drive_id)
+        for column, op, value in (
+            ("f.file_type", "=", query.type),
+            ("f.size", ">=", query.min_size),
+            ("f.size", "<=", query.max_size),
+            ("f.created_at", ">=", query.created_after),
+            ("f.created_at", "<", query.created_before),
+            ("f.updated_at", ">=", query.updated_after),
+            ("f.updated_at", "<", query.updated_before),
+        ):
+            if value is None:
+                continue
+            conds.append(f"{column} {op} ?")
+            args.append(value.timestamp() if isinstance(value, datetime) else value)
+        for column, values in (
+            ("f.category", query.category),
+            ("f.file_extension", query.extension),
+        ):
+            if values:
+                conds.append(f"{column} IN ({','.join('?' * len(values))})")
+                args.extend(values)
+        if query.under:
+            clause, arg = _like("f.path", query.under.rstrip("/"), "{}/%")
+            conds.append(clause)
+            args.append(arg)
+        sql += " WHERE " + " AND ".join(conds)
+
+        direction = query.order_direction
+        sql += f" ORDER BY {_ORDER_COLUMNS[query.order_by]} {direction}, f.rowid {direction}"
+        # the index is local, so a plain offset is a cheap enough cursor
+        offset = int(query.cursor or 0)
+        sql += " LIMIT ? OFFSET ?"
+        args.extend((query.limit + 1, offset))
+
+        rows = self.conn.execute(sql, args).fetchall()
+        next_cursor = str(offset + query.limit) if len(rows) > query.limit else None
+        return [
+            (path, FileItem.model_validate_json(item))
+            for path, item in rows[: query.limit]
+        ], next_cursor
+
+    def timeline(
+        self, granularity: Literal["day", "month"], category: Optional[str] = None
+    ) -> list[tuple[str, int]]:
+        """(bucket, number of photos) of every bucket, newest first"""
+        sql = f"SELECT substr(day, 1, {_BUCKET_LEN[granularity]}) AS bucket, count(*) FROM files WHERE {_TIMELINE_COND}"
+        args = [self.drive_id]
+        if category:
+            sql += " AND category = ?"
+            args.append(category)
+        sql += " GROUP BY bucket ORDER BY bucket DESC"
+        return self.conn.execute(sql, args).fetchall()
+
+    def timeline_items(
+        self,
+        bucket: str,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> tuple[list[tuple[str, FileItem]], Optional[str]]:
+        """one page of (path, item) in the bucket, newest first, and the cursor of next page"""
+        # "~" sorts after every digit, so the range covers all days of a month bucket
+        sql = f"SELECT path, item FROM files WHERE {_TIMELINE_COND} AND day >= ? AND day <= ?"
+        args: list[Any] = [self.drive_id, bucket, bucket + "~"]
+        if category:
+            sql += " AND category = ?"
+            args.append(category)
+        offset = int(cursor or 0)
+        sql += " ORDER BY day DESC, coalesce(taken_at, created_at) DESC, rowid DESC LIMIT ? OFFSET ?"
+        args.extend((limit + 1, offset))
+        rows = self.conn.execute(sql, args).fetchall()
+        next_cursor = str(offset + limit) if len(rows) > limit else None
+        return [
+            (path, FileItem.model_validate_json(item)) for path, item in rows[:limit]
+        ], next_cursor
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        # the calls still queued run before the connection is closed
+        self._executor.shutdown(wait=True)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,21 +1,73 @@
 from os import fspath
-from typing import Callable, Optional, Self, Protocol
+import posixpath
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Literal,
+    Optional,
+    Self,
+    Sequence,
+    Protocol,
+)
+from pathlib import PurePosixPath
+from functools import partial, wraps
 from inspect import iscoroutinefunction
 from datetime import datetime
+import asyncio
+import json
+import logging
+import time
 
-from store.base import BaseFile, BaseStore, BasePath, StrPath, Thumbnail
+from cachetools import TLRUCache
+
+from aiohttp import ClientResponseError, ClientTimeout
+
+from store.base import (
+    BaseFile,
+    BaseStore,
+    BasePath,
+    CachedFile,
+    SearchQuery,
+    StrPath,
+    Thumbnail,
+    TimelineBucket,
+    UploadResult,
+)
+from store.utils import UploadBuffer, sniff_image_type
 from store.backend.aliyun import *
-from store.backend.aliyun.exception import AccessTokenException, RefreshTokenException
+from store.backend.aliyun.exception import (
+    AccessTokenException,
+    AliyunException,
+    FileNotFound,
+    RefreshTokenException,
+)
 from store.backend.aliyun.utils import parse_name_path
-from utils import bidict
+from utils import PathTrie, SWRCache, SingleFlight, DiskLRUCache, traced
+
+from config import AliyunConfig, AliyunCacheConfig
+
+from ._crawler import DriveCrawler
+from ._entry import FileEntry
+from ._index import FileIndex
+from ._stream import (
+    TRANSFER_TIMEOUT,
+    RemoteFileStream,
+    SegmentedFileStream,
+    UrlGetter,
+)
+from ._upload import MultipartUpload
 
-from config import AliyunConfig
+logger = logging.getLogger(__name__)
 
 
 class AliyunFileItem(Protocol):
     file_type: FileType
     file_id: str
     drive_id: str
+    parent_file_id: str
+    name: str
+    content_hash: Optional[str]
     size: Optional[int]
     thumbnail: Optional[str]
     created_at: datetime
@@ -23,13 +75,14 @@ class AliyunFileItem(Protocol):
 
 
 class AliyunPath(BasePath):
+    __slots__ = ("file_item", "_store")
+
     def __init__(
         self, *args: str, file_item: AliyunFileItem, _store: "AliyunStore"
     ) -> None:
         super().__init__(*args)
         self.file_item = file_item
         self._store = _store
-        self._store.file_id_and_file_path_mapping[file_item.file_id] = self.as_posix()
 
     def is_dir(self) -> bool:
         return self.file_item.file_type == "folder"
@@ -40,22 +93,14 @@ class AliyunPath(BasePath):
     async def listdir(self) -> list["AliyunPath"]:
         if not self.is_dir():
             raise ValueError("not a dir")
-
-        file_list = await get_file_list(
-            self._store.access_token,
-            drive_id=self.file_item.drive_id,
-            parent_file_id=self.file_item.file_id,
-        )
-        return [
-            AliyunPath(fspath(self), it.name, file_item=it, _store=self._store)
-            for it in file_list.items
-        ]
+        return await self._store.listdir_by_file_id(self.file_item.file_id)
 
     async def get_download_url(self) -> str:
         return await self._store.get_download_url_by_file_id(self.file_item.file_id)
 
     def to_model(self) -> BaseFile:
         return BaseFile(
+            id=self.file_item.file_id,
             name=self.name,
             path=self.as_posix(),
             type=self.file_item.file_type,
@@ -70,16 +115,85 @@ class AliyunPath(BasePath):
             updated_at=self.file_item.updated_at,
         )
 
+    def to_dict(self) -> dict[str, Any]:
+        # same keys as `to_model`, built directly since listings dump thousands of them
+        item = self.file_item
+        return {
+            "id": item.file_id,
+            "name": self.name,
+            "path": self.as_posix(),
+            "type": item.file_type,
+            "extension": self.suffix,
+            "createdAt": item.created_at,
+            "updatedAt": item.updated_at,
+            "size": item.size,
+            "thumbnail": {"url": item.thumbnail} if item.thumbnail else None,
+        }
+
+
+def _coalesced(func: Callable):
+    """concurrent calls of the method with the same arguments share one result"""
+
+    @wraps(func)
+    async def inner(self: "AliyunStore", *args):
+        key = (func.__name__, *(fspath(it) for it in args))
+        return await self.single_flight.do(key, partial(func, self, *args))
+
+    return inner
+
+
+def _paths_of_tree(path: str, tree: dict, wanted: set[str]) -> list[str]:
+    """the wanted paths among `path` and the segments of `tree` under it"""
+    res = [path] if path in wanted else []
+    for name, subtree in tree.items():
+        res.extend(_paths_of_tree(f"{path}/{name}", subtree, wanted))
+    return res
+
 
 class AliyunStore(BaseStore[AliyunPath]):
     access_token: str
     refresh_token: str
     drive_id: str
     api_client: AliyunApiClient
-    file_id_and_file_path_mapping: bidict[str, StrPath]
+    path_ids: PathTrie[str]
+    listing_cache: SWRCache[str, list[FileEntry]]
+    single_flight: SingleFlight
+    file_index: FileIndex
+    download_url_cache: TLRUCache[str, FileDownloadInfo]
+    thumbnail_cache: DiskLRUCache
+    stream_chunk_size: int = 256 * 1024
+    stream_read_ahead: int = 8
+    download_segmented_min_size: int = 16 * 1024 * 1024
+    download_segment_size: int = 4 * 1024 * 1024
+    download_connections: int = 4
+    # of content downloads and part uploads, without a total limit
+    transfer_timeout: ClientTimeout = TRANSFER_TIMEOUT
+    # wall clock time the access token expires at, None if unknown
+    access_token_expires_at: Optional[float] = None
+    on_token_refreshed: Optional[Callable[["AliyunStore"], None]] = None
+    # path <-> id entries of the file index at most this old are trusted
+    index_max_age: float = 60 * 60 * 24
+    # listings in the file index at most this old are served without api calls
+    mirror_max_age: float = 0
+    crawler: Optional[DriveCrawler] = None
+    upload_part_size: int = 10 * 1024 * 1024
+    upload_concurrency: int = 4
+    upload_resume_ttl: float = 60 * 60 * 24
 
     def __init__(self) -> None:
-        pass
+        self._token_lock = asyncio.Lock()
+        self._token_task: Optional[asyncio.Task] = None
+        self._crawler_task: Optional[asyncio.Task] = None
+        self.token_refreshes = 0
+        self.token_refresh_failures = 0
+        self.token_refresh_seconds = 0.0
+        self.token_refresh_max_seconds = 0.0
+        self.token_retried_calls = 0
+        self.uploads = 0
+        self.rapid_uploads = 0
+        self.resumed_uploads = 0
+        self.upload_bytes_sent = 0
+        self.segmented_downloads = 0
 
     @classmethod
     async def create(
@@ -87,117 +201,950 @@ class AliyunStore(BaseStore[AliyunPath]):
         api_client: AliyunApiClient,
         refresh_token: str,
         access_token: Optional[str] = None,
+        cache_cfg: Optional[AliyunCacheConfig] = None,
+        token_refresh_margin: float = 60 * 5,
+        access_token_expires_at: Optional[float] = None,
+        on_token_refreshed: Optional[Callable[["AliyunStore"], None]] = None,
     ) -> Self:
+        """`on_token_refreshed` is called after every refresh, the refresh token rotates with it"""
+        cache_cfg = cache_cfg or AliyunCacheConfig()
         target = cls()
         target.api_client = api_client
         target.refresh_token = refresh_token
-        if not access_token:
-            await target._refresh_token()
-        else:
+        target.on_token_refreshed = on_token_refreshed
+        if (
+            access_token
+            and access_token_expires_at is not None
+            and access_token_expires_at - token_refresh_margin > time.time()
+        ):
             target.access_token = access_token
-        user_drive_info = await get_user_drive_info(target.access_token)
+            target.access_token_expires_at = access_token_expires_at
+        else:
+            await target._refresh_token()
+        user_drive_info = await api_client.get_user_drive_info(target.access_token)
         target.drive_id = user_drive_info.default_drive_id
-        target.file_id_and_file_path_mapping = bidict(
-            {},
-            max_size=128,
-            ttl=60 * 10,
+        target.path_ids = PathTrie(
+            cache_cfg.path_cache_maxsize, cache_cfg.path_cache_ttl
+        )
+        target.listing_cache = SWRCache(
+            cache_cfg.listing_maxsize,
+            cache_cfg.listing_fresh_ttl,
+            cache_cfg.listing_stale_ttl,
+        )
+        target.single_flight = SingleFlight()
+        target.file_index = FileIndex(cache_cfg.index_path, target.drive_id)
+        target.index_max_age = cache_cfg.index_max_age
+        margin = cache_cfg.download_url_margin
+        target.download_url_cache = TLRUCache(
+            cache_cfg.download_url_maxsize,
+            ttu=lambda _, info, __: info.expiration.timestamp() - margin,
+            timer=time.time,
+        )
+        target.thumbnail_cache = DiskLRUCache(
+            cache_cfg.thumbnail_dir, cache_cfg.thumbnail_max_bytes
         )
         target._make_func_auto_refresh()
+        target._token_task = asyncio.create_task(
+            target._token_refresh_loop(token_refresh_margin)
+        )
         return target
 
-    async def _refresh_token(self):
-        new_token = await self.api_client.acquire_token_by_refresh_token(
-            self.refresh_token
-        )
-        self.access_token = new_token.access_token
-        self.refresh_token = new_token.refresh_token
+    async def _refresh_token(self, stale_token: Optional[str] = None):
+        """refresh the access token, concurrent callers share a single refresh
+
+        :param stale_token: the token a failed call used, skip the refresh if it was already replaced
+        """
+        async with self._token_lock:
+            if stale_token is not None and stale_token != self.access_token:
+                return
+            start = time.perf_counter()
+            try:
+                new_token = await self.api_client.acquire_token_by_refresh_token(
+                    self.refresh_token
+                )
+            except BaseException:
+                self.token_refresh_failures += 1
+                raise
+            cost = time.perf_counter() - start
+            self.token_refreshes += 1
+            self.token_refresh_seconds += cost
+            self.token_refresh_max_seconds = max(self.token_refresh_max_seconds, cost)
+            self.access_token = new_token.access_token
+            self.refresh_token = new_token.refresh_token
+            self.access_token_expires_at = time.time() + new_token.expires_in
+            if self.on_token_refreshed is not None:
+                try:
+                    self.on_token_refreshed(self)
+                except Exception:
+                    # the tokens still work for this process, only a restart may need them
+                    logger.exception("save refreshed token failed")
+
+    async def _token_refresh_loop(self, margin: float):
+        """refresh the access token `margin` seconds before it expires"""
+        while True:
+            # create() leaves a token of known lifetime
+            assert self.access_token_expires_at is not None
+            delay = self.access_token_expires_at - time.time() - margin
+            await asyncio.sleep(max(delay, 0))
+            try:
+                await self._refresh_token()
+            except Exception:
+                logger.exception("refresh access token failed, retry later")
+                await asyncio.sleep(30)
 
     def _make_func_auto_refresh(self):
         def warp_retry_when_token_failed(func: Callable):
+            @traced(f"AliyunStore.{func.__name__}")
             async def inner_func(*args, **kwargs):
+                token = self.access_token
                 try:
                     res = await func(*args, **kwargs)
                 except (AccessTokenException, RefreshTokenException):
-                    await self._refresh_token()
+                    self.token_retried_calls += 1
+                    await self._refresh_token(token)
                     res = await func(*args, **kwargs)
                 return res
 
             return inner_func
 
         for att_name in dir(self):
+            if att_name in ("_refresh_token", "_token_refresh_loop", "dispose"):
+                continue
             att_val = getattr(self, att_name, None)
             if iscoroutinefunction(att_val):
                 setattr(self, att_name, warp_retry_when_token_failed(att_val))
 
+    @_coalesced
     async def get_file_id_by_path(self, path: StrPath) -> str:
-        if fspath(path) == "/root":
+        path = posixpath.normpath(path)
+        return (await self._resolve_paths([path], strict=True))[path]
+
+    async def resolve_paths(self, paths: Sequence[StrPath]) -> dict[str, str]:
+        """file ids of many paths in one pass, paths that do not exist are left out
+
+        every dir the paths share is visited once, names under a dir with a cached
+        listing cost no api call, the others one `get_by_path` each
+        """
+        normalized = {fspath(it): posixpath.normpath(it) for it in paths}
+        found = await self._resolve_paths(list(set(normalized.values())), strict=False)
+        return {k: found[v] for k, v in normalized.items() if v in found}
+
+    async def _resolve_paths(self, paths: list[str], strict: bool) -> dict[str, str]:
+        res: dict[str, str] = {}
+        wanted = set(paths)
+        # remaining segments of each unresolved path, under its deepest cached ancestor
+        walks: dict[tuple[str, str], dict] = {}
+        remote: list[str] = []
+        for path in paths:
+            file_id = await self._cached_file_id(path)
+            if file_id is not None:
+                res[path] = file_id
+                continue
+            ancestor = await self._cached_ancestor(path)
+            if not path.startswith(ancestor[0] + "/"):
+                remote.append(path)
+                continue
+            node = walks.setdefault(ancestor, {})
+            for name in path[len(ancestor[0]) :].split("/"):
+                if name:
+                    node = node.setdefault(name, {})
+        for (dir_path, dir_id), tree in walks.items():
+            await self._walk_cached(dir_path, dir_id, tree, wanted, res, remote)
+
+        async def _get_remote(path: str):
+            try:
+                res[path] = (await self.get_file_item_by_path(path)).file_item.file_id
+            except FileNotFound:
+                if strict:
+                    raise
+
+        await asyncio.gather(*map(_get_remote, remote))
+        return res
+
+    async def _walk_cached(
+        self,
+        dir_path: str,
+        dir_id: str,
+        tree: dict,
+        wanted: set[str],
+        res: dict[str, str],
+        remote: list[str],
+    ):
+        """resolve the names of `tree` under the dir without api calls, what is left goes to `remote`"""
+        listing = await self._cached_listing(dir_id)
+        children = (
+            {it.name: it.file_id for it in listing if it.name in tree}
+            if listing is not None
+            else {}
+        )
+        for name, subtree in tree.items():
+            path = f"{dir_path}/{name}"
+            file_id = children.get(name) or await self._cached_file_id(path)
+            if file_id is None:
+                remote.extend(_paths_of_tree(path, subtree, wanted))
+                continue
+            self._remember(file_id, path)
+            if path in wanted:
+                res[path] = file_id
+            if subtree:
+                await self._walk_cached(path, file_id, subtree, wanted, res, remote)
+
+    async def _cached_file_id(self, path: str) -> Optional[str]:
+        if path == "/root":
             return "root"
-        dir_file_id = self.file_id_and_file_path_mapping.by_val(path)
-        if dir_file_id is None:
-            # dir_file_id = await self.get_file_id_by_path(dir_path)
-            await self.get_file_item_by_path(path)
-            dir_file_id = self.file_id_and_file_path_mapping.by_val(path)
-        assert dir_file_id
-        return dir_file_id
+        file_id = self.path_ids.get(path)
+        if file_id is None:
+            file_id = await self.file_index.run(
+                self.file_index.get_id_by_path, path, self.index_max_age
+            )
+            if file_id is not None:
+                self._remember(file_id, path)
+        return file_id
+
+    async def _cached_ancestor(self, path: str) -> tuple[str, str]:
+        """(path, id) of the deepest ancestor with a known id, at worst the root"""
+        parent = posixpath.dirname(path)
+        found = self.path_ids.longest_prefix(parent) or ("/root", "root")
+        # the index may know dirs deeper than the trie
+        while len(parent) > len(found[0]):
+            file_id = await self.file_index.run(
+                self.file_index.get_id_by_path, parent, self.index_max_age
+            )
+            if file_id is not None:
+                self._remember(file_id, parent)
+                return parent, file_id
+            parent = posixpath.dirname(parent)
+        return found
+
+    async def _cached_listing(self, file_id: str) -> Optional[Sequence[AliyunFileItem]]:
+        listing = self.listing_cache.get_cached(
+            file_id, partial(self._fetch_dir_items, file_id)
+        )
+        if listing is None and self.mirror_max_age:
+            listing = await self.file_index.run(
+                self.file_index.get_children, file_id, self.mirror_max_age
+            )
+        return listing
+
+    def _remember(self, file_id: str, path: str):
+        self.path_ids[path] = file_id
 
     async def get_file_path_by_id(self, file_id: str) -> StrPath:
         if file_id == "root":
             return "/root"
-        if file_id not in self.file_id_and_file_path_mapping:
-            await self.get_file_item_by_id(file_id)
-        return self.file_id_and_file_path_mapping[file_id]
+        path = self.path_ids.path_of(file_id)
+        if path is not None:
+            return path
+        path = await self.file_index.run(
+            self.file_index.get_path_by_id, file_id, self.index_max_age
+        )
+        if path is not None:
+            self._remember(file_id, path)
+            return path
+        return (await self.get_file_item_by_id(file_id)).as_posix()
 
+    @_coalesced
     async def listdir(self, dir_path: StrPath = "/root") -> list[AliyunPath]:
         dir_file_id = await self.get_file_id_by_path(dir_path)
         assert dir_file_id
         return await self.listdir_by_file_id(dir_file_id)
 
     async def get_file_item_by_id(self, file_id: str) -> AliyunPath:
-        file_item = await get_file_detail_by_id(
+        file_item = await self.api_client.get_file_detail_by_id(
             self.access_token, drive_id=self.drive_id, file_id=file_id
         )
         assert file_item.name_path
-        return AliyunPath(
+        path = AliyunPath(
             parse_name_path(file_item.name_path), file_item=file_item, _store=self
         )
+        self._remember(file_id, path.as_posix())
+        await self.file_index.run(
+            self.file_index.upsert, posixpath.dirname(path), [file_item]
+        )
+        return path
 
     async def get_file_item_by_path(self, path: StrPath) -> AliyunPath:
-        file_item = await get_file_datail_by_path(
+        file_item = await self.api_client.get_file_datail_by_path(
             self.access_token, self.drive_id, fspath(path)
         )
-        return AliyunPath(fspath(path), file_item=file_item, _store=self)
+        path = AliyunPath(fspath(path), file_item=file_item, _store=self)
+        self._remember(file_item.file_id, path.as_posix())
+        await self.file_index.run(
+            self.file_index.upsert, posixpath.dirname(path), [file_item]
+        )
+        return path
+
+    async def get_file_items_by_ids(
+        self, file_ids: list[str], concurrency: int = 4
+    ) -> dict[str, AliyunPath]:
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _get(ids: list[str]) -> list[FileItemDetail]:
+            async with sem:
+                return await self.api_client.batch_get_file_detail(
+                    self.access_token, self.drive_id, ids
+                )
+
+        ids = list(dict.fromkeys(file_ids))
+        batches = await asyncio.gather(
+            *(
+                _get(ids[i : i + BATCH_GET_LIMIT])
+                for i in range(0, len(ids), BATCH_GET_LIMIT)
+            )
+        )
+        paths = await self._resolve_items([it for batch in batches for it in batch])
+        return {it.file_item.file_id: it for it in paths}
+
+    async def _resolve_items(self, items: Sequence[FileItem]) -> list[AliyunPath]:
+        """paths of items from anywhere in the drive, the items are written to the index"""
+        parent_ids = list({it.parent_file_id for it in items})
+        parent_paths = dict(
+            zip(
+                parent_ids,
+                map(
+                    fspath,
+                    await asyncio.gather(*map(self.get_file_path_by_id, parent_ids)),
+                ),
+            )
+        )
+        for parent_id, parent_path in parent_paths.items():
+            await self.file_index.run(
+                self.file_index.upsert,
+                parent_path,
+                [it for it in items if it.parent_file_id == parent_id],
+            )
+        return [
+            AliyunPath(
+                parent_paths[it.parent_file_id], it.name, file_item=it, _store=self
+            )
+            for it in items
+        ]
 
     async def listdir_by_file_id(self, file_id: str) -> list[AliyunPath]:
-        parent_path = await self.get_file_path_by_id(file_id)
-        file_list = await get_file_list(
-            self.access_token, drive_id=self.drive_id, parent_file_id=file_id
+        items = await self.listing_cache.get(
+            file_id, partial(self._fetch_dir_items, file_id)
+        )
+        return await self._to_paths(file_id, items)
+
+    async def listdir_page(
+        self, dir_path: StrPath, marker: Optional[str] = None, limit: int = 100
+    ) -> tuple[list[AliyunPath], Optional[str]]:
+        dir_file_id = await self.get_file_id_by_path(dir_path)
+        return await self.listdir_page_by_file_id(dir_file_id, marker, limit)
+
+    async def listdir_page_by_file_id(
+        self, file_id: str, marker: Optional[str] = None, limit: int = 100
+    ) -> tuple[list[AliyunPath], Optional[str]]:
+        items, marker = await self._get_file_list_page(file_id, marker, limit)
+        await self._index_items(file_id, items)
+        return await self._to_paths(file_id, items), marker
+
+    async def iter_dir(
+        self, dir_path: StrPath, limit: int = 100, marker: Optional[str] = None
+    ) -> AsyncIterator[AliyunPath]:
+        dir_file_id = await self.get_file_id_by_path(dir_path)
+        async for it in self.iter_dir_by_file_id(dir_file_id, limit, marker):
+            yield it
+
+    async def iter_dir_by_file_id(
+        self, file_id: str, limit: int = 100, marker: Optional[str] = None
+    ) -> AsyncIterator[AliyunPath]:
+        if marker is None:
+            cached = self.listing_cache.get_cached(
+                file_id, partial(self._fetch_dir_items, file_id)
+            )
+            if cached is not None:
+                for it in await self._to_paths(file_id, cached):
+                    yield it
+                return
+
+        # a walk from the first page is a full listing, keep it for the cache
+        walked: Optional[list[FileItem]] = [] if marker is None else None
+        while True:
+            items, marker = await self._get_file_list_page(file_id, marker, limit)
+            if walked is not None:
+                walked.extend(items)
+            else:
+                await self._index_items(file_id, items)
+            for it in await self._to_paths(file_id, items):
+                yield it
+            if not marker:
+                break
+        if walked is not None:
+            await self._index_items(file_id, walked, full=True)
+            self.listing_cache.set(file_id, list(map(FileEntry.from_item, walked)))
+
+    async def _get_file_list_page(
+        self, file_id: str, marker: Optional[str] = None, limit: int = 100
+    ) -> tuple[list[FileItem], Optional[str]]:
+        params = {}
+        if marker:
+            params["marker"] = marker
+        file_list = await self.api_client.get_file_list(
+            self.access_token,
+            drive_id=self.drive_id,
+            parent_file_id=file_id,
+            limit=limit,
+            **params,
         )
+        return file_list.items, (file_list.next_marker or None)
+
+    async def _fetch_dir_items(self, file_id: str) -> list[FileEntry]:
+        if self.mirror_max_age:
+            items = await self.file_index.run(
+                self.file_index.get_children, file_id, self.mirror_max_age
+            )
+            if items is not None:
+                return items
+        return await self._list_remote_dir(file_id)
+
+    async def _list_remote_dir(
+        self, file_id: str, updated_at: Optional[float] = None
+    ) -> list[FileEntry]:
+        """list all pages of the dir from the api, `updated_at` of the dir is kept in the index"""
+        items: list[FileItem] = []
+        marker = None
+        while True:
+            page, marker = await self._get_file_list_page(file_id, marker)
+            items.extend(page)
+            if not marker:
+                await self._index_items(
+                    file_id, items, full=True, updated_at=updated_at
+                )
+                return list(map(FileEntry.from_item, items))
+
+    async def _index_items(
+        self,
+        parent_file_id: str,
+        items: list[FileItem],
+        full: bool = False,
+        updated_at: Optional[float] = None,
+    ):
+        """write listed items to the persistent index, a full listing also drops removed children"""
+        parent_path = fspath(await self.get_file_path_by_id(parent_file_id))
+        if full:
+            await self.file_index.run(
+                self.file_index.replace_children,
+                parent_file_id,
+                parent_path,
+                items,
+                updated_at,
+            )
+        else:
+            await self.file_index.run(self.file_index.upsert, parent_path, items)
+
+    async def _to_paths(
+        self, parent_file_id: str, items: Sequence[AliyunFileItem]
+    ) -> list[AliyunPath]:
+        parent_path = fspath(await self.get_file_path_by_id(parent_file_id))
+        return [
+            AliyunPath(parent_path, it.name, file_item=it, _store=self) for it in items
+        ]
+
+    async def search(
+        self, query: SearchQuery
+    ) -> tuple[list[AliyunPath], Optional[str]]:
+        if not await self.index_complete():
+            return await self._search_remote(query)
+        found, cursor = await self.file_index.run(self.file_index.search, query)
+        return [
+            AliyunPath(path, file_item=it, _store=self) for path, it in found
+        ], cursor
+
+    async def index_complete(self) -> bool:
+        # only once the crawler walked the whole drive
+        return self.crawler is not None and bool(
+            await self.file_index.run(
+                self.file_index.get_meta, "last_crawl_finished_at"
+            )
+        )
+
+    async def timeline(
+        self,
+        granularity: Literal["day", "month"] = "month",
+        category: Optional[str] = None,
+    ) -> list[TimelineBucket]:
+        # served from the index only, never walks the drive on the request path
         return [
-            AliyunPath(fspath(parent_path), it.name, file_item=it, _store=self)
-            for it in file_list.items
+            TimelineBucket(*it)
+            for it in await self.file_index.run(
+                self.file_index.timeline, granularity, category
+            )
         ]
 
+    async def timeline_items(
+        self,
+        bucket: str,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> tuple[list[AliyunPath], Optional[str]]:
+        found, cursor = await self.file_index.run(
+            self.file_index.timeline_items, bucket, limit, cursor, category
+        )
+        return [
+            AliyunPath(path, file_item=it, _store=self) for path, it in found
+        ], cursor
+
+    async def _search_remote(
+        self, query: SearchQuery
+    ) -> tuple[list[AliyunPath], Optional[str]]:
+        conds = []
+        if query.name:
+            conds.append(f"name match {json.dumps(query.name)}")
+        if query.type:
+            conds.append(f'type = "{query.type}"')
+        if query.category:
+            conds.append(f"category in {json.dumps(query.category)}")
+        if query.extension:
+            conds.append(f"file_extension in {json.dumps(query.extension)}")
+        for field, op, value in (
+            ("size", ">=", query.min_size),
+            ("size", "<=", query.max_size),
+            ("created_at", ">=", query.created_after),
+            ("created_at", "<", query.created_before),
+            ("updated_at", ">=", query.updated_after),
+            ("updated_at", "<", query.updated_before),
+        ):
+            if isinstance(value, datetime):
+                conds.append(f'{field} {op} "{value.isoformat(timespec="seconds")}"')
+            elif value is not None:
+                conds.append(f"{field} {op} {value}")
+        if not conds:
+            raise ValueError("搜索条件为空")
+        params = {}
+        if query.order_by != "relevance":
+            params["order_by"] = query.order_by
+            params["order_direction"] = query.order_direction
+        if query.cursor:
+            params["marker"] = query.cursor
+        resp = await self.api_client.search_file(
+            self.access_token,
+            drive_id=self.drive_id,
+            query=" and ".join(conds),
+            limit=min(query.limit, 100),
+            **params,
+        )
+        res = await self._resolve_items(resp.items)
+        if query.under:
+            # the remote search has no path filter, a page may come out short
+            prefix = query.under.rstrip("/") + "/"
+            res = [it for it in res if it.as_posix().startswith(prefix)]
+        return res, resp.next_marker or None
+
+    async def mkdir(self, dir_path: StrPath) -> bool:
+        dir_path = PurePosixPath(dir_path)
+        parent_file_id = await self.get_file_id_by_path(dir_path.parent)
+        res = await self.api_client.create_folder(
+            self.access_token, self.drive_id, parent_file_id, dir_path.name
+        )
+        if res.exist:
+            raise FileExistsError(f"{dir_path} 已存在")
+        self.listing_cache.invalidate(parent_file_id)
+        await self.file_index.run(self.file_index.invalidate_dir, parent_file_id)
+        self._remember(res.file_id, dir_path.as_posix())
+        await self.file_index.run(
+            self.file_index.add, res.file_id, parent_file_id, dir_path.as_posix()
+        )
+        return True
+
+    async def rmfile(self, path: StrPath) -> bool:
+        path = PurePosixPath(path)
+        file_id = await self.get_file_id_by_path(path)
+        parent_file_id = await self.get_file_id_by_path(path.parent)
+        await self.api_client.trash_file(self.access_token, self.drive_id, file_id)
+        self.listing_cache.invalidate(parent_file_id)
+        await self.file_index.run(self.file_index.invalidate_dir, parent_file_id)
+        await self._forget(file_id, path.as_posix())
+        return True
+
+    async def rmdir(self, dir_path: StrPath) -> bool:
+        return await self.rmfile(dir_path)
+
+    async def rename(self, path: StrPath, new_name: str) -> bool:
+        path = PurePosixPath(path)
+        file_id = await self.get_file_id_by_path(path)
+        parent_file_id = await self.get_file_id_by_path(path.parent)
+        await self.api_client.update_file(
+            self.access_token, self.drive_id, file_id, new_name
+        )
+        self.listing_cache.invalidate(parent_file_id)
+        await self.file_index.run(self.file_index.invalidate_dir, parent_file_id)
+        await self._forget(file_id, path.as_posix())
+        new_path = path.with_name(new_name).as_posix()
+        self._remember(file_id, new_path)
+        await self.file_index.run(
+            self.file_index.add, file_id, parent_file_id, new_path
+        )
+        return True
+
+    async def upload(
+        self,
+        dir_path: StrPath,
+        name: str,
+        content: UploadBuffer,
+        on_conflict: Literal["auto_rename", "refuse", "ignore"] = "auto_rename",
+    ) -> UploadResult:
+        dir_path = posixpath.normpath(dir_path)
+        parent_file_id = await self.get_file_id_by_path(dir_path)
+        size = content.size
+        # the same content sent again to the same place resumes the upload
+        key = f"{parent_file_id}/{name}/{size}/{content.content_hash}"
+        done: set[int] = set()
+        urls: dict[int, str] = {}
+        state = await self.file_index.run(
+            self.file_index.get_upload, key, self.upload_resume_ttl
+        )
+        if state is not None:
+            file_id, upload_id, part_size = state
+            try:
+                uploaded = await self.api_client.list_uploaded_parts(
+                    self.access_token, self.drive_id, file_id, upload_id
+                )
+                done = {it.part_number for it in uploaded}
+                self.resumed_uploads += 1
+            except (AccessTokenException, RefreshTokenException):
+                raise
+            except AliyunException:
+                logger.info("upload %s can not be resumed, start over", key)
+                await self.file_index.run(self.file_index.delete_upload, key)
+                state = None
+        if state is None:
+            part_size = max(self.upload_part_size, -(-size // MAX_PART_COUNT))
+            # the content is hashed as it came in, so the drive can skip the transfer
+            # if it has the content already
+            proof = proof_code(
+                await content.read_at(proof_offset(self.access_token, size), 8)
+            )
+            resp = await self.api_client.create_file(
+                self.access_token,
+                self.drive_id,
+                parent_file_id,
+                name,
+                size,
+                max(-(-size // part_size), 1),
+                content.content_hash,
+                proof,
+                on_conflict,
+            )
+            if resp.exist and on_conflict == "refuse":
+                raise FileExistsError(f"{dir_path}/{name} 已存在")
+            self.listing_cache.invalidate(parent_file_id)
+            await self.file_index.run(self.file_index.invalidate_dir, parent_file_id)
+            if resp.rapid_upload:
+                self.uploads += 1
+                self.rapid_uploads += 1
+                return UploadResult(
+                    await self.get_file_item_by_id(resp.file_id), True, 0
+                )
+            file_id, upload_id = resp.file_id, resp.upload_id
+            assert upload_id
+            await self.file_index.run(
+                self.file_index.set_upload, key, file_id, upload_id, part_size
+            )
+            urls = {
+                it.part_number: it.upload_url
+                for it in resp.part_info_list
+                if it.upload_url
+            }
+
+        transfer = MultipartUpload(
+            self.api_client,
+            lambda: self.access_token,
+            self.drive_id,
+            file_id,
+            upload_id,
+            content,
+            part_size,
+            self.upload_concurrency,
+            timeout=self.transfer_timeout,
+        )
+        part_count = max(-(-size // part_size), 1)
+        try:
+            await transfer.send(
+                [it for it in range(1, part_count + 1) if it not in done], urls
+            )
+        finally:
+            self.upload_bytes_sent += transfer.bytes_sent
+        item = await self.api_client.complete_upload(
+            self.access_token, self.drive_id, file_id, upload_id
+        )
+        await self.file_index.run(self.file_index.delete_upload, key)
+        self.listing_cache.invalidate(parent_file_id)
+        await self.file_index.run(self.file_index.invalidate_dir, parent_file_id)
+        await self.file_index.run(self.file_index.upsert, dir_path, [item])
+        path = AliyunPath(dir_path, item.name, file_item=item, _store=self)
+        self._remember(item.file_id, path.as_posix())
+        self.uploads += 1
+        return UploadResult(path, False, transfer.bytes_sent)
+
+    async def _forget(self, file_id: str, path: str):
+        """drop cached listing and path mappings of the file and everything under it"""
+        self.listing_cache.invalidate(file_id)
+        await self.file_index.run(self.file_index.remove_tree, path)
+        for it in self.path_ids.pop_tree(path):
+            self.listing_cache.invalidate(it)
+
+    async def get_content_key(self, path: StrPath) -> str:
+        file_item = await self._get_cached_file_item(fspath(path))
+        if file_item.file_type != "file":
+            raise ValueError(f"{path} 不是文件")
+        if file_item.content_hash:
+            return file_item.content_hash
+        return f"{file_item.file_id}-{file_item.updated_at.timestamp():.0f}"
+
+    async def get_thumbnail(self, path: StrPath, width: int = 512) -> CachedFile:
+        path = fspath(path)
+        file_item = await self._get_cached_file_item(path)
+        if file_item.file_type != "file":
+            raise ValueError(f"{path} 不是文件")
+        key = f"{file_item.content_hash or file_item.file_id}-{width}"
+        cached = self.thumbnail_cache.get(key)
+        if cached is None:
+            cached = await self.single_flight.do(
+                ("thumbnail", key),
+                partial(self._fetch_thumbnail, file_item, width, key),
+            )
+        with open(cached, "rb") as f:
+            media_type = sniff_image_type(f.read(16))
+        return CachedFile(cached, f'"{key}"', media_type)
+
+    async def _get_cached_file_item(self, path: str) -> AliyunFileItem:
+        """file item from the cached listing of its parent if there is one, else from the api"""
+        parent_path, name = posixpath.split(path)
+        parent_file_id = await self._cached_file_id(parent_path)
+        if parent_file_id is not None:
+            for it in self.listing_cache.get_cached(parent_file_id) or ():
+                if it.name == name:
+                    return it
+        if self.mirror_max_age:
+            item = await self.file_index.run(self.file_index.get_item_by_path, path)
+            if item is not None:
+                return item
+        return (await self.get_file_item_by_path(path)).file_item
+
+    async def _fetch_thumbnail(
+        self, file_item: AliyunFileItem, width: int, key: str
+    ) -> str:
+        url = file_item.thumbnail if width == LIST_THUMBNAIL_WIDTH else None
+        for fresh in (False, True):
+            if url is None or fresh:
+                detail = await self.api_client.get_file_detail_by_id(
+                    self.access_token,
+                    drive_id=self.drive_id,
+                    file_id=file_item.file_id,
+                    image_thumbnail_width=width,
+                )
+                url = detail.thumbnail
+            if not url:
+                raise ValueError(f"{file_item.name} 没有缩略图")
+            try:
+                async with self.api_client.session.client.get(
+                    url, raise_for_status=True
+                ) as resp:
+                    with self.thumbnail_cache.writer(key) as f:
+                        async for chunk in resp.content.iter_chunked(64 * 1024):
+                            f.write(chunk)
+                break
+            except ClientResponseError as e:
+                # the url from a cached listing may have expired, retry with a fresh one
+                if fresh or e.status not in (403, 404, 410):
+                    raise
+        cached = self.thumbnail_cache.get(key)
+        assert cached
+        return cached
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "path_trie": self.path_ids.stats(),
+            "listing_cache": self.listing_cache.stats(),
+            "single_flight": self.single_flight.stats(),
+            "file_index": self.file_index.stats(),
+            "thumbnail_cache": self.thumbnail_cache.stats(),
+            "crawler": self.crawler.stats() if self.crawler else None,
+            "http": self.api_client.session.stats(),
+            "download": {"segmented": self.segmented_downloads},
+            "upload": {
+                "uploads": self.uploads,
+                "rapid_uploads": self.rapid_uploads,
+                "resumed_uploads": self.resumed_uploads,
+                "bytes_sent": self.upload_bytes_sent,
+            },
+            "token": {
+                "refreshes": self.token_refreshes,
+                "refresh_failures": self.token_refresh_failures,
+                "refresh_seconds_total": self.token_refresh_seconds,
+                "refresh_seconds_max": self.token_refresh_max_seconds,
+                "retried_calls": self.token_retried_calls,
+                "expires_in": (
+                    self.access_token_expires_at - time.time()
+                    if self.access_token_expires_at
+                    else None
+                ),
+            },
+        }
+
     async def get_download_url(self, path: StrPath) -> str:
         file_id = await self.get_file_id_by_path(path)
         if file_id is None:
             raise ValueError(f"{path} 路径不存在")
         return await self.get_download_url_by_file_id(file_id)
 
+    async def get_download_urls(
+        self, paths: list[StrPath], concurrency: int = 8
+    ) -> dict[str, str | Exception]:
+        ids = await self.resolve_paths(paths)
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _get(path: str) -> str:
+            if path not in ids:
+                raise ValueError(f"{path} 路径不存在")
+            async with sem:
+                return await self.get_download_url_by_file_id(ids[path])
+
+        keys = list(map(fspath, paths))
+        res = await asyncio.gather(*map(_get, keys), return_exceptions=True)
+        return dict(zip(keys, res))  # type: ignore
+
+    @_coalesced
     async def get_download_url_by_file_id(self, file_id: str) -> str:
-        res = await get_download_url(self.access_token, self.drive_id, file_id)
-        return res.url
+        info = self.download_url_cache.get(file_id)
+        if info is None:
+            info = await self.api_client.get_download_url(
+                self.access_token, self.drive_id, file_id
+            )
+            self.download_url_cache[file_id] = info
+        return info.url
+
+    def _download_url_getter(self, file_id: str) -> UrlGetter:
+        async def get_url(fresh: bool) -> str:
+            if fresh:
+                self.download_url_cache.pop(file_id, None)
+            return await self.get_download_url_by_file_id(file_id)
+
+        return get_url
+
+    async def open_file(
+        self, path: StrPath, offset: int = 0, length: Optional[int] = None
+    ) -> RemoteFileStream:
+        if isinstance(path, AliyunPath):
+            # paths from listings carry their item already
+            file_item = path.file_item
+        else:
+            file_item = await self._get_cached_file_item(fspath(path))
+        if file_item.file_type != "file":
+            raise ValueError(f"{path} 不是文件")
+        get_url = self._download_url_getter(file_item.file_id)
+        size = file_item.size
+        if size is not None and length is None:
+            length = size - offset
+        if (
+            self.download_segmented_min_size
+            and length is not None
+            and length >= self.download_segmented_min_size
+        ):
+            self.segmented_downloads += 1
+            return SegmentedFileStream(
+                self.api_client.session.client,
+                get_url,
+                size,
+                offset,
+                length,
+                chunk_size=self.stream_chunk_size,
+                read_ahead=self.stream_read_ahead,
+                segment_size=self.download_segment_size,
+                connections=self.download_connections,
+                timeout=self.transfer_timeout,
+            )
+        return RemoteFileStream(
+            self.api_client.session.client,
+            get_url,
+            size,
+            offset,
+            length,
+            chunk_size=self.stream_chunk_size,
+            read_ahead=self.stream_read_ahead,
+            timeout=self.transfer_timeout,
+        )
 
     @classmethod
-    async def spawn(cls, cfg: AliyunConfig):
-        api_client = AliyunApiClient(cfg.client_id, cfg.client_secret)
-        store = await cls.create(api_client, cfg.refresh_token, cfg.access_token)
+    async def spawn(
+        cls, cfg: AliyunConfig, on_config_changed: Optional[Callable[[], None]] = None
+    ):
+        session = ApiSession(
+            cfg.http.base_url,
+            limit=cfg.http.limit,
+            limit_per_host=cfg.http.limit_per_host,
+            keepalive_timeout=cfg.http.keepalive_timeout,
+            dns_cache_ttl=cfg.http.dns_cache_ttl,
+            timeout=cfg.http.timeout,
+            rate_limiter=RateLimiter(
+                RateLimit(cfg.http.rate_limit.rate, cfg.http.rate_limit.burst),
+                {
+                    path: RateLimit(limit.rate, limit.burst)
+                    for path, limit in cfg.http.endpoint_rate_limits.items()
+                },
+            ),
+            max_retries=cfg.http.max_retries,
+        )
+        api_client = AliyunApiClient(cfg.client_id, cfg.client_secret, session)
 
-        async def dispose():
-            await store.dispose()
+        def save_tokens(store: AliyunStore):
             cfg.access_token = store.access_token
             cfg.refresh_token = store.refresh_token
+            cfg.access_token_expires_at = store.access_token_expires_at
+            if on_config_changed is not None:
+                on_config_changed()
+
+        try:
+            store = await cls.create(
+                api_client,
+                cfg.refresh_token,
+                cfg.access_token,
+                cfg.cache,
+                cfg.token_refresh_margin,
+                cfg.access_token_expires_at,
+                save_tokens,
+            )
+        except BaseException:
+            await api_client.close()
+            raise
+        store.stream_chunk_size = cfg.http.stream_chunk_size
+        store.stream_read_ahead = cfg.http.stream_read_ahead
+        store.download_segmented_min_size = cfg.http.download_segmented_min_size
+        store.download_segment_size = cfg.http.download_segment_size
+        store.download_connections = cfg.http.download_connections
+        store.transfer_timeout = ClientTimeout(
+            total=None,
+            sock_connect=cfg.http.transfer_connect_timeout,
+            sock_read=cfg.http.transfer_read_timeout,
+        )
+        store.upload_part_size = cfg.upload.part_size
+        store.upload_concurrency = cfg.upload.concurrency
+        store.upload_resume_ttl = cfg.upload.resume_ttl
+        if cfg.crawler.enabled:
+            store.crawler = DriveCrawler(
+                store,
+                cfg.crawler.concurrency,
+                cfg.crawler.interval,
+                cfg.crawler.max_age,
+            )
+            store.mirror_max_age = cfg.crawler.max_age
+
+        async def dispose():
+            await store.dispose()
+            save_tokens(store)
 
         return store, dispose
 
+    def start_background_tasks(self):
+        if self.crawler is not None and self._crawler_task is None:
+            self._crawler_task = asyncio.create_task(self.crawler.run())
+
     async def dispose(self):
-        pass
+        if self._token_task is not None:
+            self._token_task.cancel()
+        if self._crawler_task is not None:
+            self._crawler_task.cancel()
+        await asyncio.to_thread(self.file_index.close)
+        await self.api_client.close()
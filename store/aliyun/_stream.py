@@ -0,0 +1,286 @@
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from aiohttp import (
+    ClientConnectionError,
+    ClientPayloadError,
+    ClientResponseError,
+    ClientSession,
+    ClientTimeout,
+)
+
+from utils import tracer
+
+# (fresh) -> download url, fresh=True must not return a cached url
+UrlGetter = Callable[[bool], Awaitable[str]]
+
+_EOF = object()
+# statuses of an expired signed url
+_URL_EXPIRED_STATUS = (403, 410)
+# no total, a transfer lasts as long as its reader, but a stalled one is given up
+TRANSFER_TIMEOUT = ClientTimeout(total=None, sock_connect=30, sock_read=60)
+# a stalled or dropped connection, resumed with the same url
+_NETWORK_ERRORS = (asyncio.TimeoutError, ClientConnectionError)
+
+
+class RemoteFileStream:
+    """async readable stream of (a range of) a remote file
+
+    a producer task reads ahead at most `read_ahead` chunks into a bounded queue, so
+    memory stays constant whatever the file size. an expired url resumes from the
+    current position with a fresh url, a stalled or broken connection with the same
+    one. `timeout` applies to each request.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        get_url: UrlGetter,
+        size: Optional[int],
+        offset: int = 0,
+        length: Optional[int] = None,
+        chunk_size: int = 256 * 1024,
+        read_ahead: int = 8,
+        max_retries: int = 3,
+        timeout: ClientTimeout = TRANSFER_TIMEOUT,
+    ) -> None:
+        self.size = size
+        self._session = session
+        self._timeout = timeout
+        self._get_url = get_url
+        self._chunk_size = chunk_size
+        self._read_ahead = read_ahead
+        self._max_retries = max_retries
+        self._task: Optional[asyncio.Task] = None
+        self._reset(offset, length)
+
+    def _reset(self, offset: int, length: Optional[int]):
+        if length is None and self.size is not None:
+            length = self.size - offset
+        self.offset = offset
+        self.length = length
+        self._queue: asyncio.Queue = asyncio.Queue(self._read_ahead)
+        self._pending = b""
+        self._eof = False
+
+    async def seek(self, offset: int, length: Optional[int] = None):
+        """restart the stream at `offset`, for `length` bytes (to the end when None)"""
+        await self._stop()
+        self._task = None
+        self._reset(offset, length)
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._produce())
+
+    async def _produce(self):
+        try:
+            end = None if self.length is None else self.offset + self.length
+            await self._produce_range(self.offset, end)
+            await self._queue.put(_EOF)
+        except Exception as e:
+            await self._queue.put(e)
+
+    async def _produce_range(self, pos: int, end: Optional[int]):
+        """queue the bytes of [pos, end) over one connection"""
+        retries = 0
+        fresh = False
+        while end is None or pos < end:
+            url = await self._get_url(fresh)
+            headers = {}
+            if pos or end is not None:
+                headers["Range"] = f"bytes={pos}-{'' if end is None else end - 1}"
+            try:
+                async with self._session.get(
+                    url, headers=headers, raise_for_status=True, timeout=self._timeout
+                ) as resp:
+                    # the server ignored the range, skip to the position by hand
+                    skip = pos if resp.status == 200 else 0
+                    async for chunk in resp.content.iter_chunked(self._chunk_size):
+                        if skip:
+                            drop = min(skip, len(chunk))
+                            chunk, skip = chunk[drop:], skip - drop
+                            if not chunk:
+                                continue
+                        if end is not None and pos + len(chunk) > end:
+                            chunk = chunk[: end - pos]
+                        pos += len(chunk)
+                        await self._queue.put(chunk)
+                        if end is not None and pos >= end:
+                            break
+                if end is None:
+                    break
+                if pos < end:
+                    raise ClientPayloadError("response ended before the range")
+            except (ClientResponseError, ClientPayloadError) as e:
+                if (
+                    isinstance(e, ClientResponseError)
+                    and e.status not in _URL_EXPIRED_STATUS
+                ):
+                    raise
+                retries += 1
+                if retries > self._max_retries:
+                    raise
+                # signed url expired or the response was cut short
+                fresh = True
+            except _NETWORK_ERRORS:
+                retries += 1
+                if retries > self._max_retries:
+                    raise
+                fresh = False
+
+    async def _next_chunk(self) -> bytes:
+        if self._eof:
+            return b""
+        self._start()
+        item = await self._queue.get()
+        if item is _EOF:
+            self._eof = True
+            return b""
+        if isinstance(item, Exception):
+            self._eof = True
+            raise item
+        return item
+
+    async def read(self, n: int = -1) -> bytes:
+        """read up to n bytes, all remaining bytes when n < 0, b"" at the end"""
+        if n < 0:
+            parts = [self._pending]
+            self._pending = b""
+            while chunk := await self._next_chunk():
+                parts.append(chunk)
+            return b"".join(parts)
+        if not self._pending:
+            self._pending = await self._next_chunk()
+        res, self._pending = self._pending[:n], self._pending[n:]
+        return res
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._pending:
+            chunk, self._pending = self._pending, b""
+            yield chunk
+        while chunk := await self._next_chunk():
+            yield chunk
+
+    async def close(self):
+        self._eof = True
+        await self._stop()
+
+    async def _stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+
+class _RangeIgnored(Exception):
+    pass
+
+
+class SegmentedFileStream(RemoteFileStream):
+    """RemoteFileStream that fetches `segment_size` ranges over up to `connections` connections at once
+
+    segments are queued in order as they complete, so at most `connections` of them
+    are held in memory. all connections share one url, the first to find it expired
+    renews it for the others. files of unknown size, and servers that do not serve
+    ranges, fall back to a single connection.
+    """
+
+    def __init__(
+        self,
+        *args,
+        segment_size: int = 4 * 1024 * 1024,
+        connections: int = 4,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._segment_size = segment_size
+        self._connections = connections
+        self._url: Optional[str] = None
+        self._url_lock = asyncio.Lock()
+
+    async def _current_url(self, stale: Optional[str] = None) -> str:
+        """the shared url, renewed when `stale` is still the current one"""
+        async with self._url_lock:
+            if self._url is None or self._url == stale:
+                self._url = await self._get_url(stale is not None)
+            return self._url
+
+    async def _produce(self):
+        if self.length is None:
+            return await super()._produce()
+        pos, end = self.offset, self.offset + self.length
+        tasks: deque[asyncio.Task[bytes]] = deque()
+        starts = iter(range(pos, end, self._segment_size))
+        try:
+
+            def schedule():
+                for start in starts:
+                    stop = min(start + self._segment_size, end)
+                    tasks.append(asyncio.create_task(self._fetch(start, stop)))
+                    if len(tasks) >= self._connections:
+                        break
+
+            schedule()
+            while tasks:
+                try:
+                    data = await tasks.popleft()
+                except _RangeIgnored:
+                    break
+                schedule()
+                for i in range(0, len(data), self._chunk_size):
+                    await self._queue.put(data[i : i + self._chunk_size])
+                pos += len(data)
+            if pos < end:
+                await self._produce_range(pos, end)
+            await self._queue.put(_EOF)
+        except Exception as e:
+            await self._queue.put(e)
+        finally:
+            for it in tasks:
+                it.cancel()
+            # wait for them to unwind, their connections are released and no error goes unretrieved
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch(self, start: int, end: int) -> bytes:
+        """bytes of [start, end), retried with a fresh url like the single connection stream"""
+        retries = 0
+        url = await self._current_url()
+        with tracer.span("download.segment", "client", offset=start, size=end - start):
+            while True:
+                try:
+                    async with self._session.get(
+                        url,
+                        headers={"Range": f"bytes={start}-{end - 1}"},
+                        raise_for_status=True,
+                        timeout=self._timeout,
+                    ) as resp:
+                        if resp.status == 200 and (start, end) != (0, self.size):
+                            raise _RangeIgnored()
+                        data = await resp.read()
+                    if len(data) != end - start:
+                        raise ClientPayloadError("response ended before the range")
+                    return data
+                except (ClientResponseError, ClientPayloadError) as e:
+                    if (
+                        isinstance(e, ClientResponseError)
+                        and e.status not in _URL_EXPIRED_STATUS
+                    ):
+                        raise
+                    retries += 1
+                    if retries > self._max_retries:
+                        raise
+                    url = await self._current_url(url)
+                except _NETWORK_ERRORS:
+                    retries += 1
+                    if retries > self._max_retries:
+                        raise
@@ -0,0 +1,107 @@
+import asyncio
+import random
+from typing import Callable
+
+from aiohttp import ClientError, ClientResponseError, ClientTimeout
+
+from store.backend.aliyun import AliyunApiClient, upload_part
+from store.utils import UploadBuffer
+from utils import tracer
+
+from ._stream import TRANSFER_TIMEOUT
+
+# parts per getUploadUrl request
+_URL_BATCH = 100
+
+
+class MultipartUpload:
+    """sends the parts of one upload to their signed urls, `concurrency` at a time
+
+    an expired url is replaced through getUploadUrl, network and server errors are
+    retried with backoff, the parts that made it stay uploaded for a later resume.
+    """
+
+    def __init__(
+        self,
+        api_client: AliyunApiClient,
+        access_token: Callable[[], str],
+        drive_id: str,
+        file_id: str,
+        upload_id: str,
+        content: UploadBuffer,
+        part_size: int,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        timeout: ClientTimeout = TRANSFER_TIMEOUT,
+    ) -> None:
+        self.api_client = api_client
+        self.access_token = access_token
+        self.drive_id = drive_id
+        self.file_id = file_id
+        self.upload_id = upload_id
+        self.content = content
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.bytes_sent = 0
+
+    async def send(self, part_numbers: list[int], urls: dict[int, str]):
+        """send the parts, `urls` are the signed urls already known"""
+        urls = dict(urls)
+        missing = [it for it in part_numbers if it not in urls]
+        for batch in await asyncio.gather(
+            *(
+                self._fresh_urls(missing[i : i + _URL_BATCH])
+                for i in range(0, len(missing), _URL_BATCH)
+            )
+        ):
+            urls.update(batch)
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def _send(part_number: int):
+            async with sem:
+                await self._send_part(part_number, urls[part_number])
+
+        await asyncio.gather(*map(_send, part_numbers))
+
+    async def _send_part(self, part_number: int, url: str):
+        data = await self.content.read_at(
+            (part_number - 1) * self.part_size, self.part_size
+        )
+        with tracer.span(
+            "upload.part", "client", part_number=part_number, size=len(data)
+        ) as span:
+            attempt = 0
+            while True:
+                span.set_attribute("attempts", attempt + 1)
+                try:
+                    await upload_part(
+                        self.api_client.session.client, url, data, self.timeout
+                    )
+                    self.bytes_sent += len(data)
+                    return
+                except ClientResponseError as e:
+                    # the signature of the url expired
+                    expired = e.status in (403, 404, 410)
+                    if attempt >= self.max_retries or not (expired or e.status >= 500):
+                        raise
+                    if expired:
+                        url = (await self._fresh_urls([part_number]))[part_number]
+                        attempt += 1
+                        continue
+                except (ClientError, asyncio.TimeoutError):
+                    if attempt >= self.max_retries:
+                        raise
+                await asyncio.sleep(random.uniform(0, min(10, 0.5 * 2**attempt)))
+                attempt += 1
+
+    async def _fresh_urls(self, part_numbers: list[int]) -> dict[int, str]:
+        parts = await self.api_client.get_upload_url(
+            self.access_token(),
+            self.drive_id,
+            self.file_id,
+            self.upload_id,
+            part_numbers,
+        )
+        return {it.part_number: it.upload_url for it in parts if it.upload_url}
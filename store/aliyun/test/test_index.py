@@ -0,0 +1,150 @@
+import threading
+from datetime import datetime, timezone
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from store.aliyun._index import FileIndex
+from store.backend.aliyun import FileItem
+from store.base import SearchQuery
+
+
+def _item(file_id: str, name: str, parent: str = "root", size: int = 10):
+    return FileItem(
+        drive_id="d",
+        file_id=file_id,
+        parent_file_id=parent,
+        name=name,
+        type="file",
+        size=size,
+        file_extension=name.rsplit(".", 1)[-1],
+        created_at=datetime(2024, 1, 1),
+        updated_at=datetime(2024, 1, 1),
+    )
+
+
+class TestFileIndexSearch(TestCase):
+    def setUp(self) -> None:
+        self.index = FileIndex(":memory:", "d")
+        self.index.replace_children(
+            "root",
+            "/root",
+            [
+                _item("a", "Holiday_2024.jpg", size=5),
+                _item("b", "holiday notes.txt"),
+                _item("c", "beach.jpg", size=50),
+            ],
+        )
+
+    def search(self, **kwargs) -> list[str]:
+        found, _ = self.index.search(SearchQuery(**kwargs))
+        return [path for path, _ in found]
+
+    def test_name(self):
+        self.assertEqual(
+            self.search(name="holi"),
+            ["/root/Holiday_2024.jpg", "/root/holiday notes.txt"],
+        )
+        self.assertEqual(self.search(name="_2024"), ["/root/Holiday_2024.jpg"])
+        self.assertEqual(self.search(name="beach", match="prefix"), ["/root/beach.jpg"])
+        self.assertIn(
+            "/root/holiday notes.txt", self.search(name="holdiay", match="fuzzy")
+        )
+
+    def test_filters(self):
+        self.assertEqual(
+            self.search(extension=["jpg"], order_by="size", order_direction="DESC"),
+            ["/root/beach.jpg", "/root/Holiday_2024.jpg"],
+        )
+        self.assertEqual(self.search(min_size=20), ["/root/beach.jpg"])
+
+    def test_follows_listing(self):
+        self.index.replace_children("root", "/root", [_item("c", "sunset.jpg")])
+        self.assertEqual(self.search(name="beach"), [])
+        self.assertEqual(self.search(name="sun"), ["/root/sunset.jpg"])
+
+    def test_cursor(self):
+        found, cursor = self.index.search(SearchQuery(limit=2))
+        rest, end = self.index.search(SearchQuery(limit=2, cursor=cursor))
+        self.assertEqual(len(found) + len(rest), 3)
+        self.assertIsNone(end)
+
+
+def _dir(file_id: str, name: str, parent: str = "root"):
+    return _item(file_id, name, parent).model_copy(
+        update={"file_type": "folder", "file_extension": None}
+    )
+
+
+class TestFileIndexPaths(TestCase):
+    def setUp(self) -> None:
+        self.index = FileIndex(":memory:", "d")
+        self.index.replace_children("root", "/root", [_dir("x", "x"), _dir("y", "y")])
+        self.index.replace_children("x", "/root/x", [_item("x1", "a.jpg", "x")])
+        self.index.replace_children("y", "/root/y", [_item("y1", "b.jpg", "y")])
+
+    def test_drops_subtrees(self):
+        # x was deleted, y renamed to z
+        self.index.replace_children("root", "/root", [_dir("y", "z")])
+        self.assertIsNone(self.index.get_id_by_path("/root/x/a.jpg", 60))
+        self.assertIsNone(self.index.get_path_by_id("y1", 60))
+        self.assertIsNone(self.index.get_dir_scan("x"))
+        self.assertIsNone(self.index.get_children("y", 60))
+        self.assertEqual(self.index.get_id_by_path("/root/z", 60), "y")
+
+    def test_max_age(self):
+        self.assertEqual(self.index.get_id_by_path("/root/x/a.jpg", 60), "x1")
+        self.index.conn.execute("UPDATE files SET indexed_at = indexed_at - 120")
+        self.assertIsNone(self.index.get_id_by_path("/root/x/a.jpg", 60))
+        self.assertIsNone(self.index.get_path_by_id("x1", 60))
+
+
+class TestFileIndexTimeline(TestCase):
+    def test_buckets(self):
+        index = FileIndex(":memory:", "d")
+        items = [
+            _item("a", "a.jpg").model_copy(
+                update={
+                    "category": "image",
+                    "created_at": datetime(2024, 1, 3, tzinfo=timezone.utc),
+                }
+            ),
+            _item("b", "b.mp4").model_copy(
+                update={
+                    "category": "video",
+                    "created_at": datetime(2024, 2, 1, tzinfo=timezone.utc),
+                }
+            ),
+            _item("c", "c.txt").model_copy(update={"category": "doc"}),
+        ]
+        index.replace_children("root", "/root", items)
+        self.assertEqual(index.timeline("month"), [("2024-02", 1), ("2024-01", 1)])
+        found, cursor = index.timeline_items("2024-01")
+        self.assertEqual([path for path, _ in found], ["/root/a.jpg"])
+        self.assertIsNone(cursor)
+
+    def test_taken_at(self):
+        index = FileIndex(":memory:", "d")
+        item = FileItem.model_validate(
+            {
+                **_item("a", "a.jpg").model_dump(by_alias=True),
+                "category": "image",
+                "created_at": "2024-02-01T00:00:00Z",
+                "image_media_metadata": {"time": "2023:12:31 23:00:00"},
+            }
+        )
+        self.assertEqual(item.taken_at, datetime(2023, 12, 31, 23, tzinfo=timezone.utc))
+        index.replace_children("root", "/root", [item])
+        # bucketed by the date it was taken, not by the upload
+        self.assertEqual(index.timeline("day"), [("2023-12-31", 1)])
+
+
+class TestFileIndexThread(IsolatedAsyncioTestCase):
+    async def test_run(self):
+        index = FileIndex(":memory:", "d")
+        items = [_item(f"f{i}", f"{i}.jpg") for i in range(1000)]
+        await index.run(index.replace_children, "root", "/root", items)
+        self.assertEqual(await index.run(index.get_id_by_path, "/root/7.jpg", 60), "f7")
+        # the statements run off the event loop, all in the same thread
+        thread = await index.run(threading.get_ident)
+        self.assertNotEqual(thread, threading.get_ident())
+        self.assertEqual(await index.run(threading.get_ident), thread)
+        index.close()
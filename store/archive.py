@@ -0,0 +1,196 @@
+import asyncio
+import posixpath
+import zipfile
+from collections import deque
+from typing import AsyncIterator, NamedTuple, Optional
+
+from .base import BaseFileIO, BasePath, BaseStore
+
+# earliest time a zip entry can carry
+_ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+# bytes read from a file opened ahead, which starts its stream
+_HEAD_SIZE = 64 * 1024
+
+
+class ArchiveEntry(NamedTuple):
+    # name in the archive
+    name: str
+    path: BasePath
+
+
+class _Sink:
+    """write-only file the zip is written to, drained after every write"""
+
+    def __init__(self) -> None:
+        self._parts: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _unique(name: str, taken: set[str]) -> str:
+    """`name`, or "stem (n).ext" with the first n not taken"""
+    stem, ext = posixpath.splitext(name)
+    n = 1
+    while name in taken:
+        name = f"{stem} ({n}){ext}"
+        n += 1
+    taken.add(name)
+    return name
+
+
+async def walk_archive_entries(
+    store: BaseStore, roots: list[BasePath]
+) -> AsyncIterator[ArchiveEntry]:
+    """the files of `roots`, dirs walked page by page, named relative to the parent of their root"""
+    taken: set[str] = set()
+    for root in roots:
+        name = _unique(root.name or "root", taken)
+        if not root.is_dir():
+            yield ArchiveEntry(name, root)
+            continue
+        dirs = deque([(name, root)])
+        while dirs:
+            prefix, dir_path = dirs.popleft()
+            async for it in store.iter_dir(dir_path):
+                if it.is_dir():
+                    dirs.append((f"{prefix}/{it.name}", it))
+                else:
+                    yield ArchiveEntry(f"{prefix}/{it.name}", it)
+
+
+def _prefetchable(entry: ArchiveEntry, max_size: int) -> bool:
+    size = entry.path.to_model().size
+    return size is not None and size <= max_size
+
+
+async def _read_all(store: BaseStore, entry: ArchiveEntry) -> bytes:
+    async with await store.open_file(entry.path) as stream:
+        return b"".join([chunk async for chunk in stream])
+
+
+async def _open_ahead(
+    store: BaseStore, entry: ArchiveEntry
+) -> tuple[BaseFileIO, bytes]:
+    """the open stream of the file and its first bytes, the stream keeps reading ahead"""
+    stream = await store.open_file(entry.path)
+    try:
+        return stream, await stream.read(_HEAD_SIZE)
+    except BaseException:
+        await stream.close()
+        raise
+
+
+async def _discard(task: asyncio.Task):
+    """cancel a prefetch, closing its stream when it was already open"""
+    task.cancel()
+    res = (await asyncio.gather(task, return_exceptions=True))[0]
+    if isinstance(res, tuple):
+        await res[0].close()
+
+
+def _zip_info(entry: ArchiveEntry, size: Optional[int]) -> zipfile.ZipInfo:
+    updated_at = entry.path.to_model().updated_at
+    date_time = max(updated_at.timetuple()[:6], _ZIP_EPOCH)
+    info = zipfile.ZipInfo(entry.name, date_time)
+    info.compress_type = zipfile.ZIP_STORED
+    if size is not None:
+        info.file_size = size
+    return info
+
+
+async def stream_zip(
+    store: BaseStore,
+    roots: list[BasePath],
+    prefetch: int = 4,
+    prefetch_max_size: int = 1024 * 1024,
+    open_ahead: int = 2,
+) -> AsyncIterator[bytes]:
+    """a zip (stored, zip64 when needed) of `roots`, built as it is sent
+
+    the next `prefetch` files up to `prefetch_max_size` are read into memory while
+    the current one is copied. of the larger ones among them, the next `open_ahead`
+    are opened early and read ahead as far as their stream buffers (a bounded
+    queue), so memory stays constant and a large file starts without a round trip.
+    the others are opened when their turn comes.
+    """
+    sink = _Sink()
+    entries = walk_archive_entries(store, roots)
+    # a task reading the whole file when it is prefetched, opening it when it is opened ahead
+    pending: deque[tuple[ArchiveEntry, Optional[asyncio.Task]]] = deque()
+    # the file taken off `pending`, until its task is awaited
+    current: Optional[tuple[ArchiveEntry, Optional[asyncio.Task]]] = None
+    done = False
+
+    def open_next():
+        opened = sum(
+            1
+            for entry, task in pending
+            if task is not None and not _prefetchable(entry, prefetch_max_size)
+        )
+        for i, (entry, task) in enumerate(pending):
+            if opened >= open_ahead:
+                break
+            if task is None:
+                pending[i] = (entry, asyncio.create_task(_open_ahead(store, entry)))
+                opened += 1
+
+    async def fill():
+        nonlocal done
+        while not done and len(pending) < prefetch:
+            entry = await anext(entries, None)
+            if entry is None:
+                done = True
+                break
+            task = None
+            if _prefetchable(entry, prefetch_max_size):
+                task = asyncio.create_task(_read_all(store, entry))
+            pending.append((entry, task))
+        open_next()
+
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as zf:
+            await fill()
+            while pending:
+                current = pending.popleft()
+                entry, task = current
+                await fill()
+                current = None
+                if task is not None and _prefetchable(entry, prefetch_max_size):
+                    data = await task
+                    with zf.open(_zip_info(entry, len(data)), "w") as f:
+                        f.write(data)
+                    yield sink.drain()
+                    continue
+                if task is not None:
+                    stream, head = await task
+                else:
+                    stream, head = await store.open_file(entry.path), b""
+                async with stream:
+                    size = stream.size
+                    # with the size known up front zip64 fields are only used past 4 GiB
+                    with zf.open(
+                        _zip_info(entry, size), "w", force_zip64=size is None
+                    ) as f:
+                        f.write(head)
+                        async for chunk in stream:
+                            f.write(chunk)
+                            yield sink.drain()
+                    yield sink.drain()
+        yield sink.drain()
+    finally:
+        if current is not None:
+            pending.appendleft(current)
+        for _, task in pending:
+            if task is not None:
+                await _discard(task)
+        await entries.aclose()
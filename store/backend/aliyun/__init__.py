@@ -3,7 +3,24 @@ from .file import (
     get_file_datail_by_path,
     get_file_list,
     get_file_detail_by_id,
+    batch_get_file_detail,
     search_file,
+    create_folder,
+    update_file,
+    trash_file,
+    LIST_THUMBNAIL_WIDTH,
+    BATCH_GET_LIMIT,
+)
+from .upload import (
+    create_file,
+    get_upload_url,
+    list_uploaded_parts,
+    complete_upload,
+    upload_part,
+    proof_code,
+    proof_offset,
+    UploadPartInfo,
+    MAX_PART_COUNT,
 )
 from .token import acquire_token_by_code, acquire_token_by_refresh_token
 from .login import login_use_redirect
@@ -14,7 +31,16 @@ from .base import (
     ROOT_FILE_ITEM,
     FileType,
     FileCategory,
+    FileDownloadInfo,
     with_cfg,
 )
 from .user import get_user_drive_info, get_user_info, get_user_space_info
 from .api import AliyunApiClient
+from .session import ApiSession
+from .ratelimit import (
+    RateLimit,
+    RateLimiter,
+    with_priority,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+)
@@ -1,30 +1,81 @@
-from typing import Self
+from typing import Optional, Self
 from functools import partial
 
 from .file import (
     get_download_url,
     get_file_datail_by_path,
     get_file_detail_by_id,
+    batch_get_file_detail,
     get_file_list,
+    search_file,
+    create_folder,
+    update_file,
+    trash_file,
+)
+from .upload import (
+    create_file,
+    get_upload_url,
+    list_uploaded_parts,
+    complete_upload,
 )
 from .token import acquire_token_by_code, acquire_token_by_refresh_token
 from .login import login_use_redirect
 from .exception import *
 from .user import get_user_drive_info, get_user_info, get_user_space_info
+from .session import ApiSession
+from .base import BASE_URL
 
 
 class AliyunApiClient:
-    def __init__(self, client_id: str, client_secret: str) -> None:
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        session: Optional[ApiSession] = None,
+    ) -> None:
+        """must be created inside a running event loop, the session is owned by the client"""
         self._client_id = client_id
         self._client_secret = client_secret
+        self.session = session or ApiSession(BASE_URL.format(""))
 
         self.login_use_redirect = partial(login_use_redirect, client_id=client_id)
 
         self.acquire_token_by_code = partial(
-            acquire_token_by_code, client_id=client_id, client_secret=client_secret
+            acquire_token_by_code,
+            client_id=client_id,
+            client_secret=client_secret,
+            session=self.session,
         )
         self.acquire_token_by_refresh_token = partial(
             acquire_token_by_refresh_token,
             client_id=client_id,
             client_secret=client_secret,
+            session=self.session,
+        )
+
+        self.get_file_list = partial(get_file_list, session=self.session)
+        self.search_file = partial(search_file, session=self.session)
+        self.get_file_detail_by_id = partial(
+            get_file_detail_by_id, session=self.session
         )
+        self.batch_get_file_detail = partial(
+            batch_get_file_detail, session=self.session
+        )
+        self.get_file_datail_by_path = partial(
+            get_file_datail_by_path, session=self.session
+        )
+        self.get_download_url = partial(get_download_url, session=self.session)
+        self.create_folder = partial(create_folder, session=self.session)
+        self.update_file = partial(update_file, session=self.session)
+        self.trash_file = partial(trash_file, session=self.session)
+        self.create_file = partial(create_file, session=self.session)
+        self.get_upload_url = partial(get_upload_url, session=self.session)
+        self.list_uploaded_parts = partial(list_uploaded_parts, session=self.session)
+        self.complete_upload = partial(complete_upload, session=self.session)
+
+        self.get_user_info = partial(get_user_info, session=self.session)
+        self.get_user_drive_info = partial(get_user_drive_info, session=self.session)
+        self.get_user_space_info = partial(get_user_space_info, session=self.session)
+
+    async def close(self):
+        await self.session.close()
@@ -11,12 +11,14 @@ from typing import (
     TypedDict,
 )
 
-from pydantic import BaseModel, Field, HttpUrl, ConfigDict
-from datetime import datetime
+from pydantic import BaseModel, Field, HttpUrl, ConfigDict, field_validator
+from datetime import datetime, timezone
 from aiohttp import request
 from contextvars import ContextVar
 from contextlib import contextmanager
 
+from .session import ApiSession
+
 _Model_T = TypeVar("_Model_T", bound=BaseModel)
 
 CLIENT_SECRET = ContextVar[str]("aliyun_client_secret")
@@ -34,13 +36,23 @@ def _gen_header(access_token: str):
     return {"Authorization": "Bearer " + access_token}
 
 
+def _api_request(session: Optional[ApiSession], method: str, path: str, **kwargs):
+    """send request through the shared session, fallback to a one-shot request when there is none"""
+    if session is None:
+        return request(method, BASE_URL.format(path), **kwargs)
+    return session.request(method, path, **kwargs)
+
+
 def _gen_base_get_func(
     url: str, model: Type[_Model_T]
-) -> Callable[[AccessTokenType], Coroutine[Any, Any, _Model_T]]:
-    async def _inner(access_token: AccessTokenType):
-        async with request(
+) -> Callable[..., Coroutine[Any, Any, _Model_T]]:
+    async def _inner(
+        access_token: AccessTokenType, *, session: Optional[ApiSession] = None
+    ):
+        async with _api_request(
+            session,
             "POST",
-            BASE_URL.format(url),
+            url,
             headers=_gen_header(access_token),
         ) as resp:
             t = await resp.json()
@@ -60,6 +72,29 @@ class AccessToken(BaseModel):
     token_type: Literal["Bearer"] = "Bearer"
 
 
+class MediaMetadata(BaseModel):
+    # when the photo or video was taken, from its exif or container
+    time: Optional[datetime] = None
+
+    @field_validator("time", mode="before")
+    @classmethod
+    def _parse_time(cls, val: Any) -> Optional[datetime]:
+        """iso dates, or exif "2024:01:31 12:00:00" in the wall time of the camera (taken as utc)"""
+        if not isinstance(val, str) or not val:
+            return val or None
+        for parse in (
+            datetime.fromisoformat,
+            lambda it: datetime.strptime(it, "%Y:%m:%d %H:%M:%S"),
+        ):
+            try:
+                parsed = parse(val)
+            except ValueError:
+                continue
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        # a date the drive could not read is no date
+        return None
+
+
 class FileItem(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
     drive_id: str
@@ -87,6 +122,14 @@ class FileItem(BaseModel):
     # video profile
     play_cursor: Optional[str] = None
 
+    image_media_metadata: Optional[MediaMetadata] = None
+    video_media_metadata: Optional[MediaMetadata] = None
+
+    @property
+    def taken_at(self) -> Optional[datetime]:
+        metadata = self.image_media_metadata or self.video_media_metadata
+        return metadata.time if metadata else None
+
 
 class FileItemDetail(FileItem):
     id_path: Optional[str] = None
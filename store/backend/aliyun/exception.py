@@ -17,7 +17,11 @@ class ExceedCapacityForbidden(AliyunException):
     pass
 
 
-class FileNotFound(AliyunException):
+class FileNotFound(AliyunException, FileNotFoundError):
+    pass
+
+
+class FileAlreadyExists(AliyunException, FileExistsError):
     pass
 
 
@@ -48,6 +52,8 @@ async def handle_error_status(resp: ClientResponse):
                     raise ExceedCapacityForbidden(info)
                 case "NotFound.File":
                     raise FileNotFound(info)
+                case "AlreadyExist.File":
+                    raise FileAlreadyExists(info)
                 case "TooManyRequests":
                     raise TooManyRequests(info)
                 case "UserNotAllowedAccessResource":
@@ -2,20 +2,25 @@ from typing import Annotated, Literal, TypedDict, NotRequired, Unpack, Optional
 from typing_extensions import Doc
 from annotated_types import Unit
 from pydantic import conint, BaseModel, HttpUrl
-from aiohttp import request
 from datetime import datetime
 
 from .base import (
     FileItem,
     FileCategory,
     FileType,
-    BASE_URL,
+    _api_request,
     _gen_header,
     AccessTokenType,
     FileItemDetail,
     FileDownloadInfo,
 )
 from .exception import handle_error_status
+from .session import ApiSession
+
+# width of the image thumbnails that come with file listings
+LIST_THUMBNAIL_WIDTH = 512
+# files per /openFile/batch/get request
+BATCH_GET_LIMIT = 100
 
 
 class _BaseParams(TypedDict):
@@ -67,12 +72,16 @@ class _SearchFileParams(_BaseFileListMethodParams):
 
 
 async def get_file_list(
-    access_token: AccessTokenType, **kwargs: Unpack[_GetFileListParams]
+    access_token: AccessTokenType,
+    *,
+    session: Optional[ApiSession] = None,
+    **kwargs: Unpack[_GetFileListParams],
 ) -> _GetFileListResp:
-    async with request(
+    async with _api_request(
+        session,
         "POST",
-        BASE_URL.format("/adrive/v1.0/openFile/list"),
-        json={**kwargs, "image_thumbnail_width": 512},
+        "/adrive/v1.0/openFile/list",
+        json={**kwargs, "image_thumbnail_width": LIST_THUMBNAIL_WIDTH},
         headers=_gen_header(access_token),
         raise_for_status=handle_error_status,  # type: ignore
     ) as resp:
@@ -81,11 +90,15 @@ async def get_file_list(
 
 
 async def search_file(
-    access_token: AccessTokenType, **kwargs: Unpack[_SearchFileParams]
+    access_token: AccessTokenType,
+    *,
+    session: Optional[ApiSession] = None,
+    **kwargs: Unpack[_SearchFileParams],
 ) -> _SearchFileResp:
-    async with request(
+    async with _api_request(
+        session,
         "POST",
-        BASE_URL.format("/adrive/v1.0/openFile/search"),
+        "/adrive/v1.0/openFile/search",
         json=kwargs,
         headers=_gen_header(access_token),
         raise_for_status=handle_error_status,  # type: ignore
@@ -99,11 +112,15 @@ class _FileDetailByIdParams(_BaseParams):
 
 
 async def get_file_detail_by_id(
-    access_token: AccessTokenType, **kwargs: Unpack[_FileDetailByIdParams]
+    access_token: AccessTokenType,
+    *,
+    session: Optional[ApiSession] = None,
+    **kwargs: Unpack[_FileDetailByIdParams],
 ) -> FileItemDetail:
-    async with request(
+    async with _api_request(
+        session,
         "POST",
-        BASE_URL.format("/adrive/v1.0/openFile/get"),
+        "/adrive/v1.0/openFile/get",
         json={**kwargs, "fields": "id_path,name_path"},
         headers=_gen_header(access_token),
         raise_for_status=handle_error_status,  # type: ignore
@@ -112,13 +129,45 @@ async def get_file_detail_by_id(
         return FileItemDetail.model_validate(data)
 
 
+class _BatchGetFileResp(BaseModel):
+    items: list[FileItemDetail]
+
+
+async def batch_get_file_detail(
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_ids: list[str],
+    *,
+    session: Optional[ApiSession] = None,
+) -> list[FileItemDetail]:
+    """details of at most BATCH_GET_LIMIT files in one request, missing files are left out"""
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/batch/get",
+        json={
+            "file_list": [{"drive_id": drive_id, "file_id": it} for it in file_ids],
+            "image_thumbnail_width": LIST_THUMBNAIL_WIDTH,
+        },
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ) as resp:
+        data = await resp.json()
+        return _BatchGetFileResp.model_validate(data).items
+
+
 async def get_file_datail_by_path(
-    access_token: AccessTokenType, drive_id: str, file_path: str
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_path: str,
+    *,
+    session: Optional[ApiSession] = None,
 ) -> FileItemDetail:
     file_path = file_path.removeprefix("/root")
-    async with request(
+    async with _api_request(
+        session,
         "POST",
-        BASE_URL.format("/adrive/v1.0/openFile/get_by_path"),
+        "/adrive/v1.0/openFile/get_by_path",
         json={
             "drive_id": drive_id,
             "file_path": file_path,
@@ -136,10 +185,13 @@ async def get_download_url(
     drive_id: str,
     file_id: str,
     expire_sec: Optional[int] = None,
+    *,
+    session: Optional[ApiSession] = None,
 ) -> FileDownloadInfo:
-    async with request(
+    async with _api_request(
+        session,
         "POST",
-        BASE_URL.format("/adrive/v1.0/openFile/getDownloadUrl"),
+        "/adrive/v1.0/openFile/getDownloadUrl",
         json={
             "drive_id": drive_id,
             "file_id": file_id,
@@ -150,3 +202,83 @@ async def get_download_url(
     ) as resp:
         data = await resp.json()
         return FileDownloadInfo.model_validate(data)
+
+
+class _CreateFileResp(BaseModel):
+    drive_id: str
+    file_id: str
+    parent_file_id: str
+    file_name: str
+    type: FileType
+    exist: Optional[bool] = None
+
+
+async def create_folder(
+    access_token: AccessTokenType,
+    drive_id: str,
+    parent_file_id: str,
+    name: str,
+    check_name_mode: Literal["auto_rename", "refuse", "ignore"] = "refuse",
+    *,
+    session: Optional[ApiSession] = None,
+) -> _CreateFileResp:
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/create",
+        json={
+            "drive_id": drive_id,
+            "parent_file_id": parent_file_id,
+            "name": name,
+            "type": "folder",
+            "check_name_mode": check_name_mode,
+        },
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ) as resp:
+        data = await resp.json()
+        return _CreateFileResp.model_validate(data)
+
+
+async def update_file(
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_id: str,
+    name: str,
+    check_name_mode: Literal["auto_rename", "refuse", "ignore"] = "refuse",
+    *,
+    session: Optional[ApiSession] = None,
+) -> FileItem:
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/update",
+        json={
+            "drive_id": drive_id,
+            "file_id": file_id,
+            "name": name,
+            "check_name_mode": check_name_mode,
+        },
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ) as resp:
+        data = await resp.json()
+        return FileItem.model_validate(data)
+
+
+async def trash_file(
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_id: str,
+    *,
+    session: Optional[ApiSession] = None,
+) -> None:
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/recyclebin/trash",
+        json={"drive_id": drive_id, "file_id": file_id},
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ):
+        pass
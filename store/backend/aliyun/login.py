@@ -9,5 +9,5 @@ def login_use_redirect(redirect_url: str, client_id: str) -> str:
     :return: login page url
     """
     return BASE_URL.format(
-        f"/oauth/authorize?client_id={client_id}&redirect_uri={quote_plus(redirect_url)}&scope=user:base,file:all:read&response_type=code"
+        f"/oauth/authorize?client_id={client_id}&redirect_uri={quote_plus(redirect_url)}&scope=user:base,file:all:read,file:all:write&response_type=code"
     )
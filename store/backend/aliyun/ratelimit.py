@@ -0,0 +1,115 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Mapping, NamedTuple, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+# lower value goes first, background jobs (crawler etc.) set PRIORITY_BACKGROUND
+REQUEST_PRIORITY = ContextVar[int](
+    "aliyun_request_priority", default=PRIORITY_INTERACTIVE
+)
+
+
+@contextmanager
+def with_priority(priority: int):
+    token = REQUEST_PRIORITY.set(priority)
+    try:
+        yield None
+    finally:
+        REQUEST_PRIORITY.reset(token)
+
+
+class RateLimit(NamedTuple):
+    rate: float
+    burst: int
+
+
+class TokenBucket:
+    """token bucket, waiters are served by priority, then in arrival order"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.acquired = 0
+        self.waited = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        self.acquired += 1
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        self.waited += 1
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        # a cancelled waiter stays in the heap and is skipped by the dispatcher
+        await fut
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self._tokens -= 1
+            fut.set_result(None)
+
+    def pause(self, seconds: float):
+        """hold every request for `seconds`, e.g. when the server answers Retry-After"""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "queued": len(self._waiters),
+        }
+
+
+class RateLimiter:
+    """one token bucket per api path, paths without own limit share the default bucket"""
+
+    def __init__(
+        self, default: RateLimit, per_path: Optional[Mapping[str, RateLimit]] = None
+    ) -> None:
+        self._default = TokenBucket(*default)
+        self._buckets = {
+            path: TokenBucket(*limit) for path, limit in (per_path or {}).items()
+        }
+
+    def bucket(self, path: str) -> TokenBucket:
+        return self._buckets.get(path, self._default)
+
+    async def acquire(self, path: str):
+        await self.bucket(path).acquire(REQUEST_PRIORITY.get())
+
+    def pause(self, path: str, seconds: float):
+        self.bucket(path).pause(seconds)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        return {
+            "default": self._default.stats(),
+            **{path: bucket.stats() for path, bucket in self._buckets.items()},
+        }
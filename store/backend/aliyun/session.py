@@ -0,0 +1,216 @@
+import random
+import time
+from typing import Any, AsyncIterator, Optional
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+from aiohttp import (
+    ClientSession,
+    ClientResponse,
+    ClientTimeout,
+    TCPConnector,
+    TraceConfig,
+)
+
+from utils import Counter, Gauge, Histogram, Span, current_span, tracer
+
+from .ratelimit import RateLimiter, RateLimit
+
+try:
+    from aiohttp import AsyncResolver
+
+    import aiodns  # noqa: F401  # AsyncResolver needs aiodns at runtime
+except ImportError:
+    AsyncResolver = None
+
+
+API_LATENCY = Histogram(
+    "aliyun_api_request_duration_seconds",
+    "open api request latency by path, until the response is released",
+    ("path",),
+)
+API_REQUESTS = Counter(
+    "aliyun_api_requests_total",
+    "open api responses by path and status",
+    ("path", "status"),
+)
+API_IN_FLIGHT = Gauge(
+    "aliyun_api_requests_in_flight",
+    "open api requests waiting for a response",
+    ("path",),
+)
+API_ERRORS = Counter(
+    "aliyun_api_errors_total",
+    "failed open api requests by path and exception (AliyunException subclass etc.)",
+    ("path", "error"),
+)
+
+
+def _timing_trace_config() -> TraceConfig:
+    """dns, connect and time to first byte of every request, recorded on the current span"""
+    config = TraceConfig()
+
+    def on(signal: str, event: str, start: Optional[str] = None, attr: str = ""):
+        async def callback(_session, ctx, _params):
+            span = current_span()
+            if not span.recording:
+                return
+            now = time.perf_counter()
+            setattr(ctx, event, now)
+            span.add_event(event)
+            if start is not None and hasattr(ctx, start):
+                span.set_attribute(attr, (now - getattr(ctx, start)) * 1000)
+
+        getattr(config, signal).append(callback)
+
+    on("on_request_start", "http.request_start")
+    on("on_dns_resolvehost_start", "http.dns_start")
+    on("on_dns_resolvehost_end", "http.dns_end", "http.dns_start", "http.dns_ms")
+    on("on_connection_create_start", "http.connect_start")
+    on(
+        "on_connection_create_end",
+        "http.connect_end",
+        "http.connect_start",
+        "http.connect_ms",
+    )
+    on("on_connection_reuseconn", "http.connection_reused")
+    on("on_request_end", "http.response_headers", "http.request_start", "http.ttfb_ms")
+    return config
+
+
+class ApiSession:
+    """long-lived, connection-pooled http session shared by all backend calls"""
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        limit: int = 100,
+        limit_per_host: int = 32,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        timeout: float = 60,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30,
+    ) -> None:
+        self._base_url = base_url.rstrip("/")
+        self.rate_limiter = rate_limiter or RateLimiter(RateLimit(20, 20))
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self.throttled = 0
+        self.retries = 0
+        connector = TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+            resolver=AsyncResolver() if AsyncResolver else None,
+        )
+        self._session = ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(total=timeout),
+            trace_configs=[_timing_trace_config()],
+        )
+
+    @property
+    def client(self) -> ClientSession:
+        """the underlying aiohttp session, for requests outside the open api (cdn urls etc.)"""
+        return self._session
+
+    @property
+    def closed(self) -> bool:
+        return self._session.closed
+
+    def url(self, path: str) -> str:
+        return self._base_url + path
+
+    @asynccontextmanager
+    async def request(
+        self, method: str, path: str, **kwargs
+    ) -> AsyncIterator[ClientResponse]:
+        """rate limited request, TooManyRequests is retried with backoff"""
+        with tracer.span(
+            f"{method} {path}", "client", **{"http.method": method, "http.route": path}
+        ) as span:
+            async with self._request(span, method, path, **kwargs) as resp:
+                yield resp
+
+    @asynccontextmanager
+    async def _request(
+        self, span: Span, method: str, path: str, **kwargs
+    ) -> AsyncIterator[ClientResponse]:
+        # checked here so that a throttled response can be retried first
+        raise_for_status = kwargs.pop("raise_for_status", None)
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(path)
+            span.add_event("ratelimit.acquired")
+            start = time.perf_counter()
+            API_IN_FLIGHT.inc(path=path)
+            try:
+                resp = await self._session.request(method, self.url(path), **kwargs)
+            except Exception as e:
+                API_ERRORS.inc(path=path, error=type(e).__name__)
+                API_LATENCY.observe(time.perf_counter() - start, path=path)
+                raise
+            finally:
+                API_IN_FLIGHT.dec(path=path)
+            API_REQUESTS.inc(path=path, status=resp.status)
+            span.set_attribute("http.status_code", resp.status)
+            span.set_attribute("http.attempts", attempt + 1)
+            if resp.status != 429 or attempt >= self._max_retries:
+                break
+            API_LATENCY.observe(time.perf_counter() - start, path=path)
+            self.throttled += 1
+            self.retries += 1
+            delay = self._retry_after(resp)
+            if delay is None:
+                # exponential backoff with full jitter
+                delay = random.uniform(
+                    0, min(self._backoff_max, self._backoff_base * 2**attempt)
+                )
+            resp.release()
+            self.rate_limiter.pause(path, delay)
+            attempt += 1
+        try:
+            if raise_for_status is not None:
+                try:
+                    await raise_for_status(resp)
+                except Exception as e:
+                    API_ERRORS.inc(path=path, error=type(e).__name__)
+                    raise
+            yield resp
+        finally:
+            resp.release()
+            API_LATENCY.observe(time.perf_counter() - start, path=path)
+
+    def _retry_after(self, resp: ClientResponse) -> Optional[float]:
+        value = resp.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return min(float(value), self._backoff_max)
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0), self._backoff_max)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "rate_limit": self.rate_limiter.stats(),
+        }
+
+    async def close(self):
+        if not self._session.closed:
+            await self._session.close()
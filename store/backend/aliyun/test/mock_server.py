@@ -0,0 +1,649 @@
+"""local stand-in of the aliyun drive open api over a synthetic file tree
+
+run it alone with: python -m store.backend.aliyun.test.mock_server --port 8900
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, NamedTuple, Optional
+
+from aiohttp import web
+
+DRIVE_ID = "mock-drive"
+_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+# smallest png header, enough for sniffing the image type
+_THUMBNAIL = b"\x89PNG\r\n\x1a\n" + b"\0" * 56
+
+
+class MockFile(NamedTuple):
+    file_id: str
+    parent_file_id: str
+    name: str
+    type: str
+    path: str
+    size: Optional[int]
+    created_at: datetime
+
+
+class MockDrive:
+    """`depth` levels of `dirs_per_dir` folders, each folder holds `files_per_dir` files"""
+
+    def __init__(
+        self, depth: int = 2, dirs_per_dir: int = 10, files_per_dir: int = 100
+    ) -> None:
+        self.files: dict[str, MockFile] = {}
+        self.children: dict[str, list[str]] = {"root": []}
+        self.by_path: dict[str, str] = {}
+        # content of the uploaded files, and uploaded file id by content hash
+        self.uploaded: dict[str, bytes] = {}
+        self.hashes: dict[str, str] = {}
+        self._new_ids = 0
+        self._build("root", "", depth, dirs_per_dir, files_per_dir)
+
+    def _add(self, item: MockFile):
+        self.files[item.file_id] = item
+        self.children[item.parent_file_id].append(item.file_id)
+        self.by_path[item.path] = item.file_id
+        if item.type == "folder":
+            self.children[item.file_id] = []
+
+    def _build(self, parent_id: str, parent_path: str, depth, dirs, files):
+        for i in range(files):
+            n = len(self.files)
+            ext = "mp4" if n % 10 == 0 else "jpg"
+            name = f"IMG_{n:07}.{ext}"
+            self._add(
+                MockFile(
+                    f"file{n:08}",
+                    parent_id,
+                    name,
+                    "file",
+                    f"{parent_path}/{name}",
+                    64 * 1024 + n % 4096,
+                    _EPOCH + timedelta(hours=n),
+                )
+            )
+        if depth <= 0:
+            return
+        for i in range(dirs):
+            n = len(self.files)
+            name = f"dir{i:03}"
+            item = MockFile(
+                f"dir{n:08}",
+                parent_id,
+                name,
+                "folder",
+                f"{parent_path}/{name}",
+                None,
+                _EPOCH,
+            )
+            self._add(item)
+            self._build(item.file_id, item.path, depth - 1, dirs, files)
+
+    def child_by_name(self, parent_id: str, name: str) -> Optional[str]:
+        for it in self.children[parent_id]:
+            if self.files[it].name == name:
+                return it
+        return None
+
+    def new_id(self) -> str:
+        self._new_ids += 1
+        return f"new{self._new_ids:08}"
+
+    def add(
+        self,
+        parent_id: str,
+        name: str,
+        content: Optional[bytes] = None,
+        file_id: Optional[str] = None,
+    ) -> MockFile:
+        """a new folder, or file when `content` is given"""
+        parent = self.files.get(parent_id)
+        item = MockFile(
+            file_id or self.new_id(),
+            parent_id,
+            name,
+            "folder" if content is None else "file",
+            f"{parent.path if parent else ''}/{name}",
+            None if content is None else len(content),
+            datetime.now(timezone.utc),
+        )
+        self._add(item)
+        if content is not None:
+            self.uploaded[item.file_id] = content
+            self.hashes[hashlib.sha1(content).hexdigest().upper()] = item.file_id
+        return item
+
+    def remove(self, file_id: str):
+        """drop the file, or the folder with everything under it"""
+        for it in list(self.children.get(file_id, ())):
+            self.remove(it)
+        self.children.pop(file_id, None)
+        item = self.files.pop(file_id)
+        self.children[item.parent_file_id].remove(file_id)
+        del self.by_path[item.path]
+        self.uploaded.pop(file_id, None)
+
+    def rename(self, file_id: str, name: str):
+        item = self.files[file_id]
+        self._move(file_id, f"{item.path.rpartition('/')[0]}/{name}", name)
+
+    def _move(self, file_id: str, path: str, name: str):
+        item = self.files[file_id]
+        del self.by_path[item.path]
+        self.files[file_id] = item._replace(name=name, path=path)
+        self.by_path[path] = file_id
+        for it in self.children.get(file_id, ()):
+            child = self.files[it]
+            self._move(it, f"{path}/{child.name}", child.name)
+
+    def to_json(self, item: MockFile, base_url: str) -> dict[str, Any]:
+        data = {
+            "drive_id": DRIVE_ID,
+            "file_id": item.file_id,
+            "parent_file_id": item.parent_file_id,
+            "name": item.name,
+            "type": item.type,
+            "created_at": item.created_at.isoformat(),
+            "updated_at": item.created_at.isoformat(),
+        }
+        if item.type == "file":
+            ext = item.name.rsplit(".", 1)[-1]
+            data.update(
+                size=item.size,
+                file_extension=ext,
+                category="video" if ext == "mp4" else "image",
+                content_hash=self.content_hash(item.file_id),
+                thumbnail=f"{base_url}/mock/thumbnail/{item.file_id}",
+            )
+        return data
+
+    def content_hash(self, file_id: str) -> str:
+        if file_id in self.uploaded:
+            return hashlib.sha1(self.uploaded[file_id]).hexdigest().upper()
+        return hashlib.sha1(file_id.encode()).hexdigest().upper()
+
+    def content(self, file_id: str) -> bytes:
+        if file_id in self.uploaded:
+            return self.uploaded[file_id]
+        item = self.files[file_id]
+        assert item.size is not None
+        seed = hashlib.sha1(file_id.encode()).digest()
+        return (seed * (item.size // len(seed) + 1))[: item.size]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> Optional[float]:
+        """None when a token was taken, else seconds until the next one"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return None
+        return (1 - self.tokens) / self.rate
+
+
+def _error(status: int, code: str, message: str = "", **headers: str):
+    return web.json_response(
+        {"code": code, "message": message or code}, status=status, headers=headers
+    )
+
+
+class MockAliyunServer:
+    """aiohttp app of the open api endpoints the backend uses
+
+    :param latency: seconds every api call waits, plus up to `jitter` more
+    :param rate_limit: (rate, burst) of all api calls, exceeding it answers TooManyRequests
+    """
+
+    def __init__(
+        self,
+        drive: Optional[MockDrive] = None,
+        latency: float = 0,
+        jitter: float = 0,
+        rate_limit: Optional[tuple[float, int]] = None,
+        token_ttl: int = 7200,
+    ) -> None:
+        self.drive = drive or MockDrive()
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = TokenBucket(*rate_limit) if rate_limit else None
+        self.token_ttl = token_ttl
+        self.tokens: set[str] = set()
+        self.calls: Counter[str] = Counter()
+        self.throttled = 0
+        # multipart uploads in progress by upload id
+        self.uploads: dict[str, dict[str, Any]] = {}
+        # bumped to expire all signed upload urls given out so far
+        self.upload_url_version = 0
+        # bumped to expire all signed download urls given out so far
+        self.download_url_version = 0
+        # seconds a download url stays valid when the client asks for no expiry
+        self.download_url_ttl = 900
+        self.download_requests = 0
+        # the next downloads that send half their body, then stall until the client gives up
+        self.stall_downloads = 0
+        # ids of the dirs whose listing fails with 500
+        self.fail_lists: set[str] = set()
+        # the next part puts that fail with 400
+        self.fail_part_puts = 0
+        self.base_url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application(
+            middlewares=[self._api_middleware], client_max_size=1024**3
+        )
+        api = "/adrive/v1.0"
+        for path, handler in (
+            ("/oauth/access_token", self.access_token),
+            (f"{api}/user/getDriveInfo", self.drive_info),
+            (f"{api}/openFile/list", self.list_files),
+            (f"{api}/openFile/get", self.get),
+            (f"{api}/openFile/get_by_path", self.get_by_path),
+            (f"{api}/openFile/batch/get", self.batch_get),
+            (f"{api}/openFile/getDownloadUrl", self.download_url),
+            (f"{api}/openFile/search", self.search),
+            (f"{api}/openFile/create", self.create),
+            (f"{api}/openFile/update", self.update),
+            (f"{api}/openFile/recyclebin/trash", self.trash),
+            (f"{api}/openFile/getUploadUrl", self.upload_url),
+            (f"{api}/openFile/listUploadedParts", self.list_uploaded_parts),
+            (f"{api}/openFile/complete", self.complete),
+        ):
+            self.app.router.add_post(path, handler)
+        self.app.router.add_get("/mock/download/{file_id}", self.download)
+        self.app.router.add_get("/mock/thumbnail/{file_id}", self.thumbnail)
+        self.app.router.add_put("/mock/upload/{upload_id}/{part_number}", self.put_part)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """serve in the running loop, return the base url"""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets  # type: ignore
+        self.base_url = f"http://{host}:{sockets[0].getsockname()[1]}"
+        return self.base_url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    @web.middleware
+    async def _api_middleware(self, request: web.Request, handler):
+        if request.path.startswith("/mock/"):
+            return await handler(request)
+        self.calls[request.path] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.bucket is not None:
+            wait = self.bucket.take()
+            if wait is not None:
+                self.throttled += 1
+                return _error(429, "TooManyRequests", **{"Retry-After": f"{wait:.3f}"})
+        if request.path != "/oauth/access_token":
+            token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+            if token not in self.tokens:
+                return _error(401, "AccessTokenInvalid")
+        return await handler(request)
+
+    def _item(self, file_id: str, with_path: bool = False) -> dict[str, Any]:
+        item = self.drive.files[file_id]
+        data = self.drive.to_json(item, self.base_url)
+        if with_path:
+            data["name_path"] = "root:" + item.path
+        return data
+
+    def _not_found(self):
+        return _error(404, "NotFound.File", "file not found")
+
+    async def access_token(self, request: web.Request):
+        body = await request.json()
+        if (
+            body.get("grant_type") == "refresh_token"
+            and len(body.get("refresh_token") or "") < 20
+        ):
+            return _error(400, "RefreshTokenInvalid")
+        token = f"mock-{random.getrandbits(64):016x}"
+        self.tokens.add(token)
+        return web.json_response(
+            {
+                "access_token": token,
+                # rotated on every use, like the real one
+                "refresh_token": f"mock-refresh-{random.getrandbits(64):020}",
+                "expires_in": self.token_ttl,
+                "token_type": "Bearer",
+            }
+        )
+
+    async def drive_info(self, request: web.Request):
+        return web.json_response(
+            {
+                "user_id": "mock-user",
+                "name": "mock",
+                "avatar": "",
+                "default_drive_id": DRIVE_ID,
+            }
+        )
+
+    async def list_files(self, request: web.Request):
+        body = await request.json()
+        if body["parent_file_id"] in self.fail_lists:
+            return _error(500, "InternalError")
+        children = self.drive.children.get(body["parent_file_id"])
+        if children is None:
+            return self._not_found()
+        limit = min(int(body.get("limit") or 50), 100)
+        start = int(body.get("marker") or 0)
+        page = children[start : start + limit]
+        end = start + len(page)
+        return web.json_response(
+            {
+                "items": [self._item(it) for it in page],
+                "next_marker": str(end) if end < len(children) else "",
+            }
+        )
+
+    async def get(self, request: web.Request):
+        body = await request.json()
+        if body["file_id"] not in self.drive.files:
+            return self._not_found()
+        return web.json_response(self._item(body["file_id"], with_path=True))
+
+    async def get_by_path(self, request: web.Request):
+        body = await request.json()
+        file_id = self.drive.by_path.get(body["file_path"].rstrip("/"))
+        if file_id is None:
+            return self._not_found()
+        return web.json_response(self._item(file_id, with_path=True))
+
+    async def batch_get(self, request: web.Request):
+        body = await request.json()
+        ids = [it["file_id"] for it in body["file_list"]]
+        return web.json_response(
+            {"items": [self._item(it) for it in ids if it in self.drive.files]}
+        )
+
+    async def download_url(self, request: web.Request):
+        body = await request.json()
+        if body["file_id"] not in self.drive.files:
+            return self._not_found()
+        expiration = datetime.now(timezone.utc) + timedelta(
+            seconds=body.get("expire_sec") or self.download_url_ttl
+        )
+        return web.json_response(
+            {
+                "url": f"{self.base_url}/mock/download/{body['file_id']}"
+                f"?v={self.download_url_version}",
+                "expiration": expiration.isoformat(),
+                "method": "GET",
+            }
+        )
+
+    async def search(self, request: web.Request):
+        """only `name match "..."`, `type = "..."` and `category in [...]` are understood"""
+        body = await request.json()
+        query = body.get("query", "")
+        name = re.search(r'name match "([^"]*)"', query)
+        file_type = re.search(r'type = "(\w+)"', query)
+        category = re.search(r"category in \[([^\]]*)\]", query)
+        found = [
+            it.file_id
+            for it in self.drive.files.values()
+            if (name is None or name.group(1).lower() in it.name.lower())
+            and (file_type is None or it.type == file_type.group(1))
+            and (
+                category is None
+                or self._item(it.file_id).get("category", "") in category.group(1)
+            )
+        ]
+        limit = min(int(body.get("limit") or 50), 100)
+        start = int(body.get("marker") or 0)
+        page = found[start : start + limit]
+        end = start + len(page)
+        return web.json_response(
+            {
+                "items": [self._item(it) for it in page],
+                "next_marker": str(end) if end < len(found) else "",
+                "total_count": len(found),
+            }
+        )
+
+    def _part_urls(self, upload_id: str, part_numbers: list[int]):
+        return [
+            {
+                "part_number": it,
+                "upload_url": f"{self.base_url}/mock/upload/{upload_id}/{it}"
+                f"?v={self.upload_url_version}",
+            }
+            for it in part_numbers
+        ]
+
+    async def create(self, request: web.Request):
+        body = await request.json()
+        parent_id, name = body["parent_file_id"], body["name"]
+        if parent_id not in self.drive.children:
+            return self._not_found()
+        resp = {"drive_id": DRIVE_ID, "parent_file_id": parent_id}
+        existing = self.drive.child_by_name(parent_id, name)
+        if existing is not None:
+            mode = body.get("check_name_mode", "ignore")
+            if mode == "refuse":
+                return web.json_response(
+                    {
+                        **resp,
+                        "file_id": existing,
+                        "file_name": name,
+                        "type": self.drive.files[existing].type,
+                        "exist": True,
+                    }
+                )
+            if mode == "auto_rename":
+                stem, dot, ext = name.rpartition(".")
+                stem, ext = (stem, dot + ext) if dot else (name, "")
+                i = 1
+                while self.drive.child_by_name(parent_id, f"{stem}({i}){ext}"):
+                    i += 1
+                name = f"{stem}({i}){ext}"
+        resp.update(file_name=name, type=body["type"])
+        if body["type"] == "folder":
+            item = self.drive.add(parent_id, name)
+            return web.json_response({**resp, "file_id": item.file_id})
+
+        size = body["size"]
+        content_hash = body.get("content_hash")
+        rapid_source = self.drive.hashes.get(content_hash or "")
+        if rapid_source is not None:
+            content = self.drive.uploaded[rapid_source]
+            token = request.headers["Authorization"].removeprefix("Bearer ")
+            digest = hashlib.md5(token.encode()).hexdigest()
+            offset = int(digest[:16], 16) % size if size else 0
+            proof = base64.b64encode(content[offset : offset + 8]).decode()
+            if body.get("proof_code") == proof and len(content) == size:
+                item = self.drive.add(parent_id, name, content)
+                return web.json_response(
+                    {**resp, "file_id": item.file_id, "rapid_upload": True}
+                )
+        upload_id = f"upload-{len(self.uploads)}"
+        part_numbers = [it["part_number"] for it in body["part_info_list"]]
+        file_id = self.drive.new_id()
+        self.uploads[upload_id] = {
+            "file_id": file_id,
+            "parent_file_id": parent_id,
+            "name": name,
+            "size": size,
+            "content_hash": content_hash,
+            "part_count": len(part_numbers),
+            "parts": {},
+        }
+        return web.json_response(
+            {
+                **resp,
+                "file_id": file_id,
+                "upload_id": upload_id,
+                "rapid_upload": False,
+                "part_info_list": self._part_urls(upload_id, part_numbers),
+            }
+        )
+
+    async def update(self, request: web.Request):
+        body = await request.json()
+        file_id = body["file_id"]
+        item = self.drive.files.get(file_id)
+        if item is None:
+            return self._not_found()
+        existing = self.drive.child_by_name(item.parent_file_id, body["name"])
+        if existing not in (None, file_id) and body.get("check_name_mode") == "refuse":
+            return _error(409, "AlreadyExist.File", "file already exists")
+        self.drive.rename(file_id, body["name"])
+        return web.json_response(self._item(file_id))
+
+    async def trash(self, request: web.Request):
+        body = await request.json()
+        if body["file_id"] not in self.drive.files:
+            return self._not_found()
+        self.drive.remove(body["file_id"])
+        return web.json_response({"drive_id": DRIVE_ID, "file_id": body["file_id"]})
+
+    def _upload(self, body: dict[str, Any]) -> Optional[dict[str, Any]]:
+        upload = self.uploads.get(body["upload_id"])
+        if upload is None or upload["file_id"] != body["file_id"]:
+            return None
+        return upload
+
+    async def upload_url(self, request: web.Request):
+        body = await request.json()
+        if self._upload(body) is None:
+            return _error(404, "NotFound.UploadId")
+        part_numbers = [it["part_number"] for it in body["part_info_list"]]
+        return web.json_response(
+            {"part_info_list": self._part_urls(body["upload_id"], part_numbers)}
+        )
+
+    async def list_uploaded_parts(self, request: web.Request):
+        body = await request.json()
+        upload = self._upload(body)
+        if upload is None:
+            return _error(404, "NotFound.UploadId")
+        parts = [
+            {
+                "part_number": n,
+                "part_size": len(data),
+                "etag": hashlib.md5(data).hexdigest(),
+            }
+            for n, data in sorted(upload["parts"].items())
+        ]
+        return web.json_response(
+            {"uploaded_parts": parts, "next_part_number_marker": ""}
+        )
+
+    async def complete(self, request: web.Request):
+        body = await request.json()
+        upload = self._upload(body)
+        if upload is None:
+            return _error(404, "NotFound.UploadId")
+        parts = upload["parts"]
+        if sorted(parts) != list(range(1, upload["part_count"] + 1)):
+            return _error(400, "InvalidParameter.PartInfoList")
+        content = b"".join(parts[it] for it in sorted(parts))
+        if len(content) != upload["size"] or (
+            upload["content_hash"]
+            and hashlib.sha1(content).hexdigest().upper() != upload["content_hash"]
+        ):
+            return _error(400, "InvalidParameter.ContentHash")
+        del self.uploads[body["upload_id"]]
+        item = self.drive.add(
+            upload["parent_file_id"], upload["name"], content, upload["file_id"]
+        )
+        return web.json_response(self._item(item.file_id))
+
+    async def put_part(self, request: web.Request):
+        upload = self.uploads.get(request.match_info["upload_id"])
+        if upload is None:
+            raise web.HTTPNotFound()
+        # like oss: the url is signed without a content type, and expires
+        if "Content-Type" in request.headers or request.query.get("v") != str(
+            self.upload_url_version
+        ):
+            raise web.HTTPForbidden(text="SignatureDoesNotMatch")
+        if self.fail_part_puts > 0:
+            self.fail_part_puts -= 1
+            raise web.HTTPBadRequest()
+        upload["parts"][int(request.match_info["part_number"])] = await request.read()
+        return web.Response()
+
+    async def download(self, request: web.Request):
+        file_id = request.match_info["file_id"]
+        if file_id not in self.drive.files:
+            raise web.HTTPNotFound()
+        if request.query.get("v") != str(self.download_url_version):
+            raise web.HTTPForbidden(text="AccessDenied")
+        self.download_requests += 1
+        data = self.drive.content(file_id)
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", request.headers.get("Range", ""))
+        if match is None:
+            status, body, headers = 200, data, {}
+        else:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            status, body = 206, data[start : end + 1]
+            headers = {"Content-Range": f"bytes {start}-{end}/{len(data)}"}
+        if self.stall_downloads <= 0:
+            return web.Response(status=status, body=body, headers=headers)
+        self.stall_downloads -= 1
+        headers["Content-Length"] = str(len(body))
+        res = web.StreamResponse(status=status, headers=headers)
+        await res.prepare(request)
+        await res.write(body[: len(body) // 2])
+        await asyncio.sleep(3600)
+
+    async def thumbnail(self, request: web.Request):
+        if request.match_info["file_id"] not in self.drive.files:
+            raise web.HTTPNotFound()
+        return web.Response(body=_THUMBNAIL, content_type="image/png")
+
+
+async def _serve(args: argparse.Namespace):
+    server = MockAliyunServer(
+        MockDrive(args.depth, args.dirs, args.files),
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=(args.rate, args.burst) if args.rate else None,
+    )
+    url = await server.start(args.host, args.port)
+    print(f"mock aliyun open api on {url}, {len(server.drive.files)} files")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--dirs", type=int, default=10, help="folders per folder")
+    parser.add_argument("--files", type=int, default=100, help="files per folder")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="calls per second, 0 for no limit"
+    )
+    parser.add_argument("--burst", type=int, default=10)
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import asyncio
+import io
+import os
+import tempfile
+import zipfile
+from unittest import IsolatedAsyncioTestCase
+
+from aiohttp import ClientResponseError, ClientTimeout
+
+from config import (
+    AliyunCacheConfig,
+    AliyunConfig,
+    AliyunHttpConfig,
+    RateLimitConfig,
+)
+from store.aliyun import AliyunStore
+from store.aliyun._crawler import DriveCrawler
+from store.archive import stream_zip
+from store.base import SearchQuery
+from store.utils import UploadBuffer
+
+from .mock_server import MockAliyunServer, MockDrive, TokenBucket
+
+
+class _MockServerTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.server = MockAliyunServer(MockDrive(2, 3, 120))
+        url = await self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cfg = cfg = AliyunConfig(
+            refresh_token="mock-refresh-" + "0" * 20,
+            client_id="id",
+            client_secret="secret",
+            http=AliyunHttpConfig(
+                base_url=url, rate_limit=RateLimitConfig(rate=1000, burst=1000)
+            ),
+            cache=AliyunCacheConfig(index_path=":memory:", thumbnail_dir=self.tmp.name),
+        )
+        self.store, self.dispose = await AliyunStore.spawn(cfg)
+
+    async def asyncTearDown(self) -> None:
+        await self.dispose()
+        await self.server.close()
+        self.tmp.cleanup()
+
+
+class TestStoreOnMockServer(_MockServerTestCase):
+    async def test_browse(self):
+        root = await self.store.listdir("/root")
+        self.assertEqual(len(root), 123)
+        # every next_marker page walked, 100 entries per page
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/list"], 2)
+        sub = await self.store.listdir("/root/dir001/dir002")
+        self.assertEqual(len(sub), 120)
+        path = str(sub[0])
+        self.assertEqual(str(await self.store.get_file_item_by_path(path)), path)
+        stream = await self.store.open_file(path, 10, 20)
+        async with stream:
+            data = await stream.read()
+        item = self.server.drive.files[sub[0].file_item.file_id]
+        self.assertEqual(data, self.server.drive.content(item.file_id)[10:30])
+
+    async def test_throttled(self):
+        self.server.bucket = TokenBucket(50, 1)
+        paths = [f"/root/dir{i:03}" for i in range(3)]
+        found = await asyncio.gather(*map(self.store.get_file_item_by_path, paths))
+        self.assertEqual([str(it) for it in found], paths)
+        # TooManyRequests answers were retried by the session
+        self.assertGreater(self.server.throttled, 0)
+        self.assertEqual(self.store.stats()["http"]["retries"], self.server.throttled)
+
+    async def test_resolve_paths(self):
+        await self.store.listdir("/root/dir001")
+        calls = sum(self.server.calls.values())
+        names = [str(it) for it in await self.store.listdir("/root/dir001/dir000")]
+        paths = [*names, "/root/dir001/dir000/missing.jpg", "/root/dir001/dir002/"]
+        ids = await self.store.resolve_paths(paths)
+        # only listing dir000 and looking up the missing file went to the api
+        self.assertEqual(sum(self.server.calls.values()) - calls, 3)
+        self.assertEqual(len(ids), len(names) + 1)
+        self.assertEqual(
+            ids["/root/dir001/dir002/"],
+            self.server.drive.by_path["/dir001/dir002"],
+        )
+        self.assertEqual(
+            await self.store.get_file_id_by_path(names[-1]), ids[names[-1]]
+        )
+
+    async def test_listing_revalidated(self):
+        def names(listing) -> set[str]:
+            return {it.name for it in listing}
+
+        await self.store.listdir("/root/dir000")
+        lists = self.server.calls["/adrive/v1.0/openFile/list"]
+        await self.store.listdir("/root/dir000")
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/list"], lists)
+
+        dir_id = self.server.drive.by_path["/dir000"]
+        self.server.drive.add(dir_id, "new.jpg", b"new")
+        # stale, served as is while one refresh reloads it
+        self.store.listing_cache.fresh_ttl = 0
+        self.server.latency = 0.05
+        self.assertNotIn("new.jpg", names(await self.store.listdir("/root/dir000")))
+        self.assertNotIn("new.jpg", names(await self.store.listdir("/root/dir000")))
+        self.store.listing_cache.fresh_ttl = self.cfg.cache.listing_fresh_ttl
+        for _ in range(100):
+            cached = self.store.listing_cache.get_cached(dir_id)
+            if cached is not None and "new.jpg" in names(cached):
+                break
+            await asyncio.sleep(0.02)
+        self.assertIn("new.jpg", names(await self.store.listdir("/root/dir000")))
+        # 124 entries, two pages of one refresh
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/list"], lists + 2)
+
+    async def test_coalesced(self):
+        files = [it for it in await self.store.listdir("/root/dir000") if it.is_file()]
+        file_id = files[0].file_item.file_id
+        self.server.latency = 0.05
+        merged = self.store.single_flight.merged_total
+        urls = await asyncio.gather(
+            *(self.store.get_download_url_by_file_id(file_id) for _ in range(5))
+        )
+        self.assertEqual(len(set(urls)), 1)
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/getDownloadUrl"], 1)
+
+        lists = self.server.calls["/adrive/v1.0/openFile/list"]
+        listings = await asyncio.gather(
+            *(self.store.listdir("/root/dir001") for _ in range(5))
+        )
+        self.assertTrue(all(it == listings[0] for it in listings))
+        # the two pages of dir001 once, /root was listed already
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/list"], lists + 2)
+        self.assertEqual(self.store.single_flight.merged_total, merged + 8)
+
+    async def test_download_url_margin(self):
+        files = [it for it in await self.store.listdir("/root/dir000") if it.is_file()]
+        margin = self.cfg.cache.download_url_margin
+        self.server.download_url_ttl = round(margin) + 60
+        url = await self.store.get_download_url_by_file_id(files[0].file_item.file_id)
+        self.assertEqual(
+            await self.store.get_download_url_by_file_id(files[0].file_item.file_id),
+            url,
+        )
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/getDownloadUrl"], 1)
+
+        # expiring within the margin, never served from the cache
+        self.server.download_url_ttl = round(margin) - 1
+        await self.store.get_download_url_by_file_id(files[1].file_item.file_id)
+        await self.store.get_download_url_by_file_id(files[1].file_item.file_id)
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/getDownloadUrl"], 3)
+
+    async def test_get_file_items_by_ids(self):
+        drive = self.server.drive
+        files = [it.file_id for it in drive.files.values() if it.type == "file"]
+        # spread over many dirs, missing ones in between, one id twice
+        ids = files[::3][:230]
+        ids[10:10] = ["missing-1"]
+        ids[150:150] = ["missing-2", ids[0]]
+        found = await self.store.get_file_items_by_ids(ids)
+        # 232 distinct ids, 100 per call
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/batch/get"], 3)
+        expected = [it for it in dict.fromkeys(ids) if not it.startswith("missing")]
+        self.assertEqual(list(found), expected)
+        for file_id, path in found.items():
+            self.assertEqual(path.as_posix(), "/root" + drive.files[file_id].path)
+
+    async def test_search_remote(self):
+        found, _ = await self.store.search(SearchQuery(name="IMG_000000", limit=100))
+        self.assertEqual(len(found), 10)
+        self.assertTrue(all("IMG_000000" in str(it) for it in found))
+
+
+class TestEditOnMockServer(_MockServerTestCase):
+    async def names(self, path: str) -> list[str]:
+        return [it.name for it in await self.store.listdir(path)]
+
+    async def test_mkdir(self):
+        self.assertNotIn("new", await self.names("/root/dir000"))
+        await self.store.mkdir("/root/dir000/new")
+        self.assertIn("new", await self.names("/root/dir000"))
+        file_id = self.server.drive.by_path["/dir000/new"]
+        self.assertEqual(self.store.path_ids.get("/root/dir000/new"), file_id)
+        self.assertEqual(
+            self.store.file_index.get_id_by_path("/root/dir000/new", 60), file_id
+        )
+        with self.assertRaises(FileExistsError):
+            await self.store.mkdir("/root/dir000/new")
+        with self.assertRaises(FileNotFoundError):
+            await self.store.mkdir("/root/missing/new")
+
+    async def test_rmfile(self):
+        drive = self.server.drive
+        under = [
+            f"/root/dir000/dir001/{it}"
+            for it in await self.names("/root/dir000/dir001")
+        ]
+        await self.store.resolve_paths(under)
+        await self.store.rmfile("/root/dir000/dir001")
+        self.assertNotIn("/dir000/dir001", drive.by_path)
+        self.assertNotIn("dir001", await self.names("/root/dir000"))
+        for it in ("/root/dir000/dir001", *under):
+            self.assertIsNone(self.store.path_ids.get(it))
+            self.assertIsNone(self.store.file_index.get_id_by_path(it, 60))
+        with self.assertRaises(FileNotFoundError):
+            await self.store.rmfile("/root/dir000/dir001")
+
+    async def test_rename(self):
+        drive = self.server.drive
+        old = "/root/dir000/dir001"
+        under = await self.names(old)
+        file_id = await self.store.get_file_id_by_path(f"{old}/{under[0]}")
+        await self.store.rename(old, "moved")
+        self.assertIn("moved", await self.names("/root/dir000"))
+        self.assertNotIn("dir001", await self.names("/root/dir000"))
+        self.assertIsNone(self.store.path_ids.get(f"{old}/{under[0]}"))
+        self.assertIsNone(self.store.file_index.get_id_by_path(f"{old}/{under[0]}", 60))
+        new = f"/root/dir000/moved/{under[0]}"
+        self.assertEqual(await self.store.get_file_id_by_path(new), file_id)
+        self.assertEqual(drive.by_path[new.removeprefix("/root")], file_id)
+        with self.assertRaises(FileExistsError):
+            await self.store.rename("/root/dir000/moved", "dir002")
+        self.assertIn("moved", await self.names("/root/dir000"))
+        with self.assertRaises(FileNotFoundError):
+            await self.store.rename(old, "again")
+
+
+class TestCrawlerOnMockServer(_MockServerTestCase):
+    async def test_failures(self):
+        crawler = DriveCrawler(self.store)
+        self.server.fail_lists.add(self.server.drive.by_path["/dir001"])
+        await crawler.crawl()
+        self.assertEqual(crawler.errors, 1)
+        self.assertIsNone(crawler.last_finished_at)
+        self.assertEqual(len(self.store.file_index.load_crawl_queue()), 1)
+
+        # the failed dir is retried, then the drive is crawled again from the root
+        self.server.fail_lists.clear()
+        listed = crawler.dirs_listed
+        await crawler.crawl()
+        self.assertEqual(crawler.crawls, 1)
+        self.assertIsNotNone(crawler.last_finished_at)
+        self.assertEqual(self.store.file_index.load_crawl_queue(), [])
+        self.assertGreater(crawler.dirs_listed - listed, 1)
+
+    async def test_deleted_dir(self):
+        crawler = DriveCrawler(self.store)
+        self.store.file_index.crawl_step(None, [("gone", "/root/gone", None)])
+        await crawler.crawl()
+        self.assertEqual(crawler.errors, 0)
+        self.assertEqual(crawler.crawls, 1)
+
+
+class TestTokensOnMockServer(_MockServerTestCase):
+    async def test_saved(self):
+        saved = []
+        token = self.cfg.refresh_token
+        await self.store._refresh_token()
+        self.assertNotEqual(self.store.refresh_token, token)
+        # spawned without a callback, the config still follows the store
+        self.assertEqual(self.cfg.refresh_token, self.store.refresh_token)
+
+        # the access token of the config is still valid, no refresh at startup
+        refreshes = self.server.calls["/oauth/access_token"]
+        store, dispose = await AliyunStore.spawn(self.cfg, lambda: saved.append(1))
+        try:
+            self.assertEqual(self.server.calls["/oauth/access_token"], refreshes)
+            self.assertEqual(store.access_token, self.cfg.access_token)
+            await store._refresh_token()
+            self.assertEqual(len(saved), 1)
+            self.assertEqual(self.cfg.refresh_token, store.refresh_token)
+            self.assertEqual(
+                self.cfg.access_token_expires_at, store.access_token_expires_at
+            )
+        finally:
+            await dispose()
+
+
+class TestUploadOnMockServer(_MockServerTestCase):
+    def buffer(self, content: bytes) -> UploadBuffer:
+        buf = UploadBuffer(max_memory=100 * 1024, dir=self.tmp.name)
+        for i in range(0, len(content), 4096):
+            buf.write(content[i : i + 4096])
+        return buf
+
+    async def test_upload(self):
+        self.store.upload_part_size = 64 * 1024
+        content = bytes(range(256)) * 1000
+        with self.buffer(content) as buf:
+            self.assertTrue(buf.spooled)
+            res = await self.store.upload("/root/dir000", "a.bin", buf)
+        self.assertFalse(res.rapid_upload)
+        self.assertEqual(res.bytes_sent, len(content))
+        self.assertEqual(self.server.drive.content(res.path.file_item.file_id), content)
+        names = [it.name for it in await self.store.listdir("/root/dir000")]
+        self.assertIn("a.bin", names)
+
+        # the drive has the content, nothing is sent
+        with self.buffer(content) as buf:
+            res = await self.store.upload("/root/dir000", "a.bin", buf)
+        self.assertTrue(res.rapid_upload)
+        self.assertEqual(str(res.path), "/root/dir000/a(1).bin")
+        with self.buffer(content) as buf:
+            with self.assertRaises(FileExistsError):
+                await self.store.upload("/root/dir000", "a.bin", buf, "refuse")
+
+    async def test_resume(self):
+        self.store.upload_part_size = 64 * 1024
+        self.store.upload_concurrency = 1
+        content = os.urandom(300 * 1024)
+        self.server.fail_part_puts = 1
+        with self.buffer(content) as buf:
+            with self.assertRaises(ClientResponseError):
+                await self.store.upload("/root", "b.bin", buf)
+            # part 1 is lost, the urls of the others expired meanwhile
+            self.server.upload_url_version += 1
+            res = await self.store.upload("/root", "b.bin", buf)
+        self.assertEqual(self.store.resumed_uploads, 1)
+        self.assertEqual(str(res.path), "/root/b.bin")
+        self.assertEqual(self.server.drive.content(res.path.file_item.file_id), content)
+
+
+class TestDownloadOnMockServer(_MockServerTestCase):
+    async def test_segmented(self):
+        content = os.urandom(1024 * 1024 + 1000)
+        self.server.drive.add("root", "big.bin", content)
+        self.store.download_segmented_min_size = 256 * 1024
+        self.store.download_segment_size = 100 * 1024
+        self.store.stream_chunk_size = 32 * 1024
+
+        stream = await self.store.open_file("/root/big.bin", 1000)
+        async with stream:
+            head = await stream.read(50 * 1024)
+            # the url expires mid-transfer and is renewed once for all connections
+            self.server.download_url_version += 1
+            data = head + await stream.read()
+        self.assertEqual(data, content[1000:])
+        self.assertEqual(self.store.segmented_downloads, 1)
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/getDownloadUrl"], 2)
+
+        dest = os.path.join(self.tmp.name, "big.bin")
+        self.assertEqual(await self.store.download("/root/big.bin", dest), len(content))
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse(os.path.exists(dest + ".part"))
+
+    async def test_stalled(self):
+        content = os.urandom(300 * 1024)
+        self.server.drive.add("root", "a.bin", content)
+        self.store.transfer_timeout = ClientTimeout(total=None, sock_read=0.2)
+        self.server.stall_downloads = 1
+        async with await self.store.open_file("/root/a.bin") as stream:
+            self.assertEqual(await stream.read(), content)
+        # resumed with the same url
+        self.assertEqual(self.server.download_requests, 2)
+        self.assertEqual(self.server.calls["/adrive/v1.0/openFile/getDownloadUrl"], 1)
+
+        self.store.download_segmented_min_size = 100 * 1024
+        self.store.download_segment_size = 64 * 1024
+        self.server.stall_downloads = 2
+        async with await self.store.open_file("/root/a.bin") as stream:
+            self.assertEqual(await stream.read(), content)
+
+    async def test_archive(self):
+        drive = self.server.drive
+        sub = drive.add(drive.by_path["/dir000/dir002"], "sub")
+        drive.add(sub.file_id, "a.bin", b"abc")
+        paths = ["/root/dir000/dir002", "/root/dir001/dir002"]
+        roots = [await self.store.get_file_item_by_path(it) for it in paths]
+        data = b"".join([it async for it in stream_zip(self.store, roots, 2)])
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            names = zf.namelist()
+            self.assertEqual(len(names), 2 * 120 + 1)
+            self.assertEqual(zf.read("dir002/sub/a.bin"), b"abc")
+            self.assertEqual(len(set(names)), len(names))
+            name = names[-1]
+            self.assertTrue(name.startswith("dir002 (1)/"))
+            file_id = drive.by_path[name.replace("dir002 (1)", "/dir001/dir002")]
+            self.assertEqual(zf.read(name), drive.content(file_id))
+
+        # none read into memory, the next two opened ahead
+        opened = b"".join([it async for it in stream_zip(self.store, roots, 4, 0)])
+        with zipfile.ZipFile(io.BytesIO(opened)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), names)
+            self.assertEqual(zf.read("dir002/sub/a.bin"), b"abc")
+
+        self.server.download_requests = 0
+        it = aiter(stream_zip(self.store, roots, 4, 0, 2))
+        await anext(it)
+        await asyncio.sleep(0.05)
+        # the file being copied and the two after it
+        self.assertEqual(self.server.download_requests, 3)
+        await it.aclose()
+
+        # every file opened in turn, none prefetched
+        lazy = b"".join([it async for it in stream_zip(self.store, roots, 2, 0, 0)])
+        with zipfile.ZipFile(io.BytesIO(lazy)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), names)
+            self.assertEqual(zf.read("dir002/sub/a.bin"), b"abc")
@@ -0,0 +1,41 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from store.backend.aliyun.ratelimit import (
+    TokenBucket,
+    with_priority,
+    REQUEST_PRIORITY,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+)
+
+
+class TestTokenBucket(IsolatedAsyncioTestCase):
+    async def test_priority_order(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        await bucket.acquire()
+        order = []
+
+        async def acquire(name: str, priority: int):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        waiters = [
+            asyncio.create_task(acquire("background", PRIORITY_BACKGROUND)),
+            asyncio.create_task(acquire("interactive", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.gather(*waiters)
+        assert order == ["interactive", "background"]
+
+    async def test_pause(self):
+        bucket = TokenBucket(rate=1000, burst=10)
+        bucket.pause(0.05)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await bucket.acquire()
+        assert loop.time() - start >= 0.04
+
+    def test_with_priority(self):
+        with with_priority(PRIORITY_BACKGROUND):
+            assert REQUEST_PRIORITY.get() == PRIORITY_BACKGROUND
+        assert REQUEST_PRIORITY.get() == PRIORITY_INTERACTIVE
@@ -1,19 +1,19 @@
-from aiohttp.client import request
-
 from typing import Optional
 
-from store.backend.aliyun.base import BASE_URL
-
-from .base import BASE_URL, AccessToken
+from .base import AccessToken, _api_request
+from .exception import handle_error_status
+from .session import ApiSession
 
 
 async def acquire_token_by_code(
     code: str,
     client_id: str,
     client_secret: str,
+    *,
+    session: Optional[ApiSession] = None,
 ) -> AccessToken:
     return await _acquire_access_token(
-        code=code, client_id=client_id, client_secret=client_secret
+        code=code, client_id=client_id, client_secret=client_secret, session=session
     )
 
 
@@ -21,9 +21,14 @@ async def acquire_token_by_refresh_token(
     refresh_token: str,
     client_id: str,
     client_secret: str,
+    *,
+    session: Optional[ApiSession] = None,
 ) -> AccessToken:
     return await _acquire_access_token(
-        refresh_token=refresh_token, client_id=client_id, client_secret=client_secret
+        refresh_token=refresh_token,
+        client_id=client_id,
+        client_secret=client_secret,
+        session=session,
     )
 
 
@@ -33,6 +38,7 @@ async def _acquire_access_token(
     *,
     client_id: str,
     client_secret: str | None = None,
+    session: Optional[ApiSession] = None,
 ) -> AccessToken:
     body = {
         "client_id": client_id,
@@ -45,8 +51,12 @@ async def _acquire_access_token(
     else:
         raise ValueError("code and refresh token can not be both none")
 
-    async with request(
-        "POST", BASE_URL.format("/oauth/access_token"), json=body
+    async with _api_request(
+        session,
+        "POST",
+        "/oauth/access_token",
+        json=body,
+        raise_for_status=handle_error_status,  # type: ignore
     ) as response:
         res_json = await response.json()
         return AccessToken.model_validate(res_json)
@@ -0,0 +1,184 @@
+import base64
+import hashlib
+from typing import Literal, Optional
+
+from aiohttp import ClientSession, ClientTimeout
+from pydantic import BaseModel
+
+from .base import FileItem, _api_request, _gen_header, AccessTokenType
+from .exception import handle_error_status
+from .session import ApiSession
+
+# the drive takes at most this many parts per upload
+MAX_PART_COUNT = 10000
+
+
+class UploadPartInfo(BaseModel):
+    part_number: int
+    upload_url: Optional[str] = None
+    part_size: Optional[int] = None
+    etag: Optional[str] = None
+
+
+class _CreateUploadResp(BaseModel):
+    drive_id: str
+    file_id: str
+    file_name: str
+    upload_id: Optional[str] = None
+    rapid_upload: bool = False
+    exist: Optional[bool] = None
+    part_info_list: list[UploadPartInfo] = []
+
+
+def proof_offset(access_token: str, size: int) -> int:
+    """offset of the 8 bytes that prove owning the content of a rapid upload (proof_version v1)"""
+    if size == 0:
+        return 0
+    digest = hashlib.md5(access_token.encode()).hexdigest()
+    return int(digest[:16], 16) % size
+
+
+def proof_code(data: bytes) -> str:
+    """:param data: the bytes at `proof_offset`, up to 8 of them"""
+    return base64.b64encode(data[:8]).decode()
+
+
+async def create_file(
+    access_token: AccessTokenType,
+    drive_id: str,
+    parent_file_id: str,
+    name: str,
+    size: int,
+    part_count: int,
+    content_hash: Optional[str] = None,
+    proof: Optional[str] = None,
+    check_name_mode: Literal["auto_rename", "refuse", "ignore"] = "auto_rename",
+    *,
+    session: Optional[ApiSession] = None,
+) -> _CreateUploadResp:
+    """start an upload, with `content_hash` (sha1) and `proof` the drive may finish it as a rapid upload"""
+    body = {
+        "drive_id": drive_id,
+        "parent_file_id": parent_file_id,
+        "name": name,
+        "type": "file",
+        "check_name_mode": check_name_mode,
+        "size": size,
+        "part_info_list": [{"part_number": i} for i in range(1, part_count + 1)],
+    }
+    if content_hash is not None:
+        body.update(
+            content_hash=content_hash,
+            content_hash_name="sha1",
+            proof_code=proof,
+            proof_version="v1",
+        )
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/create",
+        json=body,
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ) as resp:
+        data = await resp.json()
+        return _CreateUploadResp.model_validate(data)
+
+
+async def get_upload_url(
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_id: str,
+    upload_id: str,
+    part_numbers: list[int],
+    *,
+    session: Optional[ApiSession] = None,
+) -> list[UploadPartInfo]:
+    """fresh signed urls of the parts, the ones from `create_file` expire"""
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/getUploadUrl",
+        json={
+            "drive_id": drive_id,
+            "file_id": file_id,
+            "upload_id": upload_id,
+            "part_info_list": [{"part_number": it} for it in part_numbers],
+        },
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ) as resp:
+        data = await resp.json()
+        return [UploadPartInfo.model_validate(it) for it in data["part_info_list"]]
+
+
+async def list_uploaded_parts(
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_id: str,
+    upload_id: str,
+    *,
+    session: Optional[ApiSession] = None,
+) -> list[UploadPartInfo]:
+    parts: list[UploadPartInfo] = []
+    marker = None
+    while True:
+        body = {"drive_id": drive_id, "file_id": file_id, "upload_id": upload_id}
+        if marker:
+            body["part_number_marker"] = marker
+        async with _api_request(
+            session,
+            "POST",
+            "/adrive/v1.0/openFile/listUploadedParts",
+            json=body,
+            headers=_gen_header(access_token),
+            raise_for_status=handle_error_status,  # type: ignore
+        ) as resp:
+            data = await resp.json()
+        parts.extend(
+            UploadPartInfo.model_validate(it) for it in data.get("uploaded_parts") or ()
+        )
+        marker = data.get("next_part_number_marker")
+        if not marker:
+            return parts
+
+
+async def complete_upload(
+    access_token: AccessTokenType,
+    drive_id: str,
+    file_id: str,
+    upload_id: str,
+    *,
+    session: Optional[ApiSession] = None,
+) -> FileItem:
+    async with _api_request(
+        session,
+        "POST",
+        "/adrive/v1.0/openFile/complete",
+        json={"drive_id": drive_id, "file_id": file_id, "upload_id": upload_id},
+        headers=_gen_header(access_token),
+        raise_for_status=handle_error_status,  # type: ignore
+    ) as resp:
+        data = await resp.json()
+        return FileItem.model_validate(data)
+
+
+async def upload_part(
+    client: ClientSession,
+    url: str,
+    data: bytes,
+    timeout: ClientTimeout = ClientTimeout(total=None, sock_connect=30, sock_read=60),
+) -> None:
+    """put one part to its signed url, an expired url raises ClientResponseError 403
+
+    `timeout` replaces the session's own, a part may take longer than an api call.
+    """
+    # the url is signed without a content type, so none may be sent
+    async with client.put(
+        url,
+        data=data,
+        skip_auto_headers=("Content-Type",),
+        raise_for_status=True,
+        timeout=timeout,
+    ):
+        pass
@@ -7,14 +7,24 @@ from typing import (
     Self,
     Callable,
     Coroutine,
+    AsyncIterator,
+    Any,
+    NamedTuple,
+    TYPE_CHECKING,
 )
 from pathlib import PurePosixPath
-from os import PathLike
+from os import PathLike, fspath
+import asyncio
+import contextlib
+import os
 from datetime import datetime
 
 from pydantic import BaseModel, ConfigDict
 from pydantic.alias_generators import to_camel
 
+if TYPE_CHECKING:
+    from .utils import UploadBuffer
+
 StrPath = str | PathLike[str]
 
 # from pydantic import HttpUrl
@@ -28,10 +38,26 @@ StrPath = str | PathLike[str]
 
 
 class BaseFileIO(Protocol):
-    def __enter__(self):
+    size: Optional[int]
+    offset: int
+    length: Optional[int]
+
+    async def read(self, n: int = -1) -> bytes:
+        raise NotImplementedError
+
+    async def seek(self, offset: int, length: Optional[int] = None):
         raise NotImplementedError
 
-    def close(self):
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    async def __aenter__(self) -> Self:
+        raise NotImplementedError
+
+    async def __aexit__(self, *_):
         raise NotImplementedError
 
 
@@ -74,8 +100,29 @@ EMPTY_DATE = datetime(2000, 1, 1, 0, 0, 0)
 DisposeFunc = Callable[[], None | Coroutine[None, None, None]]
 
 
+class CachedFile(NamedTuple):
+    path: str
+    etag: str
+    media_type: str
+
+
+class TimelineBucket(NamedTuple):
+    # "2024-01-31" for a day bucket, "2024-01" for a month bucket
+    key: str
+    count: int
+
+
+class UploadResult(NamedTuple):
+    path: "BasePath"
+    rapid_upload: bool
+    # bytes sent to the backend, 0 when it already had the content
+    bytes_sent: int
+
+
 class BaseFile(BaseModel):
     model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+    # id of the file in the store, if the store has one
+    id: Optional[str] = None
     name: str
     path: str
     type: FileType
@@ -86,7 +133,30 @@ class BaseFile(BaseModel):
     thumbnail: Optional[Thumbnail] = None
 
 
+class SearchQuery(BaseModel):
+    # words the name must contain, all of them in "contains" mode
+    name: str = ""
+    match: Literal["contains", "prefix", "fuzzy"] = "contains"
+    type: Optional[FileType] = None
+    category: Optional[list[str]] = None
+    extension: Optional[list[str]] = None
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    updated_after: Optional[datetime] = None
+    updated_before: Optional[datetime] = None
+    # only files under this dir
+    under: Optional[str] = None
+    order_by: Literal["name", "size", "created_at", "updated_at", "relevance"] = "name"
+    order_direction: Literal["ASC", "DESC"] = "ASC"
+    limit: int = 100
+    cursor: Optional[str] = None
+
+
 class BasePath(PurePosixPath):
+    __slots__ = ()
+
     def is_file(self) -> bool:
         raise NotImplementedError
 
@@ -99,6 +169,10 @@ class BasePath(PurePosixPath):
     def to_model(self) -> BaseFile:
         raise NotImplementedError
 
+    def to_dict(self) -> dict[str, Any]:
+        """`to_model` dumped by alias, stores override it to skip building the model"""
+        return self.to_model().model_dump(by_alias=True)
+
 
 _T = TypeVar("_T", bound=BasePath)
 
@@ -107,11 +181,70 @@ class BaseStore(Generic[_T]):
     """store abstraction base class"""
 
     async def search_file_by_name(self, file_name: str) -> list[_T]:
+        query = SearchQuery(name=file_name)
+        res: list[_T] = []
+        while True:
+            items, query.cursor = await self.search(query)
+            res.extend(items)
+            if not query.cursor:
+                return res
+
+    async def search(self, query: SearchQuery) -> tuple[list[_T], Optional[str]]:
+        """one page of files matching the query, and the cursor of next page (None if it is the last page)"""
         raise NotImplementedError
 
     async def listdir(self, dir_path: StrPath) -> list[_T]:
         raise NotImplementedError
 
+    async def listdir_page(
+        self, dir_path: StrPath, marker: Optional[str] = None, limit: int = 100
+    ) -> tuple[list[_T], Optional[str]]:
+        """list one page of the dir, return the items and the marker of next page (None if it is the last page)"""
+        raise NotImplementedError
+
+    async def iter_dir(
+        self, dir_path: StrPath, limit: int = 100, marker: Optional[str] = None
+    ) -> AsyncIterator[_T]:
+        """lazily walk all pages of the dir"""
+        while True:
+            items, marker = await self.listdir_page(dir_path, marker, limit)
+            for it in items:
+                yield it
+            if not marker:
+                break
+
+    async def index_complete(self) -> bool:
+        """whether the local index (search, timeline) covers the whole drive, or only the dirs seen so far"""
+        return False
+
+    async def timeline(
+        self,
+        granularity: Literal["day", "month"] = "month",
+        category: Optional[str] = None,
+    ) -> list[TimelineBucket]:
+        """photo and video counts by the date they were taken, newest first"""
+        raise NotImplementedError
+
+    async def timeline_items(
+        self,
+        bucket: str,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        category: Optional[str] = None,
+    ) -> tuple[list[_T], Optional[str]]:
+        """one page of photos and videos in a bucket of `timeline`, newest first"""
+        raise NotImplementedError
+
+    async def get_file_item_by_path(self, path: StrPath) -> _T:
+        """the file or dir at `path`, FileNotFoundError if there is none"""
+        raise NotImplementedError
+
+    async def get_file_items_by_ids(
+        self, file_ids: list[str], concurrency: int = 4
+    ) -> dict[str, _T]:
+        """resolve many file ids at once, ids that do not exist are left out"""
+        raise NotImplementedError
+
     async def mkdir(self, dir_path: StrPath) -> bool:
         raise NotImplementedError
 
@@ -127,17 +260,82 @@ class BaseStore(Generic[_T]):
     async def rmfile(self, path: StrPath) -> bool:
         raise NotImplementedError
 
-    async def open_file(self, path: StrPath) -> BaseFileIO:
+    async def open_file(
+        self, path: StrPath, offset: int = 0, length: Optional[int] = None
+    ) -> BaseFileIO:
+        """open `length` bytes (to the end when None) of the file from `offset` as a stream"""
         raise NotImplementedError
 
+    async def download(self, path: StrPath, dest: StrPath) -> int:
+        """copy the file to the local file `dest`, return the bytes written
+
+        the content goes to a temporary file next to `dest` first, so `dest` is
+        either missing or complete.
+        """
+        tmp = f"{fspath(dest)}.part"
+        written = 0
+        try:
+            async with await self.open_file(path) as stream:
+                with open(tmp, "wb") as f:
+                    async for chunk in stream:
+                        await asyncio.to_thread(f.write, chunk)
+                        written += len(chunk)
+            os.replace(tmp, dest)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+        return written
+
     async def get_download_url(self, path: StrPath) -> str:
         raise NotImplementedError
 
+    async def get_content_key(self, path: StrPath) -> str:
+        """a key of the file content, it changes when the content does. keys caches of data derived from files"""
+        raise NotImplementedError
+
+    async def get_download_urls(
+        self, paths: list[StrPath], concurrency: int = 8
+    ) -> dict[str, str | Exception]:
+        """resolve download urls of many paths concurrently, failed paths map to their exception"""
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _get(path: StrPath) -> str:
+            async with sem:
+                return await self.get_download_url(path)
+
+        res = await asyncio.gather(*map(_get, paths), return_exceptions=True)
+        return {fspath(path): url for path, url in zip(paths, res)}  # type: ignore
+
     async def rename(self, path: StrPath, new_name: str) -> bool:
         raise NotImplementedError
 
+    async def upload(
+        self,
+        dir_path: StrPath,
+        name: str,
+        content: "UploadBuffer",
+        on_conflict: Literal["auto_rename", "refuse", "ignore"] = "auto_rename",
+    ) -> UploadResult:
+        """store `content` as a new file in the dir, FileExistsError when refused for the name"""
+        raise NotImplementedError
+
+    async def get_thumbnail(self, path: StrPath, width: int = 512) -> CachedFile:
+        """thumbnail of the file, kept in a local cache"""
+        raise NotImplementedError
+
+    def start_background_tasks(self):
+        """start long running jobs of the store (indexing etc.), called once after spawn"""
+
+    def stats(self) -> dict[str, Any]:
+        """runtime counters of the store (cache hit/miss etc.)"""
+        return {}
+
     async def dispose(self): ...
 
     @classmethod
-    async def spawn(cls, cfg) -> tuple[Self, DisposeFunc]:
+    async def spawn(
+        cls, cfg, on_config_changed: Optional[Callable[[], None]] = None
+    ) -> tuple[Self, DisposeFunc]:
+        """the store of `cfg`, `on_config_changed` is called to persist it whenever the store updates it"""
         raise NotImplementedError
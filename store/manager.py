@@ -1,10 +1,10 @@
-from typing import Mapping, Type
+from typing import Callable, Mapping, Optional, Type
 from inspect import iscoroutinefunction
 
 from .base import BaseStore, BasePath
 from .aliyun import AliyunStore
 
-from config import global_config
+from config import global_config, save_config, StoreConfig
 
 STORE_NAME_AND_STORE_FACTOR_MAPPING: Mapping[str, Type[BaseStore]] = {
     "aliyun": AliyunStore
@@ -15,16 +15,26 @@ class StoreManager:
     def __init__(self) -> None:
         self._store: BaseStore[BasePath] | None = None
 
-    async def setup(self):
-        await self._init_store()
+    async def setup(self, store_cfg: Optional[StoreConfig] = None):
+        """spawn the store of `store_cfg`, the global config by default"""
+        # rotated tokens are written back only to the config file they came from
+        if store_cfg is None:
+            await self._init_store(global_config.store, save_config)
+        else:
+            await self._init_store(store_cfg)
+        self.store.start_background_tasks()
 
-    async def _init_store(self):
-        store_use = global_config.store.use
+    async def _init_store(
+        self, cfg: StoreConfig, on_config_changed: Optional[Callable[[], None]] = None
+    ):
+        store_use = cfg.use
         if store_use not in STORE_NAME_AND_STORE_FACTOR_MAPPING:
             raise NotImplementedError
-        store_cfg = getattr(global_config.store, store_use)
+        store_cfg = getattr(cfg, store_use)
         factor = STORE_NAME_AND_STORE_FACTOR_MAPPING[store_use]
-        self._store, self._store_dispose_func = await factor.spawn(store_cfg)
+        self._store, self._store_dispose_func = await factor.spawn(
+            store_cfg, on_config_changed
+        )
 
     @property
     def store(self):
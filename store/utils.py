@@ -1 +1,83 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from typing import IO, Optional
+
 from .base import StrPath
+
+_MAGIC_AND_MEDIA_TYPE = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def sniff_image_type(head: bytes, default: str = "application/octet-stream") -> str:
+    """guess the media type of image bytes from their magic number"""
+    for magic, media_type in _MAGIC_AND_MEDIA_TYPE:
+        if head.startswith(magic):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypavif", b"ftypheic", b"ftypmif1"):
+        return "image/avif" if head[8:12] == b"avif" else "image/heic"
+    return default
+
+
+class UploadBuffer:
+    """content of an upload, kept in memory up to `max_memory` bytes and spooled to a temp file past that
+
+    the sha1 is computed as chunks are written, so it is ready once the body is in.
+    """
+
+    def __init__(self, max_memory: int = 16 * 1024 * 1024, dir: Optional[str] = None):
+        self.max_memory = max_memory
+        self.dir = dir
+        self.size = 0
+        self._memory: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[IO[bytes]] = None
+        self._sha1 = hashlib.sha1()
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    @property
+    def content_hash(self) -> str:
+        """upper case hex sha1 of the content written so far"""
+        return self._sha1.hexdigest().upper()
+
+    def write(self, chunk: bytes):
+        self._sha1.update(chunk)
+        self.size += len(chunk)
+        if self._memory is not None:
+            self._memory.write(chunk)
+            if self.size <= self.max_memory:
+                return
+            self._file = tempfile.TemporaryFile(dir=self.dir)
+            self._file.write(self._memory.getbuffer())
+            self._memory = None
+        else:
+            assert self._file is not None
+            self._file.write(chunk)
+
+    async def read_at(self, offset: int, n: int) -> bytes:
+        if self._memory is not None:
+            return self._memory.getbuffer()[offset : offset + n].tobytes()
+        assert self._file is not None
+        self._file.flush()
+        return await asyncio.to_thread(os.pread, self._file.fileno(), n, offset)
+
+    def close(self):
+        self._memory = None
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -11,6 +11,28 @@ from typing import (
 )
 from cachetools import TTLCache
 
+from ._swr_cache import SWRCache
+from ._single_flight import SingleFlight
+from ._disk_cache import DiskLRUCache
+from ._path_trie import PathTrie
+from ._metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricFamily,
+    MetricsRegistry,
+    Sample,
+    REGISTRY,
+)
+from ._tracing import (
+    Span,
+    JsonLinesExporter,
+    Tracer,
+    current_span,
+    traced,
+    tracer,
+)
+
 _KT = TypeVar("_KT", bound=Hashable)
 _KV = TypeVar("_KV", bound=Hashable)
 
@@ -42,6 +64,10 @@ class bidict(Generic[_KT, _KV], MutableMapping[_KT, _KV]):
             ival: ikey for ikey, ival in self.frozen_key_to_val_mapping.items()
         }
 
+        # lookups through by_key / by_val
+        self.hits = 0
+        self.misses = 0
+
     def keys(self) -> KeysView[_KT]:
         return self.key_to_value.keys()
 
@@ -69,10 +95,20 @@ class bidict(Generic[_KT, _KV], MutableMapping[_KT, _KV]):
         return iter(self.key_to_value)
 
     def by_key(self, key: _KT, default: Optional[_KV] = None) -> Optional[_KV]:
-        return self.key_to_value.get(key, None)
+        return self._count(self.key_to_value.get(key, None))
 
     def by_val(self, val: _KV, default: Optional[_KT] = None) -> Optional[_KT]:
-        return self.value_to_key.get(val, None)
+        return self._count(self.value_to_key.get(val, None))
+
+    def _count(self, res):
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return res
+
+    def stats(self) -> dict[str, int]:
+        return {"count": len(self), "hits": self.hits, "misses": self.misses}
 
     def exist_val(self, val: _KV) -> bool:
         return val in self.value_to_key
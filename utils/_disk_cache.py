@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional
+
+
+class DiskLRUCache:
+    """size bounded lru cache of files in a directory
+
+    the lru order is rebuilt from file access times the first time the cache is used,
+    so the cache survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: Optional[OrderedDict[str, int]] = None
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def entries(self) -> OrderedDict[str, int]:
+        if self._entries is None:
+            os.makedirs(self.directory, exist_ok=True)
+            found: list[tuple[float, str, int]] = []
+            for it in os.scandir(self.directory):
+                if not it.is_file():
+                    continue
+                if it.name.endswith(".tmp"):
+                    # left over by an interrupted write
+                    os.unlink(it.path)
+                    continue
+                stat = it.stat()
+                found.append((stat.st_atime, it.name, stat.st_size))
+            found.sort()
+            self._entries = OrderedDict((name, size) for _, name, size in found)
+            self._size = sum(self._entries.values())
+        return self._entries
+
+    def _name(self, key: str) -> str:
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """path of the cached file, or None"""
+        name = self._name(key)
+        if name not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            self._size -= self.entries.pop(name)
+            return None
+        return path
+
+    @contextmanager
+    def writer(self, key: str) -> Iterator[BinaryIO]:
+        """write a new entry, it becomes visible only when the block exits without error"""
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.entries  # make sure the directory exists
+        try:
+            with open(tmp_path, "wb") as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        size = os.path.getsize(path)
+        self._size += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+        self._evict()
+
+    def remove(self, key: str):
+        name = self._name(key)
+        if name in self.entries:
+            self._size -= self.entries.pop(name)
+            os.unlink(os.path.join(self.directory, name))
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "count": len(self.entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
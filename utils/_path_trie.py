@@ -0,0 +1,180 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Iterator, Optional, TypeVar
+
+_V = TypeVar("_V")
+
+
+def _segments(path: str) -> list[str]:
+    return [it for it in path.split("/") if it]
+
+
+class _Node(Generic[_V]):
+    __slots__ = ("children", "value", "expires_at", "parent", "name")
+
+    def __init__(self, parent: Optional["_Node[_V]"] = None, name: str = "") -> None:
+        self.children: dict[str, "_Node[_V]"] = {}
+        self.value: Optional[_V] = None
+        self.expires_at = 0.0
+        # the name is the key of the node in its parent, no full path is kept
+        self.parent = parent
+        self.name = name
+
+
+class PathTrie(Generic[_V]):
+    """values keyed by posix paths, stored by segment so the deepest stored ancestor of a path is one walk away
+
+    at most `maxsize` values are kept, the least recently used go first, and each
+    one expires `ttl` seconds after it was set. nodes link to their parent, the
+    path of a node is only built when it is asked for.
+
+    values are unique (eg: file ids) and map back to their path, setting a value
+    stored at another path moves it.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._root: _Node[_V] = _Node()
+        # nodes holding a value in lru order
+        self._lru: OrderedDict[_Node[_V], None] = OrderedDict()
+        self._nodes: dict[_V, _Node[_V]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def __setitem__(self, path: str, value: _V):
+        # before the walk, dropping it may prune the nodes on the way
+        moved_from = self._nodes.get(value)
+        if moved_from is not None:
+            self._drop(moved_from)
+        node = self._root
+        for it in _segments(path):
+            child = node.children.get(it)
+            if child is None:
+                child = node.children[it] = _Node(node, it)
+            node = child
+        if node.value is not None and self._nodes.get(node.value) is node:
+            del self._nodes[node.value]
+        node.value = value
+        node.expires_at = self._timer() + self.ttl
+        self._nodes[value] = node
+        self._lru[node] = None
+        self._lru.move_to_end(node)
+        while len(self._lru) > self.maxsize:
+            self._drop(next(iter(self._lru)))
+
+    def get(self, path: str) -> Optional[_V]:
+        found = self.longest_prefix(path)
+        if found is None or found[0] != "/" + "/".join(_segments(path)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return found[1]
+
+    def path_of(self, value: _V) -> Optional[str]:
+        """the path `value` is stored at, None if it is not or expired"""
+        node = self._nodes.get(value)
+        if node is not None and node.expires_at <= self._timer():
+            self._drop(node)
+            node = None
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._lru.move_to_end(node)
+        return self._path(node)
+
+    def longest_prefix(self, path: str) -> Optional[tuple[str, _V]]:
+        """(path, value) of the deepest stored path that is `path` or one of its ancestors"""
+        now = self._timer()
+        segments = _segments(path)
+        node = self._root
+        found: Optional[tuple[int, _Node[_V]]] = None
+        expired = []
+        for depth in range(len(segments) + 1):
+            if node.value is not None:
+                if node.expires_at > now:
+                    found = (depth, node)
+                else:
+                    expired.append(node)
+            if depth == len(segments):
+                break
+            child = node.children.get(segments[depth])
+            if child is None:
+                break
+            node = child
+        for it in expired:
+            self._drop(it)
+        if found is None:
+            return None
+        depth, node = found
+        self._lru.move_to_end(node)
+        assert node.value is not None
+        return "/" + "/".join(segments[:depth]), node.value
+
+    def pop_tree(self, path: str) -> list[_V]:
+        """drop the value of `path` and of every path under it, return the dropped values"""
+        node = self._root
+        for it in _segments(path):
+            child = node.children.get(it)
+            if child is None:
+                return []
+            node = child
+        dropped = []
+        for it in self._walk(node):
+            assert it.value is not None
+            self._lru.pop(it, None)
+            if self._nodes.get(it.value) is it:
+                del self._nodes[it.value]
+            dropped.append(it.value)
+        if node.parent is None:
+            self._root = _Node()
+        else:
+            del node.parent.children[node.name]
+            self._prune(node.parent)
+        return dropped
+
+    def clear(self):
+        self._root = _Node()
+        self._lru.clear()
+        self._nodes.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"count": len(self), "hits": self.hits, "misses": self.misses}
+
+    def _path(self, node: _Node[_V]) -> str:
+        names = []
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return "/" + "/".join(reversed(names))
+
+    def _walk(self, node: _Node[_V]) -> Iterator[_Node[_V]]:
+        if node.value is not None:
+            yield node
+        for child in node.children.values():
+            yield from self._walk(child)
+
+    def _drop(self, node: _Node[_V]):
+        """remove the value of the node"""
+        self._lru.pop(node, None)
+        if node.value is not None and self._nodes.get(node.value) is node:
+            del self._nodes[node.value]
+        node.value = None
+        self._prune(node)
+
+    def _prune(self, node: _Node[_V]):
+        """remove `node` and its ancestors while they are empty"""
+        while node.parent is not None and node.value is None and not node.children:
+            del node.parent.children[node.name]
+            node = node.parent
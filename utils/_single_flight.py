@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+from cachetools import LRUCache
+
+_V = TypeVar("_V")
+
+
+class SingleFlight:
+    """concurrent calls with the same key share one in-flight result"""
+
+    def __init__(self, stats_maxsize: int = 1024) -> None:
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        # merged caller count of each key, bounded so rare keys do not pile up
+        self.merged: LRUCache[Hashable, int] = LRUCache(stats_maxsize)
+        self.calls = 0
+        self.merged_total = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[_V]]) -> _V:
+        fut = self._inflight.get(key)
+        if fut is None:
+            self.calls += 1
+            fut = asyncio.ensure_future(func())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.merged_total += 1
+            self.merged[key] = self.merged.get(key, 0) + 1
+        # a cancelled caller must not cancel the call shared with others
+        return await asyncio.shield(fut)
+
+    def _done(self, key: Hashable, fut: asyncio.Future):
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if not fut.cancelled():
+            fut.exception()
+
+    def stats(self, top: int = 20) -> dict[str, Any]:
+        top_keys = sorted(self.merged.items(), key=lambda kv: kv[1], reverse=True)
+        return {
+            "calls": self.calls,
+            "merged": self.merged_total,
+            "inflight": len(self._inflight),
+            "top_merged": {repr(k): v for k, v in top_keys[:top]},
+        }
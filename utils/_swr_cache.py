@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from ._ttl_cache import TTLCache
+
+_KT = TypeVar("_KT", bound=Hashable)
+_KV = TypeVar("_KV")
+
+Loader = Callable[[], Awaitable[_KV]]
+
+
+class SWRCache(Generic[_KT, _KV]):
+    """stale-while-revalidate cache
+
+    a value is fresh for `fresh_ttl` seconds, after that it is still served for
+    another `stale_ttl` seconds while a single background refresh per key reloads it.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        fresh_ttl: float,
+        stale_ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.fresh_ttl = fresh_ttl
+        self._timer = timer
+        self._cache: TTLCache[_KT, tuple[float, _KV]] = TTLCache(
+            maxsize, fresh_ttl + stale_ttl, timer=timer
+        )
+        self._inflight: dict[_KT, asyncio.Task[_KV]] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def get_cached(self, key: _KT, loader: Optional[Loader] = None) -> Optional[_KV]:
+        """return the cached value or None, a stale value schedules a refresh when `loader` is given"""
+        entry = self._cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        fetched_at, value = entry
+        if self._timer() - fetched_at < self.fresh_ttl:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            if loader is not None:
+                self._refresh(key, loader)
+        return value
+
+    async def get(self, key: _KT, loader: Loader) -> _KV:
+        entry = self.get_cached(key, loader)
+        if entry is not None:
+            return entry
+        # concurrent misses of the same key share one load
+        return await asyncio.shield(self._refresh(key, loader))
+
+    def set(self, key: _KT, value: _KV):
+        self._cache[key] = (self._timer(), value)
+
+    def invalidate(self, key: _KT):
+        self._cache.pop(key, None)
+        # an in-flight load started before the invalidation must not write back
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        self._cache.clear()
+        self._inflight.clear()
+
+    def _refresh(self, key: _KT, loader: Loader) -> asyncio.Task[_KV]:
+        task = self._inflight.get(key)
+        if task is not None:
+            return task
+
+        async def _load():
+            try:
+                value = await loader()
+                if self._inflight.get(key) is task:
+                    self.set(key, value)
+                return value
+            except BaseException:
+                self.refresh_errors += 1
+                raise
+            finally:
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+
+        self.refreshes += 1
+        task = asyncio.create_task(_load())
+        # background refreshes are not awaited by anyone, mark their errors retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return task
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,217 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Iterator, Literal, Optional, Protocol
+
+import orjson
+
+SpanKind = Literal["internal", "server", "client"]
+StatusCode = Literal["UNSET", "OK", "ERROR"]
+
+
+class Span:
+    """a timed operation, the api follows opentelemetry's Span"""
+
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_span_id",
+        "name",
+        "kind",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "events",
+        "status",
+        "status_message",
+    )
+    recording = True
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str] = None,
+        kind: SpanKind = "internal",
+        attributes: Optional[dict[str, Any]] = None,
+    ) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.events: list[tuple[str, int, dict[str, Any]]] = []
+        self.status: StatusCode = "UNSET"
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[dict[str, Any]] = None):
+        self.events.append((name, time.time_ns(), attributes or {}))
+
+    def record_exception(self, e: BaseException):
+        self.add_event(
+            "exception",
+            {"exception.type": type(e).__name__, "exception.message": str(e)},
+        )
+
+    def set_status(self, status: StatusCode, message: str = ""):
+        self.status = status
+        self.status_message = message
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    def to_dict(self) -> dict[str, Any]:
+        """field names of the otlp json encoding"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "events": [
+                {"name": name, "timeUnixNano": ts, "attributes": attrs}
+                for name, ts, attrs in self.events
+            ],
+            "status": {"code": self.status, "message": self.status_message},
+        }
+
+
+class _NonRecordingSpan(Span):
+    """span of a trace that is not sampled (or tracing is off), every call is a no-op"""
+
+    __slots__ = ()
+    recording = False
+
+    def __init__(self) -> None:
+        pass
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def add_event(self, name: str, attributes: Optional[dict[str, Any]] = None):
+        pass
+
+    def record_exception(self, e: BaseException):
+        pass
+
+    def set_status(self, status: StatusCode, message: str = ""):
+        pass
+
+    def end(self):
+        pass
+
+
+NON_RECORDING_SPAN = _NonRecordingSpan()
+
+_CURRENT_SPAN = ContextVar[Optional[Span]]("current_span", default=None)
+
+
+def current_span() -> Span:
+    return _CURRENT_SPAN.get() or NON_RECORDING_SPAN
+
+
+class SpanExporter(Protocol):
+    def export(self, span: Span): ...
+
+    def close(self): ...
+
+
+class JsonLinesExporter:
+    """append finished spans to a file, one json object per line"""
+
+    def __init__(self, path: str, flush_every: int = 64) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._file = open(path, "ab")
+        self._flush_every = flush_every
+        self._pending = 0
+
+    def export(self, span: Span):
+        self._file.write(orjson.dumps(span.to_dict()) + b"\n")
+        self._pending += 1
+        if self._pending >= self._flush_every:
+            self._file.flush()
+            self._pending = 0
+
+    def close(self):
+        self._file.close()
+
+
+class Tracer:
+    """creates spans once an exporter is set, until then `span` costs one check"""
+
+    def __init__(self) -> None:
+        self.exporter: Optional[SpanExporter] = None
+        self.sample_ratio = 1.0
+
+    def configure(self, exporter: Optional[SpanExporter], sample_ratio: float = 1.0):
+        if self.exporter is not None:
+            self.exporter.close()
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+
+    @contextmanager
+    def span(
+        self, name: str, kind: SpanKind = "internal", **attributes: Any
+    ) -> Iterator[Span]:
+        """start a span as a child of the current one and make it current"""
+        exporter = self.exporter
+        parent = _CURRENT_SPAN.get()
+        if exporter is None or (parent is not None and not parent.recording):
+            yield NON_RECORDING_SPAN
+            return
+        if parent is None:
+            if random.random() >= self.sample_ratio:
+                # children of an unsampled root are not recorded either
+                token = _CURRENT_SPAN.set(NON_RECORDING_SPAN)
+                try:
+                    yield NON_RECORDING_SPAN
+                finally:
+                    _CURRENT_SPAN.reset(token)
+                return
+            span = Span(name, os.urandom(16).hex(), None, kind, attributes)
+        else:
+            span = Span(name, parent.trace_id, parent.span_id, kind, attributes)
+        token = _CURRENT_SPAN.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status("ERROR", f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _CURRENT_SPAN.reset(token)
+            span.end()
+            exporter.export(span)
+
+
+tracer = Tracer()
+
+
+def traced(name: Optional[str] = None):
+    """run the decorated coroutine function in a span"""
+
+    def decorator(func: Callable):
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            with tracer.span(span_name):
+                return await func(*args, **kwargs)
+
+        return inner
+
+    return decorator
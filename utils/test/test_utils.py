@@ -1,5 +1,20 @@
-from unittest import TestCase
-from utils import bidict
+import asyncio
+from types import SimpleNamespace
+from tempfile import TemporaryDirectory
+from unittest import TestCase, IsolatedAsyncioTestCase
+from utils import (
+    bidict,
+    SWRCache,
+    SingleFlight,
+    DiskLRUCache,
+    PathTrie,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    Tracer,
+    traced,
+    tracer,
+)
 
 
 class TestUtils(TestCase):
@@ -10,3 +25,190 @@ class TestUtils(TestCase):
         assert b_dict.by_val(1) == "a"
         assert "a" in b_dict
         assert b_dict.exist_val(1)
+
+
+class TestSWRCache(IsolatedAsyncioTestCase):
+    async def test_stale_while_revalidate(self):
+        now = [0.0]
+        loads = []
+
+        async def loader():
+            loads.append(now[0])
+            await asyncio.sleep(0)
+            return len(loads)
+
+        cache = SWRCache[str, int](8, fresh_ttl=10, stale_ttl=100, timer=lambda: now[0])
+
+        # concurrent misses share one load
+        res = await asyncio.gather(*(cache.get("a", loader) for _ in range(5)))
+        assert res == [1] * 5
+        assert len(loads) == 1
+
+        assert await cache.get("a", loader) == 1
+        assert cache.hits == 1
+
+        # stale value is served while a single refresh runs in background
+        now[0] = 20
+        assert await cache.get("a", loader) == 1
+        assert await cache.get("a", loader) == 1
+        await asyncio.sleep(0.01)
+        assert len(loads) == 2
+        assert cache.stale_hits == 2
+        assert await cache.get("a", loader) == 2
+
+        cache.invalidate("a")
+        assert cache.get_cached("a") is None
+        assert await cache.get("a", loader) == 3
+
+
+class TestSingleFlight(IsolatedAsyncioTestCase):
+    async def test_merge_concurrent_calls(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        res = await asyncio.gather(*(flight.do("k", func) for _ in range(10)))
+        assert res == [1] * 10
+        assert flight.merged["k"] == 9
+
+        # the key is released once the call finished
+        assert await flight.do("k", func) == 2
+
+
+class TestDiskLRUCache(TestCase):
+    def test_evict_least_recently_used(self):
+        with TemporaryDirectory() as tmp_dir:
+            cache = DiskLRUCache(tmp_dir, max_bytes=25)
+            for key in "abc":
+                with cache.writer(key) as f:
+                    f.write(b"0" * 10)
+            # "a" was evicted to keep the size under max_bytes
+            assert cache.get("a") is None
+            assert cache.get("b") is not None
+            with cache.writer("d") as f:
+                f.write(b"0" * 10)
+            assert cache.get("c") is None
+            assert cache.get("b") is not None
+
+            # entries are reloaded from the directory
+            reloaded = DiskLRUCache(tmp_dir, max_bytes=25)
+            assert reloaded.get("b") is not None
+            assert reloaded.get("d") is not None
+
+
+class TestPathTrie(TestCase):
+    def test_longest_prefix(self):
+        now = [0.0]
+        trie = PathTrie[str](3, ttl=10, timer=lambda: now[0])
+        trie["/root/a"] = "a"
+        trie["/root/a/b/c"] = "c"
+
+        assert trie.get("/root/a/") == "a"
+        assert trie.get("/root/a/b") is None
+        assert trie.longest_prefix("/root/a/b/d/e") == ("/root/a", "a")
+        assert trie.longest_prefix("/root/a/b/c/d") == ("/root/a/b/c", "c")
+        assert trie.longest_prefix("/root/x") is None
+
+        # "/root/a/b/c" was used last, "/root/a" is evicted
+        trie["/root/x"] = "x"
+        trie["/root/y"] = "y"
+        assert trie.get("/root/a") is None
+        assert trie.get("/root/a/b/c") == "c"
+        assert len(trie) == 3
+
+        trie.pop_tree("/root/a")
+        assert trie.longest_prefix("/root/a/b/c") is None
+        assert len(trie) == 2
+
+        now[0] = 11
+        assert trie.get("/root/x") is None
+        assert len(trie) == 1
+
+    def test_path_of(self):
+        trie = PathTrie[str](10, ttl=10)
+        trie["/root/a"] = "a"
+        trie["/root/a/b"] = "b"
+        assert trie.path_of("b") == "/root/a/b"
+        # a value set at another path moves there
+        trie["/root/c"] = "b"
+        assert trie.path_of("b") == "/root/c"
+        assert trie.get("/root/a/b") is None
+        trie["/root/a/d"] = "d"
+        assert sorted(trie.pop_tree("/root/a")) == ["a", "d"]
+        assert trie.path_of("a") is None
+        assert trie.path_of("d") is None
+        assert trie.path_of("b") == "/root/c"
+
+
+class TestMetrics(TestCase):
+    def test_render(self):
+        registry = MetricsRegistry()
+        counter = Counter("calls_total", "calls", ("path",), registry=registry)
+        histogram = Histogram(
+            "latency_seconds", "latency", ("path",), registry=registry, buckets=(0.1, 1)
+        )
+        counter.inc(path="/a")
+        counter.inc(2, path="/a")
+        histogram.observe(0.05, path="/a")
+        histogram.observe(0.5, path="/a")
+        histogram.observe(5, path="/a")
+        lines = registry.render().splitlines()
+        assert "# TYPE calls_total counter" in lines
+        assert 'calls_total{path="/a"} 3' in lines
+        assert 'latency_seconds_bucket{path="/a",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{path="/a",le="1"} 2' in lines
+        assert 'latency_seconds_bucket{path="/a",le="+Inf"} 3' in lines
+        assert 'latency_seconds_count{path="/a"} 3' in lines
+        assert 'latency_seconds_sum{path="/a"} 5.55' in lines
+
+
+class TestTracing(TestCase):
+    def test_span_tree(self):
+        exported = []
+        tracer = Tracer()
+        tracer.configure(SimpleNamespace(export=exported.append, close=lambda: None))
+        with tracer.span("root") as root:
+            with tracer.span("child", answer=42) as child:
+                child.add_event("half way")
+        assert [it.name for it in exported] == ["child", "root"]
+        assert child.trace_id == root.trace_id
+        assert child.parent_span_id == root.span_id
+        assert child.to_dict()["attributes"] == {"answer": 42}
+
+        tracer.configure(None)
+        with tracer.span("off") as span:
+            assert not span.recording
+        assert len(exported) == 2
+
+    def test_error_status(self):
+        exported = []
+        tracer = Tracer()
+        tracer.configure(SimpleNamespace(export=exported.append, close=lambda: None))
+        with self.assertRaises(ValueError):
+            with tracer.span("fail"):
+                raise ValueError("boom")
+        assert exported[0].status == "ERROR"
+        assert exported[0].events[0][0] == "exception"
+
+    def test_traced(self):
+        exported = []
+        tracer.configure(SimpleNamespace(export=exported.append, close=lambda: None))
+
+        @traced("outer")
+        async def outer():
+            return await inner()
+
+        @traced()
+        async def inner():
+            return 42
+
+        try:
+            assert asyncio.run(outer()) == 42
+        finally:
+            tracer.configure(None)
+        assert [it.name for it in exported] == [inner.__qualname__, "outer"]
+        assert exported[0].parent_span_id == exported[1].span_id